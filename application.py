@@ -1,33 +1,150 @@
-from flask import Flask, jsonify, request, render_template
+import functools
+import os
+import threading
+import time
+
+from flask import Flask, jsonify, request, render_template, abort, g
 from forecast_functions import spring
-from time_functions import to_datetime, date_convert_RU
+from time_functions import dt_to_string, date_convert_RU
 
+import http_caching
+import metrics
+from cache import ResponseCache
+from data_version import read_version
 from database_queries import DatabaseQueries
+from heating_rules import RuleIndex
+from region_search import SearchIndex
+from migrations import migrate
 
-db = DatabaseQueries('weather.db')
+# database file, can point to a synthetic benchmark database
+db = DatabaseQueries(os.environ.get("WEATHER_DB", "weather.db"))
 
 app = Flask(__name__)
 
+# bring database schema up to date
+migrate(db)
+
+# rendered pages and JSON payloads keyed on data version
+response_cache = ResponseCache(maxsize=2048)
+
+# sorted region names and data version they were loaded for
+region_names = {'version': None, 'names': None}
+region_names_lock = threading.Lock()
+
+# heating rule index and data version it was built for
+rule_index = {'version': None, 'index': None}
+rule_index_lock = threading.Lock()
+
+# region search index and data version it was built for
+search_index = {'version': None, 'index': None}
+search_index_lock = threading.Lock()
+
+# results of /search by default and at most
+SEARCH_LIMIT = 10
+SEARCH_LIMIT_MAX = 50
+
+@app.before_request
+def start_timer():
+	g.start = time.perf_counter()
+
+@app.after_request
+def record_timing(response):
+	"""
+	Record duration of request by route pattern, so that query strings don't
+	produce a series per region.
+	"""
+	if 'start' in g:
+		route = request.url_rule.rule if request.url_rule else 'unmatched'
+		metrics.observe('http_request_seconds', time.perf_counter() - g.start,
+						route=route, status=str(response.status_code))
+	return response
+
+@app.teardown_appcontext
+def release_connection(exception):
+	"""
+	Hand connection of request thread back to the pool, threaded servers
+	start a new thread for every request.
+	"""
+	db.release()
+
+def cached(view):
+	"""
+	Cache successful responses of a route by path, query string and data version.
+	Entries become stale as soon as forecast.py bumps the version.
+
+	Responses carry a strong ETag derived from the data version and expire at
+	the next forecast run. If-None-Match is answered with 304 before the view
+	or database is touched. Bodies above COMPRESS_MIN_SIZE are compressed
+	and cached per encoding.
+
+	:param view: Flask view function <function>.
+	:return: wrapped view function <function>.
+	"""
+	@functools.wraps(view)
+	def wrapper(*args, **kwargs):
+		version = read_version()
+		encoding = http_caching.accepted_encoding(request.headers.get('Accept-Encoding', ''))
+		tag = http_caching.etag(version, request.full_path)
+
+		# client already has current data
+		for candidate in (tag, http_caching.encoded_etag(tag, encoding)):
+			if request.if_none_match.contains(candidate):
+				return _cache_headers(app.response_class(status=304), version, candidate)
+
+		key = (request.path, tuple(sorted(request.args.items(multi=True))), version)
+		entry = response_cache.get(key + (encoding,))
+		if entry is None:
+			entry = response_cache.get(key + (None,))
+			if entry is None:
+				response = app.make_response(view(*args, **kwargs))
+				if response.status_code != 200:
+					return response
+				entry = (response.get_data(), response.status_code,
+						 [x for x in response.headers.items() if x[0] != 'Content-Length'])
+				response_cache.set(key + (None,), entry)
+			if encoding:
+				if len(entry[0]) >= http_caching.COMPRESS_MIN_SIZE:
+					entry = (http_caching.compress(entry[0], encoding), entry[1],
+							 entry[2] + [('Content-Encoding', encoding)])
+				response_cache.set(key + (encoding,), entry)
+
+		response = app.response_class(*entry)
+		if response.content_encoding:
+			tag = http_caching.encoded_etag(tag, response.content_encoding)
+		return _cache_headers(response, version, tag)
+	return wrapper
+
+def _cache_headers(response, version, tag):
+	"""
+	Set validators and freshness lifetime: until the next forecast run.
+
+	:param response: Flask response <object>.
+	:param version: data version <string>.
+	:param tag: entity tag <string>.
+	:return: Flask response <object>.
+	"""
+	response.set_etag(tag)
+	response.last_modified = http_caching.last_modified(version)
+	response.cache_control.public = True
+	response.cache_control.max_age = http_caching.max_age()
+	response.vary.add('Accept-Encoding')
+	return response
+
 @app.route("/")
+@cached
 def index():
 	"""
 	Renders index.html with list of all regions for table.
 
 	:return: sorted region names (list of tuples) <list>, page title <string>.
 	"""
-	region_names_params = {'table': 'regions',
-							   'conditions': [],
-							   'condition_data': (),
-							   'filters': ['name', 'country']}
-
-	# returns a list of tuples
-	region_names = db.select(**region_names_params)
 	# page title
 	title = "Прогноз включения отопления"
 
-	return render_template("index.html", regions=sorted(region_names), title=title)
+	return render_template("index.html", regions=_region_names(), title=title)
 
 @app.route("/region")
+@cached
 def region():
 	"""
 	Renders region.html, page for chosen region.
@@ -35,93 +152,23 @@ def region():
 	:return: sorted region names (list of tuples) <list>, page title <string>,
 	heating date <string>, title for graph <string>, x and y coordinate data for graph.
 	"""
-	region_names_params = {'table': 'regions',
-						   'conditions': [],
-						   'condition_data': (),
-						   'filters': ['name', 'country']}
-
-	# returns a list of tuples
-	region_names = db.select(**region_names_params)
-
 	# parse region name via GET request
 	region = request.args.get("region")
 
-	# download heating date
-	heating_date_params = {'table': 'regions',
-						   'conditions': ['name'],
-						   'condition_data': (region,),
-						   'filters': ['heating_date_RU', 'name_RU', 'id']}
-
-	# returns a list of tuples
-	heating_data = db.select(**heating_date_params)
-
-	# set message for heating date
-	heating_message = None
-
-	heating_date = heating_data[0][0]
-	heating_region = heating_data[0][1]
-	region_id = heating_data[0][2]
-
-	# russian language sensitive cases for season and no heating date
-	if not heating_date and spring():
-		if 'Влад' in heating_region:
-			heating_message = "Отопление во {} в ближайшее время не отключат.*".format(heating_region)
-		else:
-			heating_message = "Отопление в {} в ближайшее время не отключат.*".format(heating_region)
-	if not heating_date and not spring():
-		if 'Влад' in heating_region:
-			heating_message = "Отопление во {} в ближайшее время не включат.*".format(heating_region)
-		else:
-			heating_message = "Отопление в {} в ближайшее время не включат.*".format(heating_region)
-
-	# russian language sensitive cases for season and heating date
-	if heating_date and spring():
-		if 'Влад' in heating_region:
-			if last_date == 1:
-				heating_message = "Отопление во {} должны были отключить {}.*".format(heating_region, heating_date)
-			else:
-				heating_message = "Отопление во {} отключат {}.*".format(heating_region, heating_date)
-		else:
-			if last_date == 1:
-				heating_message = "Отопление в {} должны были отключить {}.*".format(heating_region, heating_date)
-			else:
-				heating_message = "Отопление в {} отключат {}.*".format(heating_region, heating_date)
-	if heating_date and not spring():
-		if 'Влад' in heating_region:
-			if last_date == 1:
-				heating_message = "Отопление во {} должны были включить {}.*".format(heating_region, heating_date)
-			else:
-				heating_message = "Отопление во {} включат {}.*".format(heating_region, heating_date)
-		else:
-			if last_date == 1:
-				heating_message = "Отопление в {} должны были включить {}.*".format(heating_region, heating_date)
-			else:
-				heating_message = "Отопление в {} включат {}.*".format(heating_region, heating_date)
-
-	# page title
-	if 'Влад' in heating_region:
-		title = "Отопление во {}".format(heating_region)
-	else:
-		title = "Отопление в {}".format(heating_region)
+	# page payload precomputed by forecast.py, lowest region id if names repeat
+	page = db.query("""SELECT title, message, region_title, x, y FROM regions
+		JOIN pages ON pages.region_id = regions.id
+		WHERE regions.name = ? ORDER BY regions.id LIMIT 1""", (region,))
+	if not page:
+		abort(404)
 
-	# download graphing data
-	graph_params = {'table': 'graph',
-						   'conditions': ['region_id'],
-						   'condition_data': (region_id,),
-						   'filters': ['temp_{}'.format(x) for x in range(1, 11)] +
-									  ['date_{}'.format(x) for x in range(1, 11)]
-					}
+	title, heating_message, region_title, x, y = page[0]
 
-	# returns a list of tuples
-	graph_data = db.select(**graph_params)
-
-	x = [date_convert_RU(to_datetime(x, time=False), short=True) for x in list(graph_data[0])[10:]]
-	y = list(graph_data[0])[:10]
-	
-	return render_template("region.html", regions=sorted(region_names), title=title,
-						   heating_date=heating_message, region_title=heating_region, x=x, y=y)
+	return render_template("region.html", regions=_region_names(), title=title,
+						   heating_date=heating_message, region_title=region_title, x=x, y=y)
 
 @app.route("/urlforjsonqueries")
+@cached
 def json():
 	"""
 	Internal API for mobile app. Output region data in JSON for given region via
@@ -159,6 +206,174 @@ def json():
 
 	return jsonify(json_for_app)
 
+@app.route("/urlfortoday")
+@cached
+def today():
+	"""
+	Internal API for live intraday stats. Output running aggregates of today
+	for given region via GET request. If no region specified, return data for all regions.
+	Example: /urlfortoday?region=Moscow.
+
+	:return: JSON object with today data.
+	"""
+	sql = """SELECT regions.name, regions.latin, today.temp_sum, today.temp_count,
+		today.temp_min, today.temp_max, today.datetime
+		FROM today JOIN regions ON regions.id = today.region_id"""
+
+	if request.args.get("region"):
+		rows = db.query(sql + """ WHERE regions.latin = ?""", (request.args.get("region"),))
+	else:
+		rows = db.query(sql)
+
+	json_for_app = [{'name': name,
+					 'latin': latin,
+					 'mean': round(temp_sum / temp_count, 2) if temp_count else None,
+					 'min': temp_min,
+					 'max': temp_max,
+					 'observed': temp_count,
+					 'datetime': updated}
+					for name, latin, temp_sum, temp_count, temp_min, temp_max, updated in rows]
+
+	return jsonify(json_for_app)
+
+@app.route("/urlforheatingrules")
+@cached
+def heating_rules():
+	"""
+	Internal API for "what if" heating rules. Output heating dates for given
+	threshold, number of days in a row and season via GET request.
+	If no region specified, return data for all regions.
+	Example: /urlforheatingrules?region=Moscow&threshold=10&window=3&season=fall.
+
+	:return: JSON object with heating dates.
+	"""
+	try:
+		threshold = float(request.args.get("threshold", 8))
+		window = int(request.args.get("window", 5))
+	except ValueError:
+		abort(400)
+	season = request.args.get("season", "spring" if spring() else "fall")
+	if season not in ("spring", "fall") or window < 1:
+		abort(400)
+
+	filters = ['id', 'name', 'name_RU', 'latin']
+	if request.args.get("region"):
+		regions = db.select(table='regions', conditions=['latin'],
+							condition_data=(request.args.get("region"),), filters=filters)
+	else:
+		regions = db.select(table='regions', conditions=[], condition_data=(), filters=filters)
+
+	index = _rule_index()
+
+	json_for_app = []
+	for region_id, name, name_RU, latin in regions:
+		heating_date = None
+		if region_id in index.regions:
+			heating_date = index.heating_date(region_id, threshold, window, season == "spring")
+		json_for_app.append({'name': name,
+							 'name_RU': name_RU,
+							 'latin': latin,
+							 'season': season,
+							 'threshold': threshold,
+							 'window': window,
+							 'heating_date': dt_to_string(heating_date, time=False) if heating_date else None,
+							 'heating_date_RU': date_convert_RU(heating_date) if heating_date else None})
+
+	return jsonify(json_for_app)
+
+@app.route("/search")
+@cached
+def search():
+	"""
+	Region search for typeahead in web page and mobile app. Output regions,
+	whose name or latin starts with query, case and ё/е insensitive.
+	Example: /search?q=нижн&limit=5.
+
+	:return: JSON object with matching regions.
+	"""
+	try:
+		limit = int(request.args.get("limit", SEARCH_LIMIT))
+	except ValueError:
+		abort(400)
+	limit = max(1, min(limit, SEARCH_LIMIT_MAX))
+
+	json_for_app = [{'name': name, 'name_RU': name_RU, 'latin': latin, 'country': country}
+					for name, name_RU, latin, country in
+					_search_index().search(request.args.get("q", ""), limit)]
+
+	return jsonify(json_for_app)
+
+@app.route("/urlforcachestats")
+def cache_stats():
+	"""
+	Response cache hit/miss counters and current data version.
+
+	:return: JSON object with cache statistics.
+	"""
+	return jsonify(dict(response_cache.stats(), version=read_version()))
+
+@app.route("/metrics")
+def prometheus_metrics():
+	"""
+	Prometheus metrics: route timings and database queries of web app plus
+	stage histograms of the last forecast run.
+
+	:return: metrics in Prometheus text format.
+	"""
+	body = metrics.render(metrics.registry, metrics.load_run(db))
+	return app.response_class(body, mimetype='text/plain; version=0.0.4')
+
+def _region_names():
+	"""
+	Return sorted region names for tables, reload them if data version has changed.
+
+	:return: sorted region names (list of tuples) <list>.
+	"""
+	version = read_version()
+	with region_names_lock:
+		if region_names['version'] != version:
+			region_names_params = {'table': 'regions',
+								   'conditions': [],
+								   'condition_data': (),
+								   'filters': ['name', 'country']}
+
+			# returns a list of tuples
+			region_names['names'] = sorted(db.select(**region_names_params))
+			region_names['version'] = version
+		return region_names['names']
+
+def _rule_index():
+	"""
+	Return heating rule index, rebuild it if data version has changed.
+
+	:return: instance of RuleIndex class <object>.
+	"""
+	version = read_version()
+	with rule_index_lock:
+		if rule_index['index'] is None or rule_index['version'] != version:
+			rows = db.select(table='graph', conditions=[], condition_data=(),
+							 filters=['region_id'] + ['temp_{}'.format(x) for x in range(1, 11)] +
+									 ['date_{}'.format(x) for x in range(1, 11)])
+			rule_index['index'] = RuleIndex(rows)
+			rule_index['version'] = version
+		return rule_index['index']
+
+
+def _search_index():
+	"""
+	Return region search index, rebuild it if data version has changed.
+
+	:return: instance of SearchIndex class <object>.
+	"""
+	version = read_version()
+	with search_index_lock:
+		if search_index['index'] is None or search_index['version'] != version:
+			rows = db.select(table='regions', conditions=[], condition_data=(),
+							 filters=['name', 'name_RU', 'latin', 'country'])
+			search_index['index'] = SearchIndex(rows)
+			search_index['version'] = version
+		return search_index['index']
+
 
 if __name__ == "__main__":
 	app.run()
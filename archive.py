@@ -0,0 +1,151 @@
+"""
+Raw forecast archive: one compressed file per forecast run with API responses
+indexed by region id, so that runs can be replayed offline.
+
+File layout (little-endian):
+
+	payloads	zlib-compressed API responses, back to back
+	index		(region_id uint32, offset uint64, length uint32) per region, sorted by region id
+	footer		magic 8s, index offset uint64, number of regions uint32, run time int64 (epoch seconds)
+"""
+import bisect
+import datetime
+import mmap
+import os
+import struct
+import zlib
+
+MAGIC = b'FRCARCH1'
+INDEX_ENTRY = struct.Struct('<IQI')
+FOOTER = struct.Struct('<8sQIq')
+
+def archive_path(directory, run_time):
+	"""
+	Path of archive file for forecast run.
+
+	:param directory: archive directory <string>.
+	:param run_time: time of forecast run <datetime.datetime>.
+	:return: file path <string>.
+	"""
+	return os.path.join(directory, run_time.strftime('%Y%m%d-%H%M%S') + '.frc')
+
+def find_archive(directory, run):
+	"""
+	Resolve run name to archive file: full path, file name or run id like '20190407-200213'.
+
+	:param directory: archive directory <string>.
+	:param run: run name <string>.
+	:return: file path <string>.
+	"""
+	for path in (run, os.path.join(directory, run), os.path.join(directory, run + '.frc')):
+		if os.path.isfile(path):
+			return path
+	raise FileNotFoundError("no archive for run {} in {}".format(run, directory))
+
+class ArchiveWriter:
+	"""
+	Writes API responses of a forecast run to archive file. Data goes to a
+	temporary file, which replaces the archive on close(), so readers never
+	see a half-written archive. A region added twice keeps its last response.
+	"""
+	def __init__(self, path, run_time, level=6):
+		self.path = path
+		self.run_time = run_time
+		self.level = level
+		self._temp_path = path + '.tmp'
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+		self._file = open(self._temp_path, 'wb')
+		self._offset = 0
+		# region id -> (offset, length)
+		self._index = {}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def add(self, region_id, payload):
+		"""
+		Compress and append API response of region.
+
+		:param region_id: region id <int>.
+		:param payload: raw API response <bytes>.
+		:return: void function.
+		"""
+		blob = zlib.compress(payload, self.level)
+		self._file.write(blob)
+		self._index[region_id] = (self._offset, len(blob))
+		self._offset += len(blob)
+
+	def close(self):
+		"""
+		Write index and footer and move archive in place.
+
+		:return: void function.
+		"""
+		if self._file.closed:
+			return
+		for region_id in sorted(self._index):
+			self._file.write(INDEX_ENTRY.pack(region_id, *self._index[region_id]))
+		self._file.write(FOOTER.pack(MAGIC, self._offset, len(self._index),
+									 int(self.run_time.timestamp())))
+		self._file.close()
+		os.replace(self._temp_path, self.path)
+
+class ArchiveReader:
+	"""
+	Memory-mapped reader of archive file. Responses are decompressed on access.
+	"""
+	def __init__(self, path):
+		self.path = path
+		with open(path, 'rb') as file:
+			self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, self._index_offset, self._count, run_time = FOOTER.unpack_from(
+			self._map, len(self._map) - FOOTER.size)
+		if magic != MAGIC:
+			raise ValueError("{} is not a forecast archive".format(path))
+		self.run_time = datetime.datetime.fromtimestamp(run_time)
+		self._region_ids = [self._entry(x)[0] for x in range(self._count)]
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def __len__(self):
+		return self._count
+
+	def _entry(self, position):
+		return INDEX_ENTRY.unpack_from(self._map, self._index_offset + position * INDEX_ENTRY.size)
+
+	def region_ids(self):
+		"""
+		:return: archived region ids in ascending order <list>.
+		"""
+		return list(self._region_ids)
+
+	def get(self, region_id):
+		"""
+		Read API response of region.
+
+		:param region_id: region id <int>.
+		:return: raw API response <bytes> or None if region is not archived.
+		"""
+		position = bisect.bisect_left(self._region_ids, region_id)
+		if position == self._count or self._region_ids[position] != region_id:
+			return None
+		_, offset, length = self._entry(position)
+		return zlib.decompress(self._map[offset:offset + length])
+
+	def items(self):
+		"""
+		:return: generator of tuples (region id <int>, raw API response <bytes>).
+		"""
+		for position in range(self._count):
+			region_id, offset, length = self._entry(position)
+			yield region_id, zlib.decompress(self._map[offset:offset + length])
+
+	def close(self):
+		self._map.close()
@@ -0,0 +1,156 @@
+"""
+Vectorized heating date backtest over the full history table.
+
+For every region and season finds the first time mean temperature stayed
+above (spring: heating cut) or below (fall: heating supply) threshold for
+window days in a row, same rule as ff.search_heating_date.
+
+	$ python backtest.py --threshold 8 --window 5
+"""
+import argparse
+import csv
+import sys
+import time
+
+import numpy as np
+
+from database_queries import DatabaseQueries
+
+ONE_DAY = np.timedelta64(1, 'D')
+
+def load_history(db):
+	"""
+	Load history of all regions into contiguous arrays sorted by region and date.
+	If a date was saved twice, the latest row wins, as in Region.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:return: region ids <numpy.ndarray>, dates <numpy.ndarray of datetime64[D]>,
+	temperatures <numpy.ndarray>.
+	"""
+	rows = db.query("""SELECT region_id, date, temp FROM history
+		WHERE temp IS NOT NULL ORDER BY region_id, date, id""")
+	if not rows:
+		return np.empty(0, dtype=np.int64), np.empty(0, dtype='datetime64[D]'), np.empty(0)
+
+	region_ids, dates, temps = zip(*rows)
+	region_ids = np.array(region_ids, dtype=np.int64)
+	dates = np.array(dates, dtype='datetime64[D]')
+	temps = np.array(temps, dtype=np.float64)
+
+	# keep last row of every (region, date) pair
+	last = np.ones(len(dates), dtype=bool)
+	last[:-1] = (region_ids[1:] != region_ids[:-1]) | (dates[1:] != dates[:-1])
+	return region_ids[last], dates[last], temps[last]
+
+def seasons(dates):
+	"""
+	Split dates into heating seasons. Spring season lasts from march to august
+	(see ff.spring), fall season from september to february of the next year.
+
+	:param dates: dates <numpy.ndarray of datetime64[D]>.
+	:return: spring flags <numpy.ndarray of bool>, season start years <numpy.ndarray>.
+	"""
+	months = dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
+	years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+	spring = (months >= 3) & (months <= 8)
+	# january and february belong to the fall season of the previous year
+	years = years - ((months <= 2).astype(np.int64))
+	return spring, years
+
+def run_lengths(match, group_start):
+	"""
+	Count matching days in a row ending at every position.
+	Runs don't cross group boundaries.
+
+	:param match: matching days <numpy.ndarray of bool>.
+	:param group_start: first position of every group <numpy.ndarray of bool>.
+	:return: run lengths <numpy.ndarray>.
+	"""
+	positions = np.arange(len(match))
+	last_miss = np.maximum.accumulate(np.where(match, -1, positions))
+	first_in_group = np.maximum.accumulate(np.where(group_start, positions, 0))
+	return positions - np.maximum(last_miss + 1, first_in_group) + 1
+
+def heating_dates(region_ids, dates, temps, threshold=8, window=5):
+	"""
+	Compute heating dates for every region and season in one pass.
+
+	:param region_ids: region ids <numpy.ndarray>, sorted.
+	:param dates: dates <numpy.ndarray of datetime64[D]>, sorted within region.
+	:param temps: temperatures <numpy.ndarray>.
+	:param threshold: temperature threshold <float>.
+	:param window: number of days in a row <int>.
+	:return: dictionary of arrays with one item per region and season: 'region_id',
+	'season' ('spring' or 'fall'), 'year' and 'date' (NaT if condition wasn't met).
+	"""
+	spring, years = seasons(dates)
+	match = np.where(spring, temps > threshold, temps < threshold)
+
+	group_start = np.ones(len(dates), dtype=bool)
+	group_start[1:] = ((region_ids[1:] != region_ids[:-1]) | (years[1:] != years[:-1]) |
+					   (spring[1:] != spring[:-1]))
+	starts = np.flatnonzero(group_start)
+	groups = np.cumsum(group_start) - 1
+
+	# first position per group where the run reaches window days
+	hits = np.flatnonzero(run_lengths(match, group_start) == window)
+	hit_groups, first = np.unique(groups[hits], return_index=True)
+
+	result_dates = np.full(len(starts), np.datetime64('NaT'), dtype='datetime64[D]')
+	result_dates[hit_groups] = dates[hits[first]] + ONE_DAY
+
+	return {'region_id': region_ids[starts],
+			'season': np.where(spring[starts], 'spring', 'fall'),
+			'year': years[starts],
+			'date': result_dates}
+
+def search_window(data, spring_season, threshold=8, window=5):
+	"""
+	Search for heating date in one blended window, same as ff.search_heating_date,
+	with season direction given explicitly.
+
+	:param data: blended dictionary with dates <datetime.date> and temperatures <float>.
+	:param spring_season: True to search for heating cut, False for supply <bool>.
+	:param threshold: temperature threshold <float>.
+	:param window: number of days in a row <int>.
+	:return: heating date <datetime.date> if found, None otherwise.
+	"""
+	temps = np.fromiter(data.values(), dtype=np.float64, count=len(data))
+	match = temps > threshold if spring_season else temps < threshold
+	group_start = np.zeros(len(temps), dtype=bool)
+	group_start[:1] = True
+	hits = np.flatnonzero(run_lengths(match, group_start) == window)
+	if not len(hits):
+		return None
+	return list(data)[hits[0]] + ONE_DAY.item()
+
+def main():
+	parser = argparse.ArgumentParser(description="Backtest heating dates over history table.")
+	parser.add_argument('--database', default='weather.db')
+	parser.add_argument('--threshold', type=float, default=8)
+	parser.add_argument('--window', type=int, default=5)
+	parser.add_argument('--csv', help="write results to this file instead of stdout")
+	args = parser.parse_args()
+
+	db = DatabaseQueries(args.database)
+	start = time.perf_counter()
+	region_ids, dates, temps = load_history(db)
+	loaded = time.perf_counter()
+	result = heating_dates(region_ids, dates, temps, args.threshold, args.window)
+	done = time.perf_counter()
+	db.close()
+
+	file = open(args.csv, 'w', newline='') if args.csv else sys.stdout
+	writer = csv.writer(file)
+	writer.writerow(['region_id', 'season', 'year', 'heating_date'])
+	for row in zip(result['region_id'], result['season'], result['year'], result['date']):
+		writer.writerow([row[0], row[1], row[2], '' if np.isnat(row[3]) else str(row[3])])
+	if args.csv:
+		file.close()
+
+	print("{} rows loaded in {:.3f} s, {} region seasons computed in {:.3f} s".format(
+		len(dates), loaded - start, len(result['date']), done - loaded), file=sys.stderr)
+
+
+if __name__ == "__main__":
+	main()
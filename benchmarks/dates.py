@@ -0,0 +1,91 @@
+"""
+Micro-benchmark for date_codec: strptime/strftime and month name loops
+(old time_functions behaviour) against fixed-format fast paths with LRU
+caches, on dates that repeat like history rows and graph labels do.
+
+Run from the project root:
+
+	$ python -m benchmarks.dates --calls 100000
+"""
+import argparse
+import datetime
+import random
+import time
+
+import date_codec
+
+
+def old_parse_date(string):
+	return datetime.datetime.strptime(string, '%Y-%m-%d')
+
+
+def old_parse_datetime(string):
+	return datetime.datetime.strptime(string, '%Y-%m-%d %H:%M:%S')
+
+
+def old_format_date(dt):
+	return dt.strftime('%Y-%m-%d')
+
+
+def old_format_datetime(dt):
+	return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def old_russian_date(date, short=False):
+	months_ru = ['января', 'февраля', 'марта',
+				 'апреля', 'мая', 'июня', 'июля',
+				 'августа', 'сентября', 'октября',
+				 'ноября', 'декабря']
+	months_ru_short = ['янв', 'фев', 'мар',
+				 'апр', 'мая', 'июн', 'июл',
+				 'авг', 'сент', 'окт',
+				 'нояб', 'дек']
+	for index, month in enumerate(months_ru_short if short else months_ru, 1):
+		if index == date.month:
+			return "{} {}".format(date.day, month)
+
+
+def measure(function, inputs):
+	"""
+	Time given function over inputs.
+
+	:param function: callable taking one input <function>.
+	:param inputs: arguments <list>.
+	:return: mean latency per call in microseconds <float>.
+	"""
+	start = time.perf_counter()
+	for value in inputs:
+		function(value)
+	return (time.perf_counter() - start) / len(inputs) * 1e6
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--calls', type=int, default=100000)
+	parser.add_argument('--days', type=int, default=365, help="distinct dates in the workload")
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+
+	rng = random.Random(args.seed)
+	start = datetime.datetime(2019, 1, 1)
+	days = [start + datetime.timedelta(days=rng.randrange(args.days)) for _ in range(args.calls)]
+	# forecast points: three-hour slots of the same days
+	moments = [x + datetime.timedelta(hours=3 * rng.randrange(8)) for x in days]
+	workloads = [
+		('parse date', old_parse_date, date_codec.parse_date, [old_format_date(x) for x in days]),
+		('parse datetime', old_parse_datetime, date_codec.parse_datetime,
+		 [old_format_datetime(x) for x in moments]),
+		('format date', old_format_date, date_codec.format_date, [x.date() for x in days]),
+		('format datetime', old_format_datetime, date_codec.format_datetime, moments),
+		('russian date', old_russian_date, date_codec.russian_date, [x.date() for x in days]),
+	]
+
+	print("{} calls over {} distinct days".format(args.calls, args.days))
+	print("{:16} {:>10} {:>10} {:>8}".format('', 'old us', 'codec us', 'speedup'))
+	for name, old, new, inputs in workloads:
+		before, after = measure(old, inputs), measure(new, inputs)
+		print("{:16} {:10.3f} {:10.3f} {:7.1f}x".format(name, before, after, before / after))
+
+
+if __name__ == "__main__":
+	main()
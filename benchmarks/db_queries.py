@@ -0,0 +1,73 @@
+"""
+Micro-benchmark for DatabaseQueries: per-call latency of a connection opened
+for every call (old behaviour) against pooled connections with cached SQL.
+
+Run from the project root:
+
+	$ python -m benchmarks.db_queries --database weather.db --calls 5000
+"""
+import argparse
+import sqlite3
+import time
+
+from database_queries import DatabaseQueries
+
+
+def select_per_call(database, region_id):
+	"""
+	Old select path: new connection and freshly formatted SQL for every call.
+
+	:param database: database path <string>.
+	:param region_id: region id <int>.
+	:return: list of tuples <list>.
+	"""
+	con = sqlite3.connect(database)
+	db = con.cursor()
+	filters = ['hour_{}'.format(x) for x in range(0, 24, 3)]
+	db.execute(("SELECT {}" + ((", {}") * (len(filters) - 1)) + " FROM {} WHERE {} = ?").format(
+		*filters, 'today', 'region_id'), (region_id,))
+	rows = db.fetchall()
+	db.close()
+	con.close()
+	return rows
+
+
+def measure(function, calls, regions):
+	"""
+	Time given function over a number of calls.
+
+	:param function: callable taking region id <function>.
+	:param calls: number of calls <int>.
+	:param regions: number of regions to cycle through <int>.
+	:return: mean latency per call in microseconds <float>.
+	"""
+	start = time.perf_counter()
+	for call in range(calls):
+		function(call % regions + 1)
+	return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--database', default='weather.db')
+	parser.add_argument('--calls', type=int, default=5000)
+	args = parser.parse_args()
+
+	db = DatabaseQueries(args.database)
+	regions = db.regions('regions')
+
+	def pooled(region_id):
+		return db.select(table='today', conditions=['region_id'], condition_data=(region_id,),
+						 filters=['hour_{}'.format(x) for x in range(0, 24, 3)])
+
+	before = measure(lambda x: select_per_call(args.database, x), args.calls, regions)
+	after = measure(pooled, args.calls, regions)
+	db.close()
+
+	print("connection per call: {:8.1f} us/call".format(before))
+	print("pooled connection:   {:8.1f} us/call".format(after))
+	print("speedup:             {:8.1f}x".format(before / after))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,80 @@
+"""
+Micro-benchmark for decoding of API responses: full json.loads with dt_txt
+parsed by strptime (old behaviour) against the lean decoder: its regular
+expression scan and its full parse, with orjson if installed. Reports time
+and memory allocated per region.
+
+Run from the project root:
+
+	$ python -m benchmarks.decode --regions 2000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import decoder
+from benchmarks.owm_stub import forecast_payload
+from time_functions import to_datetime
+
+
+def decode_full(raw):
+	"""
+	Old decode path: whole response as dicts, dates parsed from dt_txt.
+
+	:param raw: API response <bytes>.
+	:return: tuple (dates <list>, temps <list>).
+	"""
+	data = json.loads(raw)
+	utc_forecast = {x['dt_txt']: x['main']['temp'] for x in data['list']}
+	return [to_datetime(x) for x in utc_forecast], list(utc_forecast.values())
+
+
+def measure(function, payloads):
+	"""
+	Time given function over all payloads, then trace its allocations.
+
+	:param function: callable taking raw response <function>.
+	:param payloads: API responses <list>.
+	:return: tuple (microseconds per region <float>, allocated KiB per region <float>,
+	KiB kept per region <float>).
+	"""
+	start = time.perf_counter()
+	for raw in payloads:
+		function(raw)
+	elapsed = (time.perf_counter() - start) / len(payloads) * 1e6
+
+	# peak of a single decode and size of its result
+	tracemalloc.start()
+	peaks, kept = [], []
+	for raw in payloads[:200]:
+		tracemalloc.reset_peak()
+		before = tracemalloc.get_traced_memory()[0]
+		result = function(raw)
+		current, peak = tracemalloc.get_traced_memory()
+		peaks.append(peak - before)
+		kept.append(current - before)
+		del result
+	tracemalloc.stop()
+	return elapsed, sum(peaks) / len(peaks) / 1024, sum(kept) / len(kept) / 1024
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--regions', type=int, default=2000)
+	args = parser.parse_args()
+
+	payloads = [json.dumps(forecast_payload(x)).encode() for x in range(1, args.regions + 1)]
+	print("{} regions, {:.1f} KiB per response".format(
+		len(payloads), sum(map(len, payloads)) / len(payloads) / 1024))
+
+	paths = [('json.loads + strptime', decode_full),
+			 ('decoder.scan', decoder.scan),
+			 ('decoder.parse ({})'.format('orjson' if decoder.orjson else 'json'), decoder.parse)]
+	print("{:24} {:>10} {:>12} {:>10}".format('', 'us/region', 'peak KiB', 'kept KiB'))
+	for name, function in paths:
+		print("{:24} {:10.1f} {:12.1f} {:10.2f}".format(name, *measure(function, payloads)))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,131 @@
+"""
+Local stand-in for OpenWeatherMap /data/2.5/forecast: five-day three-hour
+forecast for any city id, with injected latency, 404 and 429 responses.
+
+Run from the project root and point forecast.py at it:
+
+	$ python -m benchmarks.owm_stub --port 8765 --latency 50 --not-found 0.01
+	$ export API_URL_OW=http://127.0.0.1:8765/data/2.5/forecast
+"""
+import argparse
+import datetime
+import json
+import random
+import socketserver
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from benchmarks.synthetic_db import seasonal_temp
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+	"""
+	Same as http.server.ThreadingHTTPServer, which needs Python 3.7.
+	"""
+	daemon_threads = True
+
+FORECAST_PATH = '/data/2.5/forecast'
+# forty three-hour intervals
+FORECAST_POINTS = 40
+
+def forecast_payload(city_id, now=None):
+	"""
+	Forecast response in OpenWeatherMap format, starting at current three-hour slot.
+
+	:param city_id: city id <int>.
+	:param now: current UTC time <datetime.datetime>, now by default.
+	:return: response <dict>.
+	"""
+	now = now or datetime.datetime.utcnow()
+	start = now.replace(hour=now.hour - now.hour % 3, minute=0, second=0, microsecond=0)
+	points = []
+	for x in range(FORECAST_POINTS):
+		moment = start + datetime.timedelta(hours=3 * x)
+		# daily mean plus a day-night swing
+		temp = round(seasonal_temp(city_id, moment.date()) - 4 * ((moment.hour - 12) / 12) ** 2 + 2, 2)
+		points.append({'dt': int(moment.replace(tzinfo=datetime.timezone.utc).timestamp()),
+					   'main': {'temp': temp, 'temp_min': temp, 'temp_max': temp,
+								'pressure': 1015, 'humidity': 80},
+					   'weather': [{'id': 800, 'main': 'Clear', 'description': 'clear sky'}],
+					   'wind': {'speed': 3.1, 'deg': 200},
+					   'dt_txt': moment.strftime('%Y-%m-%d %H:%M:%S')})
+	return {'cod': '200', 'message': 0, 'cnt': len(points), 'list': points,
+			'city': {'id': city_id, 'name': 'City {}'.format(city_id), 'country': 'RU'}}
+
+class StubHandler(BaseHTTPRequestHandler):
+	# set by serve()
+	latency = 0.0
+	jitter = 0.0
+	not_found = 0.0
+	too_many = 0.0
+	rng = random.Random(0)
+	lock = threading.Lock()
+
+	def do_GET(self):
+		url = urllib.parse.urlparse(self.path)
+		query = urllib.parse.parse_qs(url.query)
+		if url.path != FORECAST_PATH or 'id' not in query:
+			return self.respond(404, {'cod': '404', 'message': 'Internal error'})
+		with self.lock:
+			roll, delay = self.rng.random(), self.latency + self.rng.uniform(0, self.jitter)
+		time.sleep(delay)
+		if roll < self.not_found:
+			return self.respond(404, {'cod': '404', 'message': 'city not found'})
+		if roll < self.not_found + self.too_many:
+			return self.respond(429, {'cod': '429', 'message': 'Your account is temporary blocked '
+								'due to exceeding of requests limitation of your subscription type.'})
+		self.respond(200, forecast_payload(int(query['id'][0])))
+
+	def respond(self, status, payload):
+		body = json.dumps(payload).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json; charset=utf-8')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+def serve(port=8765, latency=0.0, jitter=0.0, not_found=0.0, too_many=0.0, seed=0):
+	"""
+	Create stub server, call serve_forever() on it to start.
+
+	:param port: port <int>, any free port if 0.
+	:param latency: delay of every response in seconds <float>.
+	:param jitter: extra random delay up to given seconds <float>.
+	:param not_found: share of 404 responses <float>.
+	:param too_many: share of 429 responses <float>.
+	:param seed: random seed <int>.
+	:return: instance of ThreadingHTTPServer <object>.
+	"""
+	handler = type('Handler', (StubHandler,), {
+		'latency': latency, 'jitter': jitter, 'not_found': not_found, 'too_many': too_many,
+		'rng': random.Random(seed), 'lock': threading.Lock()})
+	server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+	server.daemon_threads = True
+	return server
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--port', type=int, default=8765, help="0 picks a free port")
+	parser.add_argument('--latency', type=float, default=0, help="response delay, ms")
+	parser.add_argument('--jitter', type=float, default=0, help="extra random delay up to, ms")
+	parser.add_argument('--not-found', type=float, default=0, help="share of 404 responses")
+	parser.add_argument('--too-many', type=float, default=0, help="share of 429 responses")
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+
+	server = serve(args.port, args.latency / 1000, args.jitter / 1000,
+				   args.not_found, args.too_many, args.seed)
+	# benchmarks.pipeline reads the port from this line
+	print("listening on port {}".format(server.server_address[1]), flush=True)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		server.server_close()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,182 @@
+"""
+End-to-end benchmark of forecast.main(): synthetic database, local
+OpenWeatherMap stub and a scripted run, results written to JSON.
+
+Run from the project root:
+
+	$ python -m benchmarks.pipeline --regions 5000 --years 2 --latency 20 --output bench.json
+	$ python -m benchmarks.pipeline --regions 5000 --compare bench.json
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_db import generate
+
+def percentile(values, share):
+	"""
+	Nearest-rank percentile.
+
+	:param values: measurements <list>.
+	:param share: percentile as share, e.g. 0.99 <float>.
+	:return: value <float> or None if no values.
+	"""
+	if not values:
+		return None
+	values = sorted(values)
+	return values[min(len(values) - 1, max(0, int(round(share * len(values))) - 1))]
+
+def start_stub(latency, jitter, not_found, too_many, seed):
+	"""
+	Start OpenWeatherMap stub in a separate process, so that it doesn't
+	compete with the pipeline for the GIL or count towards its memory.
+
+	:return: process <subprocess.Popen>, forecast url <string>.
+	"""
+	process = subprocess.Popen(
+		[sys.executable, '-m', 'benchmarks.owm_stub', '--port', '0', '--latency', str(latency),
+		 '--jitter', str(jitter), '--not-found', str(not_found), '--too-many', str(too_many),
+		 '--seed', str(seed)],
+		stdout=subprocess.PIPE, universal_newlines=True,
+		env=dict(os.environ, PYTHONPATH=os.getcwd()))
+	port = process.stdout.readline().split()[-1]
+	return process, "http://127.0.0.1:{}/data/2.5/forecast".format(port)
+
+def run_forecast(database, url, plan, workers, commit_every, retry_base, shards=None):
+	"""
+	Run forecast.main() once in a scratch working directory.
+
+	:return: results <dict>, per-region timings are only collected without shards.
+	"""
+	# forecast.py reads its settings on import
+	os.environ.update(API_URL_OW=url, API_PLAN_OW=plan, API_WORKERS_OW=str(workers),
+					  API_KEY_OW='benchmark', DB_COMMIT_EVERY=str(commit_every or 0),
+					  RETRY_BASE=str(retry_base), BREAKER_RESET=str(retry_base * 10))
+	import forecast
+	import metrics
+	from database_queries import DatabaseQueries
+
+	# time spent on each region once its response is downloaded
+	timings = []
+	process_region = forecast.process_region
+
+	def timed_process_region(db, region, data):
+		start = time.perf_counter()
+		process_region(db, region, data)
+		timings.append(time.perf_counter() - start)
+
+	forecast.process_region = timed_process_region
+
+	database = os.path.abspath(database)
+	workdir = tempfile.mkdtemp(prefix='bench-')
+	cwd = os.getcwd()
+	os.chdir(workdir)
+	try:
+		# errors.txt, archive and data version go to scratch directory
+		forecast.ARCHIVE_DIR = os.path.join(workdir, 'archive')
+		db = DatabaseQueries(database)
+		# debug output goes to log file as with forecast.sh
+		with open('log.txt', 'w') as log, contextlib.redirect_stdout(log):
+			start = time.perf_counter()
+			failed = forecast.main(db, shards)
+			elapsed = time.perf_counter() - start
+		commits = db.commits
+		db.close()
+	finally:
+		os.chdir(cwd)
+		forecast.process_region = process_region
+
+	# shard workers report through metrics
+	processed = len(timings) or sum(total for name, labels, kind, _, _, total, _ in metrics.registry.rows()
+									if name == 'forecast_regions_total' and '"ok"' in labels)
+	return {'processed': int(processed),
+			'failed': len(failed),
+			'elapsed_s': round(elapsed, 3),
+			'regions_per_s': round(processed / elapsed, 1) if elapsed else None,
+			'p50_ms': round(percentile(timings, 0.5) * 1000, 3) if timings else None,
+			'p99_ms': round(percentile(timings, 0.99) * 1000, 3) if timings else None,
+			'mean_ms': round(statistics.mean(timings) * 1000, 3) if timings else None,
+			'commits': commits,
+			# kilobytes on Linux
+			'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+			'workdir': workdir}
+
+def git_revision():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+									   universal_newlines=True, stderr=subprocess.DEVNULL).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def compare(results, baseline):
+	"""
+	Print relative change of results against baseline file.
+
+	:param results: results of this run <dict>.
+	:param baseline: results of a previous run <dict>.
+	:return: void function.
+	"""
+	print("against {} ({}):".format(baseline.get('revision'), baseline.get('timestamp')))
+	for key in ('regions_per_s', 'p50_ms', 'p99_ms', 'commits', 'peak_rss_mb'):
+		before, after = baseline['results'].get(key), results['results'].get(key)
+		if before and after is not None:
+			print("  {:14} {:>10} -> {:>10} ({:+.1f}%)".format(
+				key, before, after, (after - before) / before * 100))
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--database', help="existing database, a synthetic one is generated if not set")
+	parser.add_argument('--regions', type=int, default=142)
+	parser.add_argument('--years', type=float, default=1)
+	parser.add_argument('--latency', type=float, default=0, help="stub response delay, ms")
+	parser.add_argument('--jitter', type=float, default=0, help="stub extra random delay, ms")
+	parser.add_argument('--not-found', type=float, default=0, help="share of 404 responses")
+	parser.add_argument('--too-many', type=float, default=0, help="share of 429 responses")
+	parser.add_argument('--plan', default='enterprise', help="API plan of rate limiter")
+	parser.add_argument('--workers', type=int, default=8)
+	parser.add_argument('--commit-every', type=int, default=0)
+	parser.add_argument('--retry-base', type=float, default=0.1, help="first retry delay, s")
+	parser.add_argument('--shards', type=int, help="worker processes of forecast.py")
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--output', help="write results to JSON file")
+	parser.add_argument('--compare', help="JSON file of a previous run")
+	args = parser.parse_args()
+
+	database = args.database
+	if not database:
+		database = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'weather.db')
+		start = time.perf_counter()
+		generate(database, args.regions, args.years, args.seed)
+		print("generated {} regions in {:.1f} s".format(args.regions, time.perf_counter() - start))
+
+	stub, url = start_stub(args.latency, args.jitter, args.not_found, args.too_many, args.seed)
+	try:
+		results = run_forecast(database, url, args.plan, args.workers, args.commit_every,
+							   args.retry_base, args.shards)
+	finally:
+		stub.terminate()
+		stub.wait()
+
+	report = {'revision': git_revision(),
+			  'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+			  'parameters': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+			  'results': results}
+	print(json.dumps(report, indent=2))
+	if args.output:
+		with open(args.output, 'w') as file:
+			json.dump(report, file, indent=2)
+	if args.compare:
+		with open(args.compare) as file:
+			compare(report, json.load(file))
+
+
+if __name__ == "__main__":
+	main()
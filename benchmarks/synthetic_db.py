@@ -0,0 +1,148 @@
+"""
+Synthetic weather database for benchmarks: any number of regions with
+years of daily history and ready region pages, same schema as weather.db.
+
+Run from the project root:
+
+	$ python -m benchmarks.synthetic_db --output bench.db --regions 50000 --years 3
+"""
+import argparse
+import datetime
+import math
+import os
+import random
+import sqlite3
+
+import forecast_functions as ff
+from database_queries import DatabaseQueries
+from migrations import migrate
+from region import Region
+
+# schema of weather.db before migrations, migrations.py brings it up to date
+BASE_SCHEMA = [
+	"""CREATE TABLE IF NOT EXISTS "history" (
+		`id`	INTEGER NOT NULL,
+		`region_id`	INTEGER,
+		`temp`	REAL,
+		`date`	TEXT,
+		`datetime`	TEXT,
+		PRIMARY KEY(`id`))""",
+	"""CREATE TABLE IF NOT EXISTS "today" (
+		`id`	INTEGER NOT NULL,
+		`region_id`	INTEGER,
+		{},
+		`datetime`	TEXT DEFAULT null,
+		PRIMARY KEY(`id`))""".format(",\n\t\t".join(
+			"`hour_{}`\tREAL DEFAULT null".format(x) for x in range(0, 24, 3))),
+	"""CREATE TABLE IF NOT EXISTS "graph" (
+		`id`	INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+		`region_id`	INTEGER,
+		{},
+		`datetime`	TEXT DEFAULT NULL)""".format(",\n\t\t".join(
+			"`temp_{0}`\tREAL DEFAULT NULL,\n\t\t`date_{0}`\tTEXT".format(x) for x in range(1, 11))),
+	"""CREATE TABLE IF NOT EXISTS "regions" (
+		`id`	INTEGER NOT NULL,
+		`name`	TEXT,
+		`name_RU`	TEXT,
+		`latin`	TEXT,
+		`country`	TEXT,
+		`woeid`	INTEGER,
+		`timezone`	TEXT,
+		`heating_date`	TEXT,
+		`heating_date_RU`	TEXT,
+		`last_date`	INTEGER,
+		PRIMARY KEY(`id`))""",
+]
+
+def seasonal_temp(region_id, date, rng=None):
+	"""
+	Plausible daily mean temperature: yearly sine wave shifted per region plus noise.
+
+	:param region_id: region id <int>.
+	:param date: date <datetime.date>.
+	:param rng: instance of random.Random for noise <object>, no noise if not given.
+	:return: temperature <float>.
+	"""
+	# coldest in mid-January, regions differ in climate
+	mean = 5 - region_id % 15
+	wave = -15 * math.cos(2 * math.pi * (date.timetuple().tm_yday - 15) / 365.25)
+	noise = rng.gauss(0, 3) if rng else 0
+	return round(mean + wave + noise, 2)
+
+def generate(path, regions=142, years=1, seed=0, end=None):
+	"""
+	Create synthetic database. Existing file is replaced.
+
+	:param path: database path <string>.
+	:param regions: number of regions <int>.
+	:param years: years of daily history per region <float>.
+	:param seed: random seed <int>.
+	:param end: last history date <datetime.date>, yesterday by default.
+	:return: void function.
+	"""
+	if os.path.exists(path):
+		os.remove(path)
+	rng = random.Random(seed)
+	end = end or datetime.date.today() - datetime.timedelta(days=1)
+	days = [end - datetime.timedelta(days=x) for x in range(int(years * 365), 0, -1)] + [end]
+
+	con = sqlite3.connect(path)
+	for statement in BASE_SCHEMA:
+		con.execute(statement)
+
+	con.executemany("""INSERT INTO regions(id, name, name_RU, latin, country, woeid, timezone,
+		heating_date, heating_date_RU, last_date) VALUES(?, ?, ?, ?, ?, ?, ?, NULL, NULL, 0)""",
+		((x, "Регион {}".format(x), "Регионе {}".format(x), "Region {}".format(x), "Россия",
+		  x, "UTC+{}".format(2 + x % 11)) for x in range(1, regions + 1)))
+	con.executemany("""INSERT INTO today(region_id) VALUES(?)""",
+					((x,) for x in range(1, regions + 1)))
+	con.executemany("""INSERT INTO graph(region_id) VALUES(?)""",
+					((x,) for x in range(1, regions + 1)))
+
+	# history goes in date order, as forecast.py appends it day by day
+	con.executemany("""INSERT INTO history(region_id, temp, date, datetime) VALUES(?, ?, ?, ?)""",
+					((region_id, seasonal_temp(region_id, day, rng), day.isoformat(),
+					  "{} 23:05:00".format(day.isoformat()))
+					 for day in days for region_id in range(1, regions + 1)))
+	con.commit()
+	con.close()
+
+	db = DatabaseQueries(path)
+	migrate(db)
+	fill_pages(db, end)
+	db.close()
+
+def fill_pages(db, end, days=5):
+	"""
+	Save region pages from last history days and a noiseless forecast,
+	so that web app can be load-tested without running forecast.py.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:param end: last history date <datetime.date>.
+	:param days: number of forecast days <int>.
+	:return: void function.
+	"""
+	regions = Region.prefetch(db, list(range(1, db.regions('regions') + 1)))
+	with db.batch():
+		for region in regions.values():
+			forecast = {}
+			for x in range(1, days + 1):
+				date = end + datetime.timedelta(days=x)
+				forecast[date] = seasonal_temp(region.id, date)
+			ff.save_page(db, region, {**region.historical, **forecast})
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--output', default='bench.db')
+	parser.add_argument('--regions', type=int, default=142)
+	parser.add_argument('--years', type=float, default=1)
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+
+	generate(args.output, args.regions, args.years, args.seed)
+	print("{} regions, {} years of history written to {}".format(
+		args.regions, args.years, args.output))
+
+
+if __name__ == "__main__":
+	main()
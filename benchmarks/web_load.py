@@ -0,0 +1,235 @@
+"""
+Latency load test of application.py routes under concurrency: Flask test
+client and a real local WSGI server, region popularity following Zipf's law.
+Exits with code 1 if a route exceeds latency budget.
+
+Run from the project root:
+
+	$ python -m benchmarks.web_load --regions 20000 --requests 20000 --concurrency 16 --budget-p99 50
+	$ python -m benchmarks.web_load --database weather.db --mode server --output web.json
+"""
+import argparse
+import datetime
+import http.client
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.pipeline import git_revision, percentile
+from benchmarks.synthetic_db import generate
+
+# share of requests per route
+ROUTE_MIX = [('/', 0.15),
+			 ('/region', 0.6),
+			 ('/urlforjsonqueries', 0.25)]
+
+def zipf_weights(n, exponent):
+	"""
+	Cumulative weights of Zipf distribution over n ranks.
+
+	:param n: number of ranks <int>.
+	:param exponent: distribution exponent, about 1 for web traffic <float>.
+	:return: cumulative weights <list>.
+	"""
+	return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+def workload(regions, requests, exponent, seed):
+	"""
+	Request paths: route by ROUTE_MIX, region by popularity. Every third
+	JSON request asks for all regions, the rest for a single one.
+
+	:param regions: list of tuples (name, latin) in order of popularity <list>.
+	:param requests: number of requests <int>.
+	:param exponent: Zipf exponent <float>.
+	:param seed: random seed <int>.
+	:return: list of tuples (route, path) <list>.
+	"""
+	rng = random.Random(seed)
+	weights = zipf_weights(len(regions), exponent)
+	routes = rng.choices([x for x, _ in ROUTE_MIX], [x for _, x in ROUTE_MIX], k=requests)
+	chosen = rng.choices(regions, cum_weights=weights, k=requests)
+	paths = []
+	for route, (name, latin) in zip(routes, chosen):
+		if route == '/region':
+			paths.append((route, '/region?' + urllib.parse.urlencode({'region': name})))
+		elif route == '/urlforjsonqueries' and rng.random() > 1 / 3:
+			paths.append((route, route + '?' + urllib.parse.urlencode({'region': latin})))
+		else:
+			paths.append((route, route))
+	return paths
+
+def client_sender(app):
+	"""
+	Request function using Flask test client, one client per thread.
+
+	:param app: Flask application <object>.
+	:return: function of path returning status code <function>.
+	"""
+	local = threading.local()
+
+	def send(path):
+		if not hasattr(local, 'client'):
+			local.client = app.test_client()
+		return local.client.get(path, headers={'Accept-Encoding': 'gzip'}).status_code
+	return send
+
+def server_sender(app):
+	"""
+	Start app in a threaded WSGI server on a free port, requests go over HTTP
+	with one keep-alive connection per thread.
+
+	:param app: Flask application <object>.
+	:return: function of path returning status code <function>, server <object>.
+	"""
+	from werkzeug.serving import WSGIRequestHandler, make_server
+
+	# keep-alive needs HTTP/1.1
+	handler = type('Handler', (WSGIRequestHandler,), {'protocol_version': 'HTTP/1.1',
+													  'log_request': lambda *args: None})
+	server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=handler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	port = server.server_port
+	local = threading.local()
+
+	def send(path):
+		if not hasattr(local, 'connection'):
+			local.connection = http.client.HTTPConnection('127.0.0.1', port)
+		try:
+			local.connection.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+			response = local.connection.getresponse()
+		except (http.client.HTTPException, OSError):
+			# server closed connection, reconnect once
+			local.connection = http.client.HTTPConnection('127.0.0.1', port)
+			local.connection.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+			response = local.connection.getresponse()
+		response.read()
+		return response.status
+	return send, server
+
+def load(send, paths, concurrency):
+	"""
+	Send requests from concurrent workers and time each one.
+
+	:param send: function of path returning status code <function>.
+	:param paths: list of tuples (route, path) <list>.
+	:param concurrency: number of workers <int>.
+	:return: dictionary with key=route and value=list of latencies in seconds,
+	number of failed requests <int>, wall time in seconds <float>.
+	"""
+	latencies = {route: [] for route, _ in ROUTE_MIX}
+	failures = []
+	lock = threading.Lock()
+
+	def worker(chunk):
+		timings, failed = [], 0
+		for route, path in chunk:
+			start = time.perf_counter()
+			status = send(path)
+			timings.append((route, time.perf_counter() - start))
+			failed += status not in (200, 304)
+		with lock:
+			for route, elapsed in timings:
+				latencies[route].append(elapsed)
+			failures.append(failed)
+
+	start = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=concurrency) as executor:
+		list(executor.map(worker, [paths[x::concurrency] for x in range(concurrency)]))
+	return latencies, sum(failures), time.perf_counter() - start
+
+def summary(latencies, failures, wall):
+	"""
+	:return: throughput and latency percentiles in milliseconds per route <dict>.
+	"""
+	routes = {}
+	for route, values in latencies.items():
+		if not values:
+			continue
+		routes[route] = {'requests': len(values),
+						 'rps': round(len(values) / wall, 1),
+						 'p50_ms': round(percentile(values, 0.5) * 1000, 3),
+						 'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+						 'p99_ms': round(percentile(values, 0.99) * 1000, 3)}
+	total = sum(len(x) for x in latencies.values())
+	return {'routes': routes, 'requests': total, 'failures': failures,
+			'rps': round(total / wall, 1), 'wall_s': round(wall, 3)}
+
+def over_budget(results, budgets):
+	"""
+	:param results: results per mode <dict>.
+	:param budgets: dictionary with key=percentile name and value=milliseconds <dict>.
+	:return: budget violations <list>.
+	"""
+	violations = []
+	for mode, result in results.items():
+		for route, stats in result['routes'].items():
+			for key, budget in budgets.items():
+				if budget is not None and stats[key] > budget:
+					violations.append("{} {}: {} {} ms > {} ms".format(mode, route, key, stats[key], budget))
+		if result['failures']:
+			violations.append("{}: {} failed requests".format(mode, result['failures']))
+	return violations
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--database', help="existing database, a synthetic one is generated if not set")
+	parser.add_argument('--regions', type=int, default=5000, help="regions of synthetic database")
+	parser.add_argument('--mode', choices=['client', 'server', 'both'], default='both')
+	parser.add_argument('--requests', type=int, default=5000)
+	parser.add_argument('--concurrency', type=int, default=8)
+	parser.add_argument('--zipf', type=float, default=1.1, help="exponent of region popularity")
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--budget-p50', type=float, help="ms")
+	parser.add_argument('--budget-p95', type=float, help="ms")
+	parser.add_argument('--budget-p99', type=float, help="ms")
+	parser.add_argument('--output', help="write results to JSON file")
+	args = parser.parse_args()
+
+	database = args.database
+	if not database:
+		database = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'weather.db')
+		generate(database, args.regions, years=0.1, seed=args.seed)
+	# application.py opens database on import
+	os.environ['WEATHER_DB'] = os.path.abspath(database)
+	from application import app, db
+
+	regions = db.query("""SELECT name, latin FROM regions ORDER BY id""")
+	# popularity order shouldn't follow ids
+	random.Random(args.seed).shuffle(regions)
+	paths = workload(regions, args.requests, args.zipf, args.seed)
+
+	results = {}
+	if args.mode in ('client', 'both'):
+		results['client'] = summary(*load(client_sender(app), paths, args.concurrency))
+	if args.mode in ('server', 'both'):
+		send, server = server_sender(app)
+		try:
+			results['server'] = summary(*load(send, paths, args.concurrency))
+		finally:
+			server.shutdown()
+
+	report = {'revision': git_revision(),
+			  'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+			  'parameters': {k: v for k, v in vars(args).items() if k != 'output'},
+			  'results': results}
+	print(json.dumps(report, indent=2))
+	if args.output:
+		with open(args.output, 'w') as file:
+			json.dump(report, file, indent=2)
+
+	violations = over_budget(results, {'p50_ms': args.budget_p50, 'p95_ms': args.budget_p95,
+									   'p99_ms': args.budget_p99})
+	if violations:
+		print("latency budget exceeded:\n  " + "\n  ".join(violations), file=sys.stderr)
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,70 @@
+import collections
+import threading
+import time
+
+class ResponseCache:
+	"""
+	Thread-safe bounded LRU cache with time to live. Initializes with maximum
+	number of entries and TTL in seconds. Keys should include data version,
+	so that entries are invalidated exactly when new data lands; TTL only
+	guards against a stuck version stamp.
+	"""
+	def __init__(self, maxsize=1024, ttl=6 * 3600, clock=time.monotonic):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self._clock = clock
+		self._entries = collections.OrderedDict()
+		self._lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def get(self, key):
+		"""
+		Get value for key and mark it recently used.
+
+		:param key: hashable key.
+		:return: cached value or None if missing or expired.
+		"""
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None or entry[0] < self._clock():
+				if entry is not None:
+					del self._entries[key]
+				self.misses += 1
+				return None
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return entry[1]
+
+	def set(self, key, value):
+		"""
+		Save value for key, evict least recently used entries above maxsize.
+
+		:param key: hashable key.
+		:param value: value to cache.
+		:return: void function.
+		"""
+		with self._lock:
+			self._entries[key] = (self._clock() + self.ttl, value)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.maxsize:
+				self._entries.popitem(last=False)
+				self.evictions += 1
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def stats(self):
+		"""
+		Cache counters.
+
+		:return: dictionary with hits, misses, evictions and size <dict>.
+		"""
+		with self._lock:
+			return {'hits': self.hits,
+					'misses': self.misses,
+					'evictions': self.evictions,
+					'size': len(self._entries),
+					'maxsize': self.maxsize}
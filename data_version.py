@@ -0,0 +1,34 @@
+import os
+import time
+
+# data version stamp, bumped by forecast.py after every committed run
+VERSION_FILE = 'data_version.txt'
+
+def read_version(path=VERSION_FILE):
+	"""
+	Read data version stamp. Cheap enough to call on every request,
+	doesn't touch database.
+
+	:param path: version file path <string>.
+	:return: data version <string>, '0' if forecast has never run.
+	"""
+	try:
+		with open(path, 'r') as file:
+			return file.read().strip() or '0'
+	except FileNotFoundError:
+		return '0'
+
+def bump_version(path=VERSION_FILE):
+	"""
+	Set new data version stamp: milliseconds since epoch, always greater than
+	the previous one. File is replaced atomically, so readers never see it empty.
+
+	:param path: version file path <string>.
+	:return: new data version <string>.
+	"""
+	version = str(max(int(time.time() * 1000), int(read_version(path)) + 1))
+	temp_path = '{}.{}.tmp'.format(path, os.getpid())
+	with open(temp_path, 'w') as file:
+		file.write(version)
+	os.replace(temp_path, path)
+	return version
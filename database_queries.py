@@ -1,11 +1,237 @@
+import contextlib
 import sqlite3
+import threading
+import time
+
+import metrics
 
 class DatabaseQueries:
 	"""
 	Class of sqlite3 database queries. Initializes with database path.
+
+	Connections are long-lived: every thread gets its own connection on first
+	use (Flask workers, the batch job) and keeps it until release() or close().
+	Released connections go back to a bounded pool for the next thread, so
+	servers that start a thread per request reuse them. Generated SQL text is cached per query shape, so sqlite3 can reuse its
+	prepared statements on the same connection.
+
+	Writes commit one by one, unless they are made inside batch(), see there.
 	"""
-	def __init__(self, database):
+	def __init__(self, database, pool_size=8):
 		self.database = database
+		# idle connections kept for reuse at most
+		self.pool_size = pool_size
+		# one connection per thread
+		self._local = threading.local()
+		# every open connection, used by close()
+		self._connections = []
+		# connections released by threads, handed to the next ones
+		self._idle = []
+		self._lock = threading.Lock()
+		# SQL text cache: (kind, table, columns, conditions) -> SQL <string>
+		self._statements = {}
+		# metric labels of cached SQL: SQL -> (kind, table)
+		self._labels = {}
+		# number of committed transactions
+		self.commits = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def connection(self):
+		"""
+		Return connection for current thread, open it on first use.
+
+		:return: sqlite3 connection <object>.
+		"""
+		con = getattr(self._local, 'connection', None)
+		if con is None:
+			with self._lock:
+				con = self._idle.pop() if self._idle else None
+			if con is None:
+				# connection is closed from whatever thread calls close()
+				con = sqlite3.connect(self.database, check_same_thread=False)
+				with self._lock:
+					self._connections.append(con)
+			self._local.connection = con
+		return con
+
+	def release(self):
+		"""
+		Return connection of current thread to the pool, e. g. at the end of
+		a web request. It is closed if the pool is full.
+
+		:return: void function.
+		"""
+		con = getattr(self._local, 'connection', None)
+		if con is None:
+			return
+		self._local.connection = None
+		if con.in_transaction:
+			con.rollback()
+		with self._lock:
+			if len(self._idle) < self.pool_size:
+				self._idle.append(con)
+				return
+			self._connections.remove(con)
+		con.close()
+
+	def close(self):
+		"""
+		Close all connections opened by this instance.
+
+		:return: void function.
+		"""
+		with self._lock:
+			connections, self._connections = self._connections, []
+			self._idle = []
+		for con in connections:
+			con.close()
+		# threads will reconnect on next call
+		self._local = threading.local()
+
+	@contextlib.contextmanager
+	def batch(self, chunk_size=None):
+		"""
+		Collect writes of current thread and flush them with executemany
+		inside one transaction. Commit on exit, rollback on exception.
+		Use with checkpoint() to commit every chunk_size units of work.
+
+		Writes run in the order they were made, consecutive writes with the
+		same SQL text go to one executemany call. Reads flush pending writes
+		first, so they see them.
+
+		:param chunk_size: units of work per transaction <int>, one transaction
+		for the whole batch if None.
+		:return: context manager.
+		"""
+		# nested batches join the outer one
+		if getattr(self._local, 'pending', None) is not None:
+			yield self
+			return
+
+		self._local.pending = []
+		self._local.chunk_size = chunk_size
+		self._local.units = 0
+		try:
+			yield self
+			self.flush()
+			self._commit()
+		except BaseException:
+			self._local.pending = []
+			self.connection().rollback()
+			raise
+		finally:
+			self._local.pending = None
+
+	def checkpoint(self):
+		"""
+		Mark end of a unit of work (e. g. one region) in batch.
+		Commit if chunk_size units have been collected, so that every unit
+		is either saved completely or not at all.
+
+		:return: void function.
+		"""
+		if getattr(self._local, 'pending', None) is None:
+			return
+		self._local.units += 1
+		chunk_size = self._local.chunk_size
+		if chunk_size and self._local.units % chunk_size == 0:
+			self.flush()
+			self._commit()
+
+	def flush(self):
+		"""
+		Execute pending batch writes without committing.
+
+		:return: void function.
+		"""
+		pending = getattr(self._local, 'pending', None)
+		if not pending:
+			return
+		con = self.connection()
+		for sql, rows in pending:
+			self._execute(con.executemany, sql, rows)
+		pending.clear()
+
+	def _commit(self):
+		with metrics.timer('db_commit_seconds'):
+			self.connection().commit()
+		self.commits += 1
+
+	def _execute(self, method, sql, data):
+		"""
+		Run statement and record its duration by kind and table.
+
+		:param method: execute or executemany of connection <function>.
+		:param sql: SQL statement <string>.
+		:param data: data for placeholders <tuple> or list of tuples for executemany.
+		:return: sqlite3 cursor <object>.
+		"""
+		kind, table = self._labels.get(sql, ('query', ''))
+		start = time.perf_counter()
+		try:
+			return method(sql, data)
+		finally:
+			metrics.observe('db_query_seconds', time.perf_counter() - start, kind=kind, table=table)
+
+	def _write(self, sql, data):
+		"""
+		Execute and commit write, or add it to the batch.
+
+		:param sql: SQL statement <string>.
+		:param data: data for placeholders <tuple>.
+		:return: void function.
+		"""
+		pending = getattr(self._local, 'pending', None)
+		if pending is not None:
+			# runs of the same statement, in order
+			if pending and pending[-1][0] == sql:
+				pending[-1][1].append(data)
+			else:
+				pending.append((sql, [data]))
+			return
+		self._execute(self.connection().execute, sql, data)
+		self._commit()
+
+	def _statement(self, kind, table, columns, conditions):
+		"""
+		Build SQL text for given query shape or return it from cache.
+
+		:param kind: 'update', 'select', 'delete', 'insert' or 'replace' <string>.
+		:param table: database table <string>.
+		:param columns: destinations or filters <list>, empty for SELECT *.
+		:param conditions: table columns for WHERE clause <list>.
+		:return: SQL <string>.
+		"""
+		key = (kind, table, tuple(columns), tuple(conditions))
+		sql = self._statements.get(key)
+		if sql is not None:
+			return sql
+
+		where = ""
+		if conditions:
+			where = " WHERE " + " AND ".join("{} = ?".format(x) for x in conditions)
+
+		if kind == 'update':
+			sql = "UPDATE {} SET {}".format(
+				table, ", ".join("{} = ?".format(x) for x in columns)) + where
+		elif kind == 'delete':
+			sql = "DELETE FROM {}".format(table) + where
+		elif kind == 'select':
+			sql = "SELECT {} FROM {}".format(
+				", ".join(columns) if columns else "*", table) + where
+		else:
+			sql = "{} INTO {}({}) VALUES({})".format(
+				"INSERT" if kind == 'insert' else "INSERT OR REPLACE",
+				table, ", ".join(columns), ",".join("?" * len(columns)))
+
+		self._statements[key] = sql
+		self._labels[sql] = (kind, table)
+		return sql
 
 	def update(self, table, destinations, data, conditions, condition_data):
 		"""
@@ -19,50 +245,10 @@ class DatabaseQueries:
 		:param condition_data: data to match conditions <tuple>.
 		:return: void function.
 		"""
-		# connect to database
-		con = sqlite3.connect(self.database)
-		db = con.cursor()
+		sql = self._statement('update', table, destinations, conditions)
 
 		# write data to database
-		if len(conditions) == 0:
-			if len(destinations) == 1:
-				mytuples = data + condition_data
-				db.execute("""UPDATE {} SET {} = ?""".format(
-					table, *destinations), mytuples)
-			else:
-				mytuples = data + condition_data
-				db.execute(("UPDATE {} SET {} = ?" + ((", {} = ?") *
-						   (len(destinations) - 1))).format(
-					table, *destinations), mytuples)
-
-		if len(conditions) == 1:
-			if len(destinations) == 1:
-				mytuples = data + condition_data
-				db.execute("""UPDATE {} SET {} = ? WHERE {} = ?""".format(
-					table, *destinations, *conditions), mytuples)
-			else:
-				mytuples = data + condition_data
-				db.execute(("UPDATE {} SET {} = ?" + ((", {} = ?") *
-						   (len(destinations) - 1)) + " WHERE {} = ?").format(
-					table, *destinations, *conditions), mytuples)
-
-		if len(conditions) > 1:
-			if len(destinations) == 1:
-				mytuples = data + condition_data
-				db.execute(("UPDATE {} SET {} = ? WHERE {} = ?" +
-						   (("AND {} = ? ") * (len(conditions) - 1))).format(
-					table, *destinations, *conditions), mytuples)
-			else:
-				mytuples = data + condition_data
-				db.execute(("UPDATE {} SET {} = ?" + ((", {} = ?") *
-						   (len(destinations) - 1)) + " WHERE {} = ?" +
-						   (("AND {} = ? ") * (len(conditions) - 1))).format(
-					table, *destinations, *conditions), mytuples)
-
-		con.commit()
-
-		# close connection
-		db.close()
+		self._write(sql, data + condition_data)
 
 	def select(self, table, conditions, condition_data, filters=None):
 		"""
@@ -75,64 +261,9 @@ class DatabaseQueries:
 		:param filters: table columns for selection <list>, set to None by default.
 		:return: list of tuples of size one <list>, for example [(1, 2, 3)]
 		"""
-		# connect to database
-		con = sqlite3.connect(self.database)
-		db = con.cursor()
-
-		if not filters:
-			if len(conditions) == 0:
-				db.execute("""SELECT * FROM {}""".format(table))
-				rows = db.fetchall()
-				db.close()
-				return rows
-
-			if len(conditions) > 0:
-				db.execute(("SELECT * FROM {} WHERE {} = ?" +
-							   (("AND {} = ? ") * (len(conditions) - 1))).format(
-					table, *conditions), condition_data)
-				rows = db.fetchall()
-				db.close()
-				return rows
-
-		if filters and len(filters) == 1:
-			if len(conditions) == 0:
-				db.execute("""SELECT {} FROM {}""".format(*filters, table))
-				rows = db.fetchall()
-				db.close()
-				return rows
-
-			if len(conditions) > 0:
-				db.execute(("SELECT {} FROM {} WHERE {} = ?" +
-							(("AND {} = ? ") * (len(conditions) - 1))).format(
-					*filters, table, *conditions), condition_data)
-				rows = db.fetchall()
-				db.close()
-				return rows
-
-		if filters and len(filters) > 1:
-			if len(conditions) == 0:
-				db.execute(("SELECT {}" + ((", {}") * (len(filters) - 1)) + " FROM {}").format(
-					*filters, table))
-				rows = db.fetchall()
-				db.close()
-				return rows
-
-			if len(conditions) == 1:
-				print(("SELECT {}" + ((", {}") * (len(filters) - 1)) + " FROM {} WHERE {} = ?").format(
-					*filters, table, *conditions))
-				db.execute(("SELECT {}" + ((", {}") * (len(filters) - 1)) + " FROM {} WHERE {} = ?").format(
-					*filters, table, *conditions), condition_data)
-				rows = db.fetchall()
-				db.close()
-				return rows
-
-			if len(conditions) > 1:
-				db.execute(("SELECT {}" + ((", {}") * (len(filters) - 1)) + " FROM {} WHERE {} = ?" +
-							(("AND {} = ? ") * (len(conditions) - 1))).format(
-					*filters, table, *conditions), condition_data)
-				rows = db.fetchall()
-				db.close()
-				return rows
+		sql = self._statement('select', table, filters or [], conditions)
+
+		return self.query(sql, condition_data)
 
 	def insert(self, table, destinations, data):
 		"""
@@ -143,17 +274,60 @@ class DatabaseQueries:
 		:param data: new data <tuple>.
 		:return: void function.
 		"""
-		# connect to database
-		con = sqlite3.connect(self.database)
-		db = con.cursor()
+		sql = self._statement('insert', table, destinations, [])
 
 		# write data to database
-		db.execute("INSERT INTO {}({}) VALUES({})".format(
-			table, ", ".join(destinations), ",".join(list("?" * len(data)))), data)
-		con.commit()
+		self._write(sql, data)
 
-		# close connection
-		db.close()
+	def replace(self, table, destinations, data):
+		"""
+		Insert new row or replace existing one with the same primary key.
+
+		:param table: database table <string>.
+		:param destinations: table columns for update <list>.
+		:param data: new data <tuple>.
+		:return: void function.
+		"""
+		sql = self._statement('replace', table, destinations, [])
+
+		# write data to database
+		self._write(sql, data)
+
+	def delete(self, table, conditions, condition_data):
+		"""
+		Delete rows matching conditions from table.
+
+		:param table: database table <string>.
+		:param conditions: table columns for WHERE clause <list>.
+		:param condition_data: data to match conditions <tuple>.
+		:return: void function.
+		"""
+		sql = self._statement('delete', table, [], conditions)
+
+		# write data to database
+		self._write(sql, condition_data)
+
+	def query(self, sql, data=()):
+		"""
+		Run raw SQL, use for set-based queries helpers above can't express.
+
+		:param sql: SQL statement <string>.
+		:param data: data for placeholders <tuple>.
+		:return: list of tuples <list>.
+		"""
+		# make pending batch writes visible
+		self.flush()
+		return self._execute(self.connection().execute, sql, data).fetchall()
+
+	def write(self, sql, data=()):
+		"""
+		Run raw write SQL, batched like the helpers above inside batch().
+
+		:param sql: SQL statement <string>.
+		:param data: data for placeholders <tuple>.
+		:return: void function.
+		"""
+		self._write(sql, data)
 
 	def regions(self, table):
 		"""
@@ -162,12 +336,5 @@ class DatabaseQueries:
 		:param table: database table <string>.
 		:return: number of regions <int>.
 		"""
-		con = sqlite3.connect(self.database)
-		db = con.cursor()
-		db.execute("""SELECT COUNT(*) FROM {}""".format(table))
-		length = db.fetchall()
-		db.close()
+		length = self.query("""SELECT COUNT(*) FROM {}""".format(table))
 		return length[0][0]
-		
-
-
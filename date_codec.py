@@ -0,0 +1,97 @@
+"""
+Fixed-format date parsing and formatting for database and API timestamps
+('2019-04-07', '2019-04-07 21:00:00') and Russian date rendering.
+The same dates come up again and again (history rows, forecast days, graph
+labels), so results are kept in bounded LRU caches; datetime objects are
+immutable, so cached ones are safe to share.
+"""
+import datetime
+import functools
+
+# genitive month names for dates: '1 июня'
+MONTHS_RU = ('января', 'февраля', 'марта', 'апреля', 'мая', 'июня',
+			 'июля', 'августа', 'сентября', 'октября', 'ноября', 'декабря')
+
+# abbreviated month names for graph labels: '1 июн'
+MONTHS_RU_SHORT = ('янв', 'фев', 'мар', 'апр', 'мая', 'июн',
+				   'июл', 'авг', 'сент', 'окт', 'нояб', 'дек')
+
+# distinct dates kept per cache, a few years of days
+CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def parse_date(string):
+	"""
+	:param string: date like '2019-04-07' <string>.
+	:return: midnight of the date <datetime.datetime>.
+	"""
+	if len(string) == 10 and string[4] == string[7] == '-':
+		# fixed positions are sliced, faster than strptime
+		fields = (string[0:4], string[5:7], string[8:10])
+		if all(field.isdigit() for field in fields):
+			try:
+				return datetime.datetime(*map(int, fields))
+			except ValueError:
+				pass
+	# other layouts are parsed, or rejected, as before
+	return datetime.datetime.strptime(string, '%Y-%m-%d')
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def parse_datetime(string):
+	"""
+	:param string: timestamp like '2019-04-07 21:00:00' <string>.
+	:return: time <datetime.datetime>.
+	"""
+	if (len(string) == 19 and string[4] == string[7] == '-' and string[10] == ' '
+			and string[13] == string[16] == ':'):
+		fields = (string[0:4], string[5:7], string[8:10], string[11:13], string[14:16], string[17:19])
+		if all(field.isdigit() for field in fields):
+			try:
+				return datetime.datetime(*map(int, fields))
+			except ValueError:
+				pass
+	return datetime.datetime.strptime(string, '%Y-%m-%d %H:%M:%S')
+
+def parse_time(string):
+	"""
+	:param string: time like '21:00:00' <string>.
+	:return: time on 1900-01-01 <datetime.datetime>.
+	"""
+	return datetime.datetime.strptime(string, '%H:%M:%S')
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def format_date(date):
+	"""
+	:param date: date <datetime.date> or <datetime.datetime>.
+	:return: date like '2019-04-07' <string>.
+	"""
+	return '{:04d}-{:02d}-{:02d}'.format(date.year, date.month, date.day)
+
+def format_datetime(dt):
+	"""
+	Not cached: timestamps of runs and requests rarely repeat.
+
+	:param dt: time <datetime.datetime>.
+	:return: timestamp like '2019-04-07 21:00:00' <string>.
+	"""
+	if not isinstance(dt, datetime.datetime):
+		# dates are midnight, as with strftime
+		return dt.strftime('%Y-%m-%d %H:%M:%S')
+	return '{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}'.format(
+		dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
+
+def format_time(dt):
+	"""
+	:param dt: time <datetime.datetime> or <datetime.time>.
+	:return: time like '21:00:00' <string>.
+	"""
+	return '{:02d}:{:02d}:{:02d}'.format(dt.hour, dt.minute, dt.second)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def russian_date(date, short=False):
+	"""
+	:param date: date <datetime.date> or <datetime.datetime>.
+	:param short: abbreviated month name, for graph labels <bool>.
+	:return: date like '1 июня' or '1 июн' <string>.
+	"""
+	return '{} {}'.format(date.day, (MONTHS_RU_SHORT if short else MONTHS_RU)[date.month - 1])
@@ -0,0 +1,79 @@
+"""
+Lean decoder of OpenWeatherMap forecast responses: reads only what forecast.py
+needs, status, message and (timestamp, temperature) pairs of the forecast,
+straight from raw bytes into two compact arrays.
+
+Responses as API sends them are scanned with a regular expression, no objects
+are built for weather, wind, clouds and so on. Anything else is parsed in full,
+with orjson if it is installed or with json module.
+"""
+import array
+import collections
+import json
+import re
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+# full parser of responses
+loads = orjson.loads if orjson else json.loads
+
+# cod as string, like API sends it for 200 ('401' for int 401), message,
+# epoch seconds of forecast points <array.array 'q'> and their temperatures <array.array 'd'>
+Forecast = collections.namedtuple('Forecast', ['cod', 'message', 'epochs', 'temps'])
+
+# head of forecast response: {"cod":"200","message":0,"cnt":40,"list":[
+HEAD = re.compile(rb'\s*\{\s*"cod"\s*:\s*"200"\s*,\s*"message"\s*:\s*(-?[\d.eE+-]+)\s*,'
+				  rb'\s*"cnt"\s*:\s*(\d+)\s*,\s*"list"\s*:\s*\[')
+
+# forecast point starts with {"dt":1554757200,"main":{"temp":3.48
+POINT = re.compile(rb'\{\s*"dt"\s*:\s*(\d+)\s*,\s*"main"\s*:\s*\{\s*"temp"\s*:\s*(-?[\d.eE+-]+)')
+
+def decode(raw):
+	"""
+	Decode API response.
+
+	:param raw: API response <bytes>.
+	:return: Forecast <namedtuple>, cod is None if response is empty json.
+	"""
+	return scan(raw) or parse(raw)
+
+def scan(raw):
+	"""
+	Fast path for responses with code 200. Every point must start with dt
+	and main.temp, as API sends them, and there must be cnt of them.
+
+	:param raw: API response <bytes>.
+	:return: Forecast <namedtuple> or None if response has another layout.
+	"""
+	head = HEAD.match(raw)
+	if not head:
+		return None
+	points = POINT.findall(raw, head.end())
+	if len(points) != int(head.group(2)):
+		return None
+	return Forecast('200', json.loads(head.group(1)),
+					array.array('q', [int(x) for x, _ in points]),
+					array.array('d', [float(x) for _, x in points]))
+
+def parse(raw):
+	"""
+	Decode any response by parsing it in full.
+
+	:param raw: API response <bytes>.
+	:return: Forecast <namedtuple>, cod is None if response is empty json
+	or can't be decoded.
+	"""
+	try:
+		data = loads(raw)
+		if not data:
+			return Forecast(None, None, array.array('q'), array.array('d'))
+		points = data.get('list') or ()
+		return Forecast(str(data.get('cod')), data.get('message'),
+						array.array('q', [x['dt'] for x in points]),
+						array.array('d', [x['main']['temp'] for x in points]))
+	except (ValueError, TypeError, KeyError, AttributeError):
+		# not JSON or not a forecast, e.g. HTML error page of a proxy
+		return Forecast(None, None, array.array('q'), array.array('d'))
@@ -1,161 +1,367 @@
-import json
+import argparse
 import datetime
-import time
+import logging
 import os
 from database_queries import DatabaseQueries
 from region import Region
-from time_functions import to_datetime, dt_to_string
+from time_functions import from_epoch, dt_to_string
+from timezone_functions import utc_to_local_many
+from rate_limiter import TokenBucket, SharedTokenBucket
+from retry import Backoff, CircuitBreaker
+from data_version import bump_version
+from migrations import migrate
+from archive import ArchiveReader, ArchiveWriter, archive_path, find_archive
 import forecast_functions as ff
+import decoder
+import metrics
+import sharding
+import static_export
 
-db = DatabaseQueries("weather.db")
+log = logging.getLogger(__name__)
+
+# database file, can point to a copy or a synthetic benchmark database
+DATABASE = os.environ.get("WEATHER_DB", "weather.db")
 
 # set season start dates
 spring_season_start_date = '01-04'
 fall_season_start_date = '01-09'
-date_today = datetime.datetime.now().strftime("%d-%m")
-
-# check whether it's start of the season
-if date_today == spring_season_start_date or date_today == fall_season_start_date:
-	# if true reset all last dates to zero
-	ff.reset_last_dates(db)
 
-# count regions
-REGIONS = db.regions('regions')
 API_KEY = os.environ.get("API_KEY_OW")
-
-def main():
-	# set API call counter to zero
-	api_call_counter = 0
-
-	# set a list for misfired regions
-	misfired = []
-
-	# iterator is set to REGIONS or misfired regions
-	# if such exist
-	for i in ff.iterator(REGIONS):
-		# populate a Region class instance
-		region = Region('weather.db', i)
-
-		# collect API key and form a request
-		baseurl = "http://api.openweathermap.org/data/2.5/forecast?id={}&units=metric&APPID={}".format(
-			region.woeid, API_KEY)
-
-		# check for api calls: restriction 60 calls/minute for free plan
-		if api_call_counter == 59:
-			# DEBUG
-			print('Sleeping for 70 seconds...\n')
-			# pause for one minute
-			time.sleep(70)
-			# reset counter
-			api_call_counter = 0
-
-		# download data
-		result = ff.parse_api(baseurl)
-
-		# exit script if server is not responding for 45 minutes
-		if not result:
-			break
-
-		# increment api call counter
-		api_call_counter += 1
-
-		# read json
-		data = json.loads(result)
-
-		# in case of 404 error or empty data, consider region as misfired
-		if not data or data['cod'] == '404':
-			misfired.append(i)
-			# DEBUG
-			print('{} misfired\n'.format(i))
-			continue
-
-		# write 429 and 401 errors to errors.txt file
-		if data['cod'] == '429' or data['cod'] == '401':
+# forecast endpoint, can point to a local stub server
+API_URL = os.environ.get("API_URL_OW", "http://api.openweathermap.org/data/2.5/forecast")
+# subscription plan tier, sets allowed calls per minute
+API_PLAN = os.environ.get("API_PLAN_OW", "free")
+# number of concurrent API requests
+API_WORKERS = int(os.environ.get("API_WORKERS_OW", 8))
+# regions per transaction, one transaction per run if not set
+DB_COMMIT_EVERY = int(os.environ.get("DB_COMMIT_EVERY", 0)) or None
+# raw API responses of every run are kept here for replays
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+# attempts per region, first retry after RETRY_BASE seconds, doubling up to RETRY_CAP
+RETRY_ATTEMPTS = int(os.environ.get("RETRY_ATTEMPTS", 4))
+RETRY_BASE = float(os.environ.get("RETRY_BASE", 30))
+RETRY_CAP = float(os.environ.get("RETRY_CAP", 600))
+# pause all calls for BREAKER_RESET seconds after BREAKER_THRESHOLD upstream failures in a row
+BREAKER_THRESHOLD = int(os.environ.get("BREAKER_THRESHOLD", 5))
+BREAKER_RESET = float(os.environ.get("BREAKER_RESET", 60))
+# give up on remaining regions after this many seconds
+RUN_DEADLINE = float(os.environ.get("RUN_DEADLINE", 45 * 60))
+# pages and JSON API are rendered here after every run, if set
+STATIC_DIR = os.environ.get("STATIC_DIR")
+
+def process_region(db, region, forecast):
+	"""
+	Blend history, today and forecast of region from API response and save results.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:param region: instance of Region class <object>.
+	:param forecast: decoded API response with code 200 <decoder.Forecast>.
+	:return: void function.
+	"""
+	# collect current temperature
+	region.current_temp = forecast.temps[0]
+
+	# collect current hour
+	region.current_hour = from_epoch(forecast.epochs[0]).hour
+
+	with metrics.timer('forecast_stage_seconds', stage='timezone'):
+		# convert forecast to local time with DST, fixed offset if zone is unknown
+		local_times = utc_to_local_many(forecast.epochs, region.tz_name or region.timezone)
+		local_forecast = dict(zip(local_times, forecast.temps))
+
+	# bucket forecast by local date in one pass
+	with metrics.timer('forecast_stage_seconds', stage='aggregate'):
+		days = ff.aggregate_days(local_forecast)
+
+	# calculate average weather for today
+	with metrics.timer('forecast_stage_seconds', stage='today'):
+		if days.last_interval:
+			region.today_forecast = {days.today: ff.calculate_today_last(region, db, days)}
+		else:
+			region.today_forecast = {days.today: ff.calculate_today_intermediate(region, db, days)}
+
+	# calculate forecast
+	region.forecast = days.means
+
+	# blend weather data
+	blended_data = {**region.historical, **region.today_forecast, **region.forecast}
+
+	# save blended weather data for graphing
+	destinations = ['temp_{}'.format(x) for x in range(1, 11)] +\
+				   ['date_{}'.format(x) for x in range(1, 11)] +\
+				   ['datetime']
+
+	# new regions have no history yet, leave missing graph columns empty
+	points = list(blended_data.items())[:10]
+	points += [(None, None)] * (10 - len(points))
+
+	data = tuple([x for _, x in points]) +\
+		   tuple([dt_to_string(x, time=False) if x else None for x, _ in points]) +\
+		   (dt_to_string(ff.now()),)
+
+	graph_params = {'table': 'graph',
+				   'destinations': destinations,
+				   'data': data,
+				   'conditions': ['region_id'],
+				   'condition_data': (region.id,)}
+
+	db.update(**graph_params)
+
+	# calculate heating date only if last_date is not set to 1
+	if region.last_date == 0:
+
+		# search for heating date
+		with metrics.timer('forecast_stage_seconds', stage='heating_search'):
+			region.heating_date = ff.search_heating_date(blended_data)
+
+		# save heating date to database if exists
+		ff.save_heating_date(db, region)
+
+	# save long-format series of any horizon
+	ff.save_series(db, region, blended_data)
+
+	# save ready-to-serve region page
+	ff.save_page(db, region, blended_data)
+
+def run(db, regions, responses, archive=None, retries=None):
+	"""
+	Push API responses through the pipeline: same code for live runs and replays.
+	Failed regions are retried with backoff if retries are given and every
+	failure is written to retry ledger.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:param regions: dictionary with key=region id <int> and value=Region <object>.
+	:param responses: iterable of tuples (region id <int>, raw API response <bytes> or False).
+	:param archive: instance of ArchiveWriter class <object> to keep raw responses, optional.
+	:param retries: instance of RetryQueue class <object>, that responses come from, optional.
+	:return: ids of regions, that failed after all attempts <list>.
+	"""
+	# consecutive failures per region, across runs
+	ledger = ff.load_retry_ledger(db)
+	failed = []
+
+	# collect all writes of this run, commit them in one transaction
+	# or every DB_COMMIT_EVERY regions
+	with db.batch(chunk_size=DB_COMMIT_EVERY):
+		for i, result in responses:
+			region = regions[i]
+
+			# keep raw response for replays
+			if archive and result:
+				archive.add(i, result)
+
+			# read status and forecast points only
+			data = None
+			if result:
+				with metrics.timer('forecast_stage_seconds', stage='decode'):
+					data = decoder.decode(result)
+
+			# invalid API key, every other call would fail too
+			if data and data.cod == '401':
+				metrics.inc('forecast_regions_total', result='error_401')
+				with open('errors.txt', 'a') as file:
+					file.write('Region {}, error code {}: message {} time {}\n'.format(
+						i, data.cod, data.message,
+						dt_to_string(ff.now())))
+				break
+
+			# proceed if no api errors
+			if data and data.cod == '200':
+				with metrics.timer('forecast_stage_seconds', stage='region'):
+					process_region(db, region, data)
+				metrics.inc('forecast_regions_total', result='ok')
+
+				# region is healthy again
+				if ledger.get(i):
+					ledger[i] = 0
+					ff.save_retry(db, i, 0)
+
+				# region is complete, commit it if chunk is full
+				db.checkpoint()
+				continue
+
+			# no response, 404, 429 or empty data: retry region later
+			if not result:
+				error = 'server is not responding'
+			elif not data.cod:
+				error = 'empty or invalid response'
+			else:
+				error = 'error code {}: {}'.format(data.cod, data.message)
+			ledger[i] = ledger.get(i, 0) + 1
+			delay = retries.retry(i) if retries else None
+			if delay is not None:
+				metrics.inc('forecast_retries_total')
+				ff.save_retry(db, i, ledger[i], error,
+							  datetime.datetime.now() + datetime.timedelta(seconds=delay))
+				log.info('region %s misfired, retry in %.0f s', i, delay)
+				continue
+
+			# all attempts failed
+			ff.save_retry(db, i, ledger[i], error)
+			metrics.inc('forecast_regions_total', result='misfired')
+			failed.append(i)
 			with open('errors.txt', 'a') as file:
-				file.write('Region {}, error code {}: message {} time {}\n'.format(
-					i, data['cod'], data['message'],
-					dt_to_string(datetime.datetime.now())))
-			break
-
-		# proceed if no api errors
-		if data['cod'] == '200':
-
-			# collect current temperature
-			region.current_temp = data['list'][0]['main']['temp']
-
-			# collect current hour
-			region.current_hour = to_datetime(data['list'][0]['dt_txt']).hour
-
-			# save current temp to today
-			current_hour_params = {'table': 'today',
-						  'destinations': ['hour_' + str(region.current_hour), 'datetime'],
-						  'data': (region.current_temp, dt_to_string(datetime.datetime.now())),
-						  'conditions': ['region_id'],
-						  'condition_data': (region.id,)}
-
-			db.update(**current_hour_params)
-
-			# aggregate forecast
-			utc_forecast = {x['dt_txt']: x['main']['temp'] for x in data['list']}
-			# convert forecast to local time
-			local_forecast = {to_datetime(key) + datetime.timedelta(hours=region.timezone):
-								  value for key, value in utc_forecast.items()}
-
-			# calculate average weather for today
-			if ff.last_hour(local_forecast):
-				region.today_forecast = {list(local_forecast)[0].date():
-											 ff.calculate_today_last(region, db, local_forecast)}
-
-			if not ff.last_hour(local_forecast):
-				region.today_forecast = {list(local_forecast)[0].date():
-											 ff.calculate_today_intermediate(region, db, local_forecast)}
-
-			# calculate forecast
-			region.forecast = ff.forecast_means(local_forecast)
-
-			# blend weather data
-			blended_data = {**region.historical, **region.today_forecast, **region.forecast}
-
-			# save blended weather data for graphing
-			destinations = ['temp_{}'.format(x) for x in range(1, 11)] +\
-						   ['date_{}'.format(x) for x in range(1, 11)] +\
-						   ['datetime']
-			print(destinations)
-
-			data = tuple([x for x in list(blended_data.values())]) +\
-				   tuple([dt_to_string(x, time=False) for x in list(blended_data)]) +\
-				   (dt_to_string(datetime.datetime.now()),)
-
-			print(data)
-
-			graph_params = {'table': 'graph',
-						   'destinations': destinations,
-						   'data': data,
-						   'conditions': ['region_id'],
-						   'condition_data': (region.id,)}
-
-			db.update(**graph_params)
-
-			# calculate heating date only if last_date is not set to 1
-			if region.last_date == 0:
-
-				# search for heating date
-				region.heating_date = ff.search_heating_date(blended_data)
+				file.write('Region {}, {} after {} attempts, time {}\n'.format(
+					i, error, retries.attempt(i) if retries else 1, dt_to_string(ff.now())))
+
+	return failed
+
+def finish_run(db):
+	"""
+	Save metrics of the run, invalidate web caches and export static site.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:return: void function.
+	"""
+	# stage histograms of this run for web app
+	with db.batch():
+		metrics.save_run(db, metrics.registry)
+
+	# new data is committed, invalidate web caches
+	bump_version()
+
+	if STATIC_DIR:
+		written, unchanged = static_export.export(STATIC_DIR, db.database)
+		log.info('static site: %s files written, %s unchanged', written, unchanged)
+
+def start_season(db):
+	"""
+	Reset all last dates at the start of heating season.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:return: void function.
+	"""
+	date_today = ff.now().strftime("%d-%m")
+
+	# check whether it's start of the season
+	if date_today == spring_season_start_date or date_today == fall_season_start_date:
+		# if true reset all last dates to zero
+		ff.reset_last_dates(db)
+
+def replay(db, path):
+	"""
+	Reprocess archived run: no network and no rate limiting.
+	Dates are computed as of the archived run, so replaying against
+	a copy of the database taken before the run reproduces it exactly.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:param path: archive file <string>.
+	:return: ids of regions with failed responses <list>.
+	"""
+	with ArchiveReader(path) as reader:
+		ff.set_run_time(reader.run_time)
+		start_season(db)
+		regions = Region.prefetch(db, reader.region_ids())
+		failed = run(db, regions, ((i, x) for i, x in reader.items() if i in regions))
+	finish_run(db)
+	return failed
+
+def fetch_and_run(db, region_ids, limiter, archive):
+	"""
+	Download forecasts of given regions and process them as they arrive.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:param region_ids: region ids <list>.
+	:param limiter: instance of TokenBucket class <object>.
+	:param archive: instance of ArchiveWriter class <object>.
+	:return: ids of regions, that failed after all attempts <list>.
+	"""
+	# populate Region class instances for all regions at once
+	regions = Region.prefetch(db, region_ids)
+
+	# collect API key and form requests
+	urls = [(i, "{}?id={}&units=metric&APPID={}".format(API_URL, regions[i].woeid, API_KEY))
+			for i in region_ids if i in regions]
+
+	# download data concurrently, retry failures in the same run
+	queue = ff.fetch_forecasts(urls, limiter, API_WORKERS, attempts=RETRY_ATTEMPTS,
+							   backoff=Backoff(RETRY_BASE, cap=RETRY_CAP),
+							   breaker=CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET),
+							   deadline=RUN_DEADLINE)
+
+	# process responses as they arrive
+	return run(db, regions, queue, archive, retries=queue)
+
+def run_shard(region_ids, run_time):
+	"""
+	Worker process of --shards mode: download and process one shard,
+	writes and raw responses go to the writer process.
+
+	:param region_ids: region ids of shard <list>.
+	:param run_time: time of forecast run <datetime.datetime>.
+	:return: void function.
+	"""
+	ff.set_run_time(run_time)
+	# forked worker starts with metrics of parent
+	metrics.registry.clear()
+	db = sharding.WriteRecorder(sharding.worker['database'], sharding.worker['channel'])
+	failed = fetch_and_run(db, region_ids, sharding.worker['limiter'], sharding.RecordedArchive(db))
+	sharding.finish_worker(db, failed, metrics.registry.rows())
+
+def main(db, shards=None, shard=None):
+	"""
+	Download forecasts of all regions and process them.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:param shards: number of worker processes <int>, all work is done in this process if not set.
+	:param shard: tuple (k, n) to process only shard k of n on this host <tuple>.
+	:return: ids of regions, that failed after all attempts <list>.
+	"""
+	# one timestamp per run, archived for replays
+	ff.set_run_time(datetime.datetime.now().replace(microsecond=0))
+	start_season(db)
+
+	# count regions
+	REGIONS = db.regions('regions')
+
+	# regions, that failed last time, go first
+	region_ids = ff.iterator(db, REGIONS)
+
+	# hosts of a multi-host run split regions and API quota
+	share = 1
+	if shard:
+		region_ids = sharding.shard(region_ids, *shard)
+		share = 1 / shard[1]
+
+	with ArchiveWriter(archive_path(ARCHIVE_DIR, ff.now()), ff.now()) as archive:
+		if shards:
+			# api calls are restricted per minute depending on plan, workers share the quota
+			limiter = SharedTokenBucket.for_plan(API_PLAN, share)
+			# workers only read, all writes are made here
+			with db.batch(chunk_size=DB_COMMIT_EVERY):
+				failed = sharding.run_shards(db, region_ids, shards, run_shard, (ff.now(),),
+											 limiter, archive, metrics.registry)
+		else:
+			# api calls are restricted per minute depending on plan
+			limiter = TokenBucket.for_plan(API_PLAN, share)
+			failed = fetch_and_run(db, region_ids, limiter, archive)
 
-				# save heating date to database if exists
-				ff.save_heating_date(db, region)
+	finish_run(db)
+	return failed
 
-			# DEBUG
-			print('region {} completed successfully\n'.format(i))
 
-	# write misfired regions to file
-	with open('misfired.txt', 'w') as file:
-		if len(misfired) == 0:
-			file.write('')
-		else:
-			for misfired_region in misfired:
-				file.write(str(misfired_region) + '\n')
-		
-			
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	parser = argparse.ArgumentParser(description="Download forecasts and update heating dates.")
+	parser.add_argument('--database', default=DATABASE)
+	parser.add_argument('--replay', metavar='RUN',
+						help="reprocess archived run (id like 20190407-200213 or file path)")
+	parser.add_argument('--shards', type=int, metavar='N',
+						help="split regions between N worker processes")
+	parser.add_argument('--shard', type=sharding.parse_shard, metavar='K/N',
+						help="process only shard K of N, for runs on several hosts")
+	args = parser.parse_args()
+
+	# messages go to the log file of the cron job
+	logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s: %(message)s')
+
+	db = DatabaseQueries(args.database)
+
+	# bring database schema up to date
+	migrate(db)
+
+	if args.replay:
+		replay(db, find_archive(ARCHIVE_DIR, args.replay))
+	else:
+		main(db, args.shards, args.shard)
+	log.info('%s commits', db.commits)
+	db.close()
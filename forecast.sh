@@ -1,6 +1,4 @@
 #!/bin/bash
 cd /path/to/project && /path/to/interpreter/bin/python3.6 /path/to/forecast.py > /path/to/log.txt
 dt=$(date '+%d/%m/%Y %H:%M:%S');
-echo "Executed forecast.py successfully on $dt" >> /path/to/log.txt
-
-./misfired.sh misfired.txt
\ No newline at end of file
+echo "Executed forecast.py successfully on $dt" >> /path/to/log.txt
\ No newline at end of file
@@ -1,8 +1,79 @@
-from time_functions import dt_to_string, date_convert_RU
+from time_functions import dt_to_string, date_convert_RU, to_datetime
+from region import TODAY_HOURS
+import metrics
+import collections
+import json
+import math
 import statistics
 import datetime
+import http.client
 import urllib.parse
 import urllib.request
+from retry import RetryQueue
+
+# forecast points of the first (current) local day, full-day means and whether
+# the first point is the last interval of its day
+DayAggregate = collections.namedtuple('DayAggregate', ['today', 'today_temps', 'means', 'last_interval'])
+
+# time of forecast run, set by replays to time of archived run
+_run_time = None
+
+def now():
+	"""
+	Current time of forecast run: wall clock or time of replayed run.
+
+	:return: time <datetime.datetime>.
+	"""
+	return _run_time or datetime.datetime.now()
+
+def set_run_time(run_time):
+	"""
+	Freeze time of forecast run, so that replay dates match the original run.
+
+	:param run_time: time <datetime.datetime> or None to use wall clock.
+	:return: void function.
+	"""
+	global _run_time
+	_run_time = run_time
+
+def aggregate_days(local_forecast, step=datetime.timedelta(hours=3)):
+	"""
+	Bucket forecast points by local date in a single pass.
+	Full days are those, that have every interval of given step (eight for 3 hours).
+
+	:param local_forecast: dictionary with local times <datetime.datetime> and temps <float>,
+	in chronological order.
+	:param step: forecast interval <datetime.timedelta>.
+	:return: DayAggregate <namedtuple>: today <datetime.date>, today_temps <list>,
+	means - dictionary with key=date <datetime.date> and value=temperature <float>,
+	last_interval <bool>.
+	"""
+	points_per_day = datetime.timedelta(days=1) // step
+	today = None
+	today_temps = []
+	means = {}
+	last_interval = False
+
+	# temperatures of the day being read
+	date, temps = None, []
+	for moment, temp in local_forecast.items():
+		day = moment.date()
+		if today is None:
+			today = day
+			# check date of the next interval
+			last_interval = (moment + step).date() != day
+		if day != date:
+			# close previous day
+			if len(temps) == points_per_day:
+				means[date] = round(statistics.mean(temps), 2)
+			date, temps = day, []
+			if day == today:
+				today_temps = temps
+		temps.append(temp)
+	if len(temps) == points_per_day:
+		means[date] = round(statistics.mean(temps), 2)
+
+	return DayAggregate(today, today_temps, means, last_interval)
 
 def forecast_means(data):
 	"""
@@ -12,15 +83,7 @@ def forecast_means(data):
 	:param data: dictionary with key=date <datetime.date> and value=temperature <float>.
 	:return: dictionary with key=date <datetime.date> and value=temperature <float>.
 	"""
-	# collect dates
-	date_keys = [x.date() for x in list(data)]
-	# filter out full days
-	days = set([x for x in date_keys if date_keys.count(x) == 8])
-	# group temperature by dates from the filtered list
-	temps_grouped = map(lambda x: [v for (k, v) in data.items() if x == k.date()], list(sorted(days)))
-	# return a dictionary with dates and mean temperature
-	return dict([(x, round(statistics.mean(y), 2)) for x, y in zip(list(sorted(days)), list(temps_grouped))])
-
+	return aggregate_days(data).means
 
 def last_hour(local_forecast):
 	"""
@@ -29,94 +92,99 @@ def last_hour(local_forecast):
 	:param local_forecast: dictionary with local times <datetime.date> and temps <float>.
 	:return: True if date is different, False otherwise.
 	"""
-	# check date for current hour
-	current_interval_date = list(local_forecast)[0].date()
-	# check date of the next interval: + 3 hours
-	next_interval_date = (list(local_forecast)[0] + datetime.timedelta(hours=3)).date()
-	if next_interval_date != current_interval_date:
-		return True
-	else:
-		return False
-	
-def calculate_today_last(region, db, local_forecast):
+	first = next(iter(local_forecast))
+	return (first + datetime.timedelta(hours=3)).date() != first.date()
+
+def save_today(db, region):
+	"""
+	Save current slot and running aggregates of today to database.
+	Single-row update, no recomputation over the other slots.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:param region: instance of Region class <object>.
+	:return: void function.
+	"""
+	current_hour_params = {'table': 'today',
+						   'destinations': ['hour_' + str(region.current_hour), 'temp_sum',
+											'temp_count', 'temp_min', 'temp_max', 'datetime'],
+						   'data': (region.current_temp, region.today_sum, region.today_count,
+									region.today_min, region.today_max,
+									dt_to_string(now())),
+						   'conditions': ['region_id'],
+						   'condition_data': (region.id,)}
+	db.update(**current_hour_params)
+
+def calculate_today_last(region, db, days):
 	"""
 	Save today mean temperature to database and reset today table.
 
 	:param region: instance of Region class <object>.
 	:param db: instance of DatabaseQueries class <object>.
-	:param local_forecast: dictionary with local times <datetime.date> and temps <float>.
+	:param days: aggregated local forecast <DayAggregate>.
 	:return: mean temperature for today <float>.
 	"""
-	
-	# get all temps from today table
-	today_historical_params = {'table': 'today',
-						  'conditions': ['region_id'],
-						  'condition_data': (region.id,),
-						  'filters': ['hour_{}'.format(x) for x in range(0, 24, 3)]}
+	# add current temperature to today
+	region.observe(region.current_hour, region.current_temp)
 
-	# returns a list of tuples
-	today_historical = db.select(**today_historical_params)
-
-	if None in today_historical[0]:
+	# keep collecting if some slots are missing
+	if region.today_count < len(TODAY_HOURS):
+		save_today(db, region)
 		return 0.0
 
 	# calculate mean
-	today_avg = round(statistics.mean(today_historical[0]), 2)
+	today_avg = round(region.today_sum / region.today_count, 2)
 
-	# save to history
-	current_date = dt_to_string(list(local_forecast)[0].date(), time=False)
+	# roll today into history: an insert into history and a reset of today,
+	# SQLite can't write two tables in one statement, the batch transaction
+	# of the run keeps them together
+	current_date = dt_to_string(days.today, time=False)
 	save_to_history_params = {'table': 'history',
 							  'destinations': ['region_id', 'temp', 'date', 'datetime'],
 							  'data': (region.id, today_avg, current_date,
-									   dt_to_string(datetime.datetime.now()))}
+									   dt_to_string(now()))}
 	db.insert(**save_to_history_params)
 
 	# set today table to null
+	region.reset_today()
 	set_today_to_null_params = {'table': 'today',
-								'destinations': ['hour_{}'.format(x) for x in range(0, 24, 3)] + ['datetime'],
-								'data': tuple([None] * 9),
+								'destinations': ['hour_{}'.format(x) for x in TODAY_HOURS] +
+												['temp_sum', 'temp_count', 'temp_min', 'temp_max', 'datetime'],
+								'data': tuple([None] * 8) + (0.0, 0, None, None, None),
 								'conditions': ['region_id'],
 								'condition_data': (region.id,)}
 	db.update(**set_today_to_null_params)
 
 	return today_avg
 
-def calculate_today_intermediate(region, db, local_forecast):
+def calculate_today_intermediate(region, db, days):
 	"""
 	Calculate and return intermediate forecast for today.
 	Blends historical hour temperature and forecast from API.
 
 	:param region: instance of Region class <object>.
 	:param db: instance of DatabaseQueries class <object>.
-	:param local_forecast: dictionary with local times <datetime.date> and temps <float>.
+	:param days: aggregated local forecast <DayAggregate>.
 	:return: mean temperature for today <float>.
 	"""
-	
-	# get all not null temps from today table
-	today_historical_params = {'table': 'today',
-						  'conditions': ['region_id'],
-						  'condition_data': (region.id,),
-						  'filters': ['hour_{}'.format(x) for x in range(0, 24, 3)]}
-	# download historical temperature for today (returns a list of tuples)
-	today_historical = db.select(**today_historical_params)
-
-	# filter out None values
-	today_historical = [temp for temp in today_historical[0] if temp != None]
-
-	# get forecast for the rest of the day
-	today_forecast = [v for k, v in local_forecast.items() if k.date() == list(local_forecast)[0].date()]
+	# add current temperature to today and save it
+	region.observe(region.current_hour, region.current_temp)
+	save_today(db, region)
 
-	# blend these together and count mean
-	today_avg = round(statistics.mean(today_historical + today_forecast), 2)
+	# blend observed slots with forecast for the rest of the day and count mean
+	today_avg = round((region.today_sum + math.fsum(days.today_temps)) /
+					  (region.today_count + len(days.today_temps)), 2)
 
 	return today_avg
-	
 
-def search_heating_date(data, threshold=8):
+def search_heating_date(data, threshold=8, window=5):
 	"""
-	Search for heating date. Threshold set to 8°С by default.
+	Search for heating date: the day after mean temperature stayed above
+	(spring) or below (fall) threshold for window days in a row.
+	Threshold set to 8°С and window to five days by default.
 
 	:param data: blended dictionary with dates <datetime.date> and temperatures <float>.
+	:param threshold: temperature threshold <float>.
+	:param window: number of days in a row <int>.
 	:return: heating date <datetime.date> if found, None otherwise.
 	"""
 
@@ -131,8 +199,11 @@ def search_heating_date(data, threshold=8):
 				# increment counter if true
 				counter += 1
 				# return heating supply date if counter is equal to 5
-				if counter == 5:
+				if counter == window:
 					return date + datetime.timedelta(1)
+			else:
+				# days must go in a row
+				counter = 0
 		# if not spring
 		else:
 			# check for temperatures less, than 8 degrees
@@ -140,8 +211,11 @@ def search_heating_date(data, threshold=8):
 				# increment counter if true
 				counter += 1
 				# return heating cut date if counter is equal to 5
-				if counter == 5:
+				if counter == window:
 					return date + datetime.timedelta(1)
+			else:
+				# days must go in a row
+				counter = 0
 	# return None if heating date not found
 	return None
 
@@ -157,6 +231,7 @@ def save_heating_date(db, region):
 	"""
 	# save heating date to database
 	if region.heating_date:
+		region.heating_date_RU = date_convert_RU(region.heating_date)
 		heating_date_params = {'table': 'regions',
 								'destinations': ['heating_date', 'heating_date_RU'],
 								'data': (dt_to_string(region.heating_date, time=False),
@@ -166,6 +241,7 @@ def save_heating_date(db, region):
 		db.update(**heating_date_params)
 	# set heating date to null if no date found
 	else:
+		region.heating_date_RU = None
 		heating_date_params = {'table': 'regions',
 							   'destinations': ['heating_date', 'heating_date_RU'],
 							   'data': (None, None),
@@ -174,7 +250,8 @@ def save_heating_date(db, region):
 		db.update(**heating_date_params)
 
 	# stop tracking region if heating date is today
-	if region.heating_date == datetime.datetime.now().date():
+	if region.heating_date == now().date():
+		region.last_date = 1
 		last_date_params = {'table': 'regions',
 							   'destinations': ['last_date'],
 							   'data': (1,),
@@ -183,6 +260,101 @@ def save_heating_date(db, region):
 		db.update(**last_date_params)
 
 
+def preposition(name_RU):
+	"""
+	Choose Russian preposition for region name in locative case.
+
+	:param name_RU: region name in locative case <string>.
+	:return: 'во' or 'в' <string>.
+	"""
+	return "во" if 'Влад' in name_RU else "в"
+
+def heating_message(name_RU, heating_date_RU, last_date):
+	"""
+	Compose heating date message for region page.
+
+	:param name_RU: region name in locative case <string>.
+	:param heating_date_RU: heating date in Russian <string> or None.
+	:param last_date: 1 if heating date has been reached, 0 otherwise <int>.
+	:return: message <string>.
+	"""
+	# russian language sensitive cases for season
+	action = "отключ" if spring() else "включ"
+	where = "{} {}".format(preposition(name_RU), name_RU)
+
+	# no heating date
+	if not heating_date_RU:
+		return "Отопление {} в ближайшее время не {}ат.*".format(where, action)
+	if last_date == 1:
+		return "Отопление {} должны были {}ить {}.*".format(where, action, heating_date_RU)
+	return "Отопление {} {}ат {}.*".format(where, action, heating_date_RU)
+
+def page_payload(name_RU, heating_date_RU, last_date, graph):
+	"""
+	Payload of region page: title, heating message, graph title and graph data.
+
+	:param name_RU: region name in locative case <string>.
+	:param heating_date_RU: heating date in Russian <string> or None.
+	:param last_date: 1 if heating date has been reached, 0 otherwise <int>.
+	:param graph: dictionary with dates <datetime.date> and temperatures <float>.
+	:return: tuple (title, message, region title, x and y as JSON) <tuple>.
+	"""
+	return ("Отопление {} {}".format(preposition(name_RU), name_RU),
+			heating_message(name_RU, heating_date_RU, last_date),
+			name_RU,
+			json.dumps([date_convert_RU(x, short=True) for x in graph], ensure_ascii=False),
+			json.dumps(list(graph.values())))
+
+def graph_points(row):
+	"""
+	Dates and temperatures of a graph row, empty columns of new regions are skipped.
+
+	:param row: graph columns temp_1 ... temp_10, date_1 ... date_10 <tuple>.
+	:return: dictionary with dates <datetime.date> and temperatures <float>.
+	"""
+	return {to_datetime(date, time=False): temp
+			for temp, date in zip(row[:10], row[10:]) if date}
+
+def save_page(db, region, blended_data):
+	"""
+	Save ready-to-serve payload of region page, so that web app
+	only has to look it up.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:param region: instance of Region class <object>.
+	:param blended_data: blended dictionary with dates <datetime.date> and temperatures <float>.
+	:return: void function.
+	"""
+	page_params = {'table': 'pages',
+				   'destinations': ['region_id', 'title', 'message',
+									'region_title', 'x', 'y', 'datetime'],
+				   'data': (region.id,) +
+						   page_payload(region.name_RU, region.heating_date_RU,
+										region.last_date, blended_data) +
+						   (dt_to_string(now()),)}
+	db.replace(**page_params)
+
+def save_series(db, region, blended_data):
+	"""
+	Save blended weather data to long-format forecast series, replacing
+	previous run. Dates before today are history, later dates are forecast.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:param region: instance of Region class <object>.
+	:param blended_data: blended dictionary with dates <datetime.date> and temperatures <float>.
+	:return: void function.
+	"""
+	db.delete(table='forecast_series', conditions=['region_id'], condition_data=(region.id,))
+	# history keys are datetimes and the rest are dates, so compare strings
+	today = dt_to_string(list(region.today_forecast)[0], time=False)
+	for date, temp in blended_data.items():
+		date = dt_to_string(date, time=False)
+		kind = 'history' if date < today else 'today' if date == today else 'forecast'
+		series_params = {'table': 'forecast_series',
+						 'destinations': ['region_id', 'date', 'temp', 'kind'],
+						 'data': (region.id, date, temp, kind)}
+		db.insert(**series_params)
+
 def spring(date=None):
 	"""
 	Check if current month is spring (march-august).
@@ -193,57 +365,99 @@ def spring(date=None):
 
 	# extract current month if not given
 	if not date:
-		date = datetime.datetime.now().month
+		date = now().month
 
 	if date in [3, 4, 5, 6, 7, 8]:
 		return True
 	else:
 		return False
 
-def iterator(regions):
+def iterator(db, regions):
+	"""
+	Order region ids for download: regions, that failed in previous runs
+	(see retry_ledger table), go first.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:param regions: number of regions <int>.
+	:return: region ids <list>.
 	"""
-	Collect misfired regions from file if such exist.
+	failed = [x for x, failures in load_retry_ledger(db).items() if failures > 0 and x <= regions]
+	first = set(failed)
+	return failed + [x for x in range(1, regions + 1) if x not in first]
 
-	:param regions: number of regions <list>.
-	:return: misfired region ids <list> or all region ids <list>.
+def load_retry_ledger(db):
 	"""
-	misfired = []
-	# look for misfired regions in file
-	with open("misfired.txt", 'r') as file:
-		for line in file:
-			misfired.append(int(line.strip('\n')))
-	# if file is not empty return list of misfired regions as list
-	if misfired:
-		return misfired
-	# return non last date regions
-	else:
-		return [x for x in range(1, regions + 1)]
+	Read consecutive failures of regions from retry ledger.
 
-def parse_api(baseurl):
+	:param db: instance of DatabaseQueries class <object>.
+	:return: dictionary with key=region id <int> and value=failures <int>.
 	"""
-	Parse json by given url. Wait for ten minutes if server
-	is not responding. Write error after four attempts.
+	return dict(db.select(table='retry_ledger', conditions=[], condition_data=(),
+						  filters=['region_id', 'failures']))
+
+def save_retry(db, region_id, failures, error=None, next_attempt=None):
+	"""
+	Save state of region to retry ledger. Successful regions are saved with
+	zero failures rather than deleted, so that every ledger write is the same
+	statement and batched writes keep their order.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:param region_id: region id <int>.
+	:param failures: consecutive failures, across runs <int>.
+	:param error: reason of last failure <string>.
+	:param next_attempt: time of scheduled retry <datetime.datetime> or None if given up.
+	:return: void function.
+	"""
+	retry_params = {'table': 'retry_ledger',
+					'destinations': ['region_id', 'failures', 'last_error', 'next_attempt', 'datetime'],
+					'data': (region_id, failures, error,
+							 dt_to_string(next_attempt) if next_attempt else None,
+							 dt_to_string(now()))}
+	db.replace(**retry_params)
+
+def parse_api(baseurl, timeout=30):
+	"""
+	Download response by given url, single attempt. Retries are up to caller,
+	see RetryQueue in retry.py.
 
 	:param baseurl: url <string>.
-	:return: parsed json object <byte> or False if server is not responding four times.
-	"""
-	# Make 4 api calls in total
-	for call in range(1, 5):
-		# Write an error to file if no response after 4 attempts
-		if call == 4:
-			with open('errors.txt', 'a') as file:
-				file.write("Server is not responding after 4 attempts. Time: {}\n".format(
-					dt_to_string(datetime.datetime.now())
-				))
-			return False
-		try:
-			# download data from api
-			result = urllib.request.urlopen(baseurl).read()
-			return result
-		except urllib.error.URLError:
-			# wait 10 minutes if server is not responding and make another call
-			print("Seems like server is not responding. Will try again in 10 minutes...")
-			time.sleep(660)
+	:param timeout: seconds to wait for server <float>.
+	:return: HTTP status <int> or None if server is not responding, response body <byte>.
+	"""
+	try:
+		# download data from api
+		with urllib.request.urlopen(baseurl, timeout=timeout) as response:
+			return response.status, response.read()
+	except urllib.error.HTTPError as error:
+		# 404, 429 and 401 come with json body
+		return error.code, error.read()
+	except (OSError, http.client.HTTPException):
+		return None, b''
+
+def fetch_forecasts(urls, limiter, workers=8, **retry_options):
+	"""
+	Download urls concurrently, respecting API rate limit.
+	Results are yielded as soon as they arrive, so that caller can parse
+	and save them while other requests are still in flight. Unreachable
+	server, 429 and 5xx responses are retried with backoff.
+
+	:param urls: list of tuples (key, url) <list>.
+	:param limiter: instance of TokenBucket class <object>.
+	:param workers: number of concurrent requests <int>.
+	:param retry_options: attempts, backoff, breaker and deadline of RetryQueue.
+	:return: instance of RetryQueue class <object>, iterate it for tuples
+	(key, response body <byte> or False if server never answered).
+	"""
+	def fetch(url):
+		with metrics.timer('forecast_stage_seconds', stage='rate_limit'):
+			limiter.acquire()
+		with metrics.timer('forecast_stage_seconds', stage='fetch'):
+			return parse_api(url)
+
+	queue = RetryQueue(fetch, workers, **retry_options)
+	for key, url in urls:
+		queue.submit(key, url)
+	return queue
 
 def check_last_dates(db):
 	"""
@@ -0,0 +1,70 @@
+import bisect
+import datetime
+from time_functions import to_datetime
+
+class RuleIndex:
+	"""
+	Precomputed per-region structures for "what if" heating rule queries
+	over the blended ten-day window saved in graph table.
+
+	For every region and run length w it keeps the minimum (maximum) of every
+	w days in a row and the running maximum (minimum) of those. Temperatures
+	stay above threshold for w days starting at day i if the window minimum is
+	above it, and the running maximum is sorted, so the first such day is
+	found with bisect for any threshold without rescanning temperatures.
+	"""
+	def __init__(self, rows):
+		"""
+		:param rows: list of tuples (region_id, temp_1..temp_10, date_1..date_10) <list>.
+		"""
+		self.regions = {}
+		for row in rows:
+			region_id, temps, dates = row[0], row[1:11], row[11:21]
+			days = sorted((to_datetime(date, time=False).date(), temp)
+						  for temp, date in zip(temps, dates) if date and temp is not None)
+			self.regions[region_id] = _RegionIndex([x[0] for x in days], [x[1] for x in days])
+
+	def heating_date(self, region_id, threshold=8, window=5, spring_season=True):
+		"""
+		Search for heating date of region with given rule.
+
+		:param region_id: region id <int>.
+		:param threshold: temperature threshold <float>.
+		:param window: number of days in a row <int>.
+		:param spring_season: True to search for heating cut, False for supply <bool>.
+		:return: heating date <datetime.date> if found, None otherwise.
+		"""
+		return self.regions[region_id].heating_date(threshold, window, spring_season)
+
+
+class _RegionIndex:
+	def __init__(self, dates, temps):
+		self.dates = dates
+		# run length -> running max of window minimums / -running min of window maximums
+		self.above = {}
+		self.below = {}
+		for window in range(1, len(temps) + 1):
+			lows = [min(temps[i:i + window]) for i in range(len(temps) - window + 1)]
+			highs = [max(temps[i:i + window]) for i in range(len(temps) - window + 1)]
+			self.above[window] = _running_max(lows)
+			# negated, so that bisect works on ascending list
+			self.below[window] = _running_max([-x for x in highs])
+
+	def heating_date(self, threshold, window, spring_season):
+		if spring_season:
+			envelope, key = self.above.get(window), threshold
+		else:
+			envelope, key = self.below.get(window), -threshold
+		if not envelope:
+			return None
+		start = bisect.bisect_right(envelope, key)
+		if start == len(envelope):
+			return None
+		return self.dates[start + window - 1] + datetime.timedelta(1)
+
+
+def _running_max(values):
+	result = []
+	for value in values:
+		result.append(max(value, result[-1]) if result else value)
+	return result
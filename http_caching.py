@@ -0,0 +1,108 @@
+import datetime
+import gzip
+import hashlib
+import io
+
+# brotli is optional, gzip is used if it's not installed
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+# forecast.py runs every three hours at 02:05, 05:05, ... UTC (see README cron),
+# new data is expected to be committed within fifteen minutes
+FORECAST_PERIOD = datetime.timedelta(hours=3)
+FORECAST_READY = datetime.timedelta(hours=2, minutes=20)
+
+# smaller bodies are sent uncompressed
+COMPRESS_MIN_SIZE = 1024
+
+def etag(version, url):
+	"""
+	Strong entity tag of uncompressed response: data version plus url hash.
+
+	:param version: data version <string>.
+	:param url: request path with query string <string>.
+	:return: entity tag without quotes <string>.
+	"""
+	return "{}-{}".format(version, hashlib.sha1(url.encode('utf-8')).hexdigest()[:16])
+
+def encoded_etag(tag, encoding):
+	"""
+	Entity tag of compressed representation, strong tags must differ per encoding.
+
+	:param tag: entity tag of uncompressed response <string>.
+	:param encoding: 'gzip', 'br' or None <string>.
+	:return: entity tag without quotes <string>.
+	"""
+	return "{}-{}".format(tag, encoding) if encoding else tag
+
+def accepted_encoding(accept_encoding):
+	"""
+	Choose best compression supported by client.
+
+	:param accept_encoding: Accept-Encoding header <string>.
+	:return: 'br', 'gzip' or None <string>.
+	"""
+	accepted = set()
+	for item in accept_encoding.split(','):
+		coding, _, params = item.strip().partition(';')
+		# skip explicitly refused codings
+		if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+			continue
+		accepted.add(coding.strip().lower())
+	if brotli and 'br' in accepted:
+		return 'br'
+	if 'gzip' in accepted:
+		return 'gzip'
+	return None
+
+def compress(body, encoding):
+	"""
+	Compress response body.
+
+	:param body: response body <bytes>.
+	:param encoding: 'gzip' or 'br' <string>.
+	:return: compressed body <bytes>.
+	"""
+	if encoding == 'br':
+		return brotli.compress(body)
+	return gzip_bytes(body, 6)
+
+def gzip_bytes(body, level):
+	"""
+	gzip.compress only takes mtime since Python 3.8.
+
+	:param body: response body <bytes>.
+	:param level: compression level from 1 to 9 <int>.
+	:return: gzip stream <bytes>.
+	"""
+	buffer = io.BytesIO()
+	# fixed mtime keeps gzip output identical for identical bodies
+	with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=level, mtime=0) as stream:
+		stream.write(body)
+	return buffer.getvalue()
+
+def max_age(now=None):
+	"""
+	Seconds until data of next forecast run is expected.
+
+	:param now: current UTC time <datetime.datetime>, now by default.
+	:return: seconds <int>.
+	"""
+	if not now:
+		now = datetime.datetime.utcnow()
+	since_ready = now - now.replace(hour=0, minute=0, second=0, microsecond=0) - FORECAST_READY
+	period = FORECAST_PERIOD.total_seconds()
+	return int(period - since_ready.total_seconds() % period)
+
+def last_modified(version):
+	"""
+	Time of last forecast run from data version stamp.
+
+	:param version: data version, milliseconds since epoch <string>.
+	:return: UTC time <datetime.datetime> or None if forecast has never run.
+	"""
+	if version == '0':
+		return None
+	return datetime.datetime.fromtimestamp(int(version) / 1000, tz=datetime.timezone.utc)
@@ -0,0 +1,235 @@
+"""
+Timings and counters of forecast.py, application.py and DatabaseQueries in
+Prometheus text format. Histograms of the last forecast run are saved to
+run_metrics table, so that web app can serve them.
+
+	with metrics.timer('forecast_stage_seconds', stage='fetch'):
+		...
+"""
+import bisect
+import contextlib
+import json
+import threading
+import time
+
+# upper bounds of histogram buckets, seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+		   0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HELP = {
+	'forecast_stage_seconds': "Time spent in stages of forecast.py per region.",
+	'forecast_regions_total': "Regions handled by forecast.py by result.",
+	'forecast_retries_total': "Retries of regions scheduled by forecast.py.",
+	'db_query_seconds': "Duration of database statements by kind and table.",
+	'db_commit_seconds': "Duration of database commits.",
+	'http_request_seconds': "Duration of web requests by route and status.",
+}
+
+class Histogram:
+	def __init__(self, buckets=BUCKETS):
+		self.buckets = tuple(buckets)
+		# per bucket, last one is +Inf
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+class Registry:
+	"""
+	Thread-safe collection of histograms and counters, keyed on metric name and labels.
+	"""
+	def __init__(self):
+		self._lock = threading.Lock()
+		# (name, labels) -> Histogram
+		self._histograms = {}
+		# (name, labels) -> value
+		self._counters = {}
+
+	def observe(self, name, value, **labels):
+		"""
+		Add observation to histogram.
+
+		:param name: metric name <string>.
+		:param value: observed value, seconds for timings <float>.
+		:param labels: label values <string>.
+		:return: void function.
+		"""
+		key = (name, tuple(sorted(labels.items())))
+		with self._lock:
+			histogram = self._histograms.get(key)
+			if histogram is None:
+				histogram = self._histograms[key] = Histogram()
+			histogram.observe(value)
+
+	def inc(self, name, value=1, **labels):
+		"""
+		Increase counter.
+
+		:param name: metric name <string>.
+		:param value: increment <float>.
+		:param labels: label values <string>.
+		:return: void function.
+		"""
+		key = (name, tuple(sorted(labels.items())))
+		with self._lock:
+			self._counters[key] = self._counters.get(key, 0) + value
+
+	@contextlib.contextmanager
+	def timer(self, name, **labels):
+		"""
+		Observe duration of with-block in seconds.
+
+		:param name: metric name <string>.
+		:param labels: label values <string>.
+		:return: context manager.
+		"""
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(name, time.perf_counter() - start, **labels)
+
+	def clear(self):
+		with self._lock:
+			self._histograms.clear()
+			self._counters.clear()
+
+	def rows(self):
+		"""
+		Dump metrics for run_metrics table.
+
+		:return: list of tuples (name, labels, kind, buckets, counts, sum, count) <list>.
+		"""
+		with self._lock:
+			histograms = [(name, json.dumps(dict(labels)), 'histogram', json.dumps(x.buckets),
+						   json.dumps(x.counts), x.sum, x.count)
+						  for (name, labels), x in self._histograms.items()]
+			counters = [(name, json.dumps(dict(labels)), 'counter', None, None, value, None)
+						for (name, labels), value in self._counters.items()]
+		return histograms + counters
+
+	@classmethod
+	def from_rows(cls, rows, **labels):
+		"""
+		Load metrics dumped by rows().
+
+		:param rows: list of tuples (name, labels, kind, buckets, counts, sum, count) <list>.
+		:param labels: extra labels for every metric <string>.
+		:return: instance of Registry class <object>.
+		"""
+		registry = cls()
+		for name, row_labels, kind, buckets, counts, total, count in rows:
+			key = (name, tuple(sorted(dict(json.loads(row_labels), **labels).items())))
+			if kind == 'histogram':
+				histogram = registry._histograms[key] = Histogram(json.loads(buckets))
+				histogram.counts, histogram.sum, histogram.count = json.loads(counts), total, count
+			else:
+				registry._counters[key] = total
+		return registry
+
+	def merge(self, rows):
+		"""
+		Add metrics dumped by rows() of another process, e.g. a shard worker.
+
+		:param rows: list of tuples (name, labels, kind, buckets, counts, sum, count) <list>.
+		:return: void function.
+		"""
+		other = Registry.from_rows(rows)
+		with self._lock:
+			for key, histogram in other._histograms.items():
+				mine = self._histograms.get(key)
+				if mine is None or mine.buckets != histogram.buckets:
+					self._histograms[key] = histogram
+					continue
+				mine.counts = [x + y for x, y in zip(mine.counts, histogram.counts)]
+				mine.sum += histogram.sum
+				mine.count += histogram.count
+			for key, value in other._counters.items():
+				self._counters[key] = self._counters.get(key, 0) + value
+
+	def samples(self):
+		"""
+		:return: dictionary with key=metric name and value=tuple (kind, lines) <dict>.
+		"""
+		metrics = {}
+		with self._lock:
+			for (name, labels), histogram in sorted(self._histograms.items()):
+				lines = metrics.setdefault(name, ('histogram', []))[1]
+				cumulative = 0
+				for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+					cumulative += count
+					lines.append('{}_bucket{} {}'.format(
+						name, _labels(labels + (('le', _number(bound)),)), cumulative))
+				lines.append('{}_sum{} {}'.format(name, _labels(labels), _number(histogram.sum)))
+				lines.append('{}_count{} {}'.format(name, _labels(labels), histogram.count))
+			for (name, labels), value in sorted(self._counters.items()):
+				metrics.setdefault(name, ('counter', []))[1].append(
+					'{}{} {}'.format(name, _labels(labels), _number(value)))
+		return metrics
+
+def render(*registries):
+	"""
+	Prometheus text exposition of given registries, series of the same
+	metric are grouped under one HELP/TYPE header.
+
+	:param registries: instances of Registry class <object>.
+	:return: text <string>.
+	"""
+	metrics = {}
+	for registry in registries:
+		for name, (kind, lines) in registry.samples().items():
+			metrics.setdefault(name, (kind, []))[1].extend(lines)
+	output = []
+	for name, (kind, lines) in sorted(metrics.items()):
+		output.append('# HELP {} {}'.format(name, HELP.get(name, name)))
+		output.append('# TYPE {} {}'.format(name, kind))
+		output.extend(lines)
+	return '\n'.join(output) + '\n'
+
+def save_run(db, registry):
+	"""
+	Replace saved metrics of previous forecast run.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:param registry: instance of Registry class <object>.
+	:return: void function.
+	"""
+	db.delete(table='run_metrics', conditions=[], condition_data=())
+	for row in registry.rows():
+		db.insert(table='run_metrics',
+				  destinations=['name', 'labels', 'kind', 'buckets', 'counts', 'sum', 'count'],
+				  data=row)
+
+def load_run(db):
+	"""
+	Load metrics of last forecast run, labelled with process="forecast".
+
+	:param db: instance of DatabaseQueries class <object>.
+	:return: instance of Registry class <object>.
+	"""
+	rows = db.select(table='run_metrics', conditions=[], condition_data=(),
+					 filters=['name', 'labels', 'kind', 'buckets', 'counts', 'sum', 'count'])
+	return Registry.from_rows(rows, process='forecast')
+
+def _labels(labels):
+	if not labels:
+		return ''
+	return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace(
+		'"', '\\"').replace('\n', '\\n')) for key, value in labels) + '}'
+
+def _number(value):
+	if isinstance(value, str):
+		return value
+	if isinstance(value, float) and not value.is_integer():
+		return repr(value)
+	return str(int(value))
+
+# metrics of current process
+registry = Registry()
+observe = registry.observe
+inc = registry.inc
+timer = registry.timer
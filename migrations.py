@@ -0,0 +1,225 @@
+"""
+Versioned schema migrations for weather.db. Applied migrations are tracked
+with PRAGMA user_version, so running them again is a no-op.
+
+	$ python migrations.py
+"""
+import argparse
+import datetime
+import logging
+
+from database_queries import DatabaseQueries
+from forecast_functions import graph_points, page_payload
+from time_functions import to_datetime
+from timezone_functions import fixed_zone
+
+log = logging.getLogger(__name__)
+
+def backfill_forecast_series(con):
+	"""
+	Copy wide graph rows (temp_N, date_N) into long-format forecast_series.
+	Dates before the day graph was saved are history, that day is today
+	and later dates are forecast.
+
+	:param con: sqlite3 connection <object>.
+	:return: void function.
+	"""
+	columns = ", ".join("temp_{0}, date_{0}".format(x) for x in range(1, 11))
+	rows = []
+	for region_id, saved, *pairs in con.execute(
+			"""SELECT region_id, datetime, {} FROM graph""".format(columns)):
+		if not saved:
+			continue
+		saved = to_datetime(saved).date()
+		for temp, date in zip(pairs[0::2], pairs[1::2]):
+			if not date:
+				continue
+			day = to_datetime(date, time=False).date()
+			kind = 'history' if day < saved else 'today' if day == saved else 'forecast'
+			rows.append((region_id, date, temp, kind))
+	con.executemany("""INSERT OR REPLACE INTO forecast_series(region_id, date, temp, kind)
+		VALUES(?, ?, ?, ?)""", rows)
+
+def backfill_today_aggregates(con):
+	"""
+	Compute running aggregates of today table from already observed slots.
+
+	:param con: sqlite3 connection <object>.
+	:return: void function.
+	"""
+	hours = ", ".join("hour_{}".format(x) for x in range(0, 24, 3))
+	rows = []
+	for region_id, *temps in con.execute("""SELECT region_id, {} FROM today""".format(hours)):
+		temps = [x for x in temps if x is not None]
+		rows.append((sum(temps), len(temps), min(temps, default=None), max(temps, default=None),
+					 region_id))
+	con.executemany("""UPDATE today SET temp_sum = ?, temp_count = ?, temp_min = ?, temp_max = ?
+		WHERE region_id = ?""", rows)
+
+# IANA timezones of existing regions by (country, offset in regions.timezone)
+TZ_NAMES = {('Россия', 2): 'Europe/Kaliningrad',
+			('Россия', 3): 'Europe/Moscow',
+			('Россия', 4): 'Europe/Samara',
+			('Россия', 5): 'Asia/Yekaterinburg',
+			('Россия', 6): 'Asia/Omsk',
+			('Россия', 7): 'Asia/Novosibirsk',
+			('Россия', 8): 'Asia/Irkutsk',
+			('Россия', 9): 'Asia/Yakutsk',
+			('Россия', 10): 'Asia/Vladivostok',
+			('Россия', 11): 'Asia/Magadan',
+			('Россия', 12): 'Asia/Kamchatka',
+			('Украина', 2): 'Europe/Kiev',
+			('Беларусь', 3): 'Europe/Minsk',
+			('Казахстан', 5): 'Asia/Aqtobe',
+			('Казахстан', 6): 'Asia/Almaty',
+			('--', 2): 'Europe/Kiev',
+			('--', 3): 'Europe/Simferopol'}
+
+def backfill_tz_names(con):
+	"""
+	Set IANA timezone of regions from country and offset, regions of other
+	countries get a fixed offset zone like 'Etc/GMT-3'.
+
+	:param con: sqlite3 connection <object>.
+	:return: void function.
+	"""
+	rows = []
+	for region_id, country, timezone in con.execute("""SELECT id, country, timezone FROM regions"""):
+		offset = float(timezone.strip("UTC+"))
+		rows.append((TZ_NAMES.get((country, offset)) or fixed_zone(offset), region_id))
+	con.executemany("""UPDATE regions SET tz_name = ? WHERE id = ?""", rows)
+
+def backfill_pages(con):
+	"""
+	Build region pages from regions and graph rows, so that every region has
+	a page before its next forecast. Regions without graph data get a page
+	with an empty graph.
+
+	:param con: sqlite3 connection <object>.
+	:return: void function.
+	"""
+	columns = ", ".join(["temp_{}".format(x) for x in range(1, 11)] +
+						["date_{}".format(x) for x in range(1, 11)])
+	rows = []
+	for region_id, name_RU, heating_date_RU, last_date, saved, *graph in con.execute(
+			"""SELECT regions.id, name_RU, heating_date_RU, last_date, graph.datetime, {}
+			FROM regions LEFT JOIN graph ON graph.region_id = regions.id""".format(columns)):
+		rows.append((region_id,) +
+					page_payload(name_RU, heating_date_RU, last_date, graph_points(graph)) +
+					(saved,))
+	con.executemany("""INSERT OR REPLACE INTO pages(region_id, title, message, region_title, x, y, datetime)
+		VALUES(?, ?, ?, ?, ?, ?, ?)""", rows)
+
+# (version, description, steps): steps are SQL strings or functions of connection
+MIGRATIONS = [
+	(1, "region page payloads, built for all regions", [
+		"""CREATE TABLE IF NOT EXISTS pages (
+			`region_id`	INTEGER NOT NULL PRIMARY KEY,
+			`title`	TEXT,
+			`message`	TEXT,
+			`region_title`	TEXT,
+			`x`	TEXT,
+			`y`	TEXT,
+			`datetime`	TEXT)""",
+		backfill_pages]),
+	(2, "indexes for history and region lookups", [
+		# covers last history rows per region: WHERE region_id ORDER BY id, reads date, temp
+		"""CREATE INDEX IF NOT EXISTS history_region_id ON history(region_id, id, date, temp)""",
+		"""CREATE INDEX IF NOT EXISTS regions_name ON regions(name)""",
+		"""CREATE INDEX IF NOT EXISTS regions_latin ON regions(latin)"""]),
+	(3, "long-format forecast series of any horizon", [
+		"""CREATE TABLE IF NOT EXISTS forecast_series (
+			`region_id`	INTEGER NOT NULL,
+			`date`	TEXT NOT NULL,
+			`temp`	REAL,
+			`kind`	TEXT NOT NULL,
+			PRIMARY KEY(`region_id`, `date`)) WITHOUT ROWID""",
+		backfill_forecast_series]),
+	(4, "running aggregates of today table", [
+		"""ALTER TABLE today ADD COLUMN `temp_sum` REAL DEFAULT 0""",
+		"""ALTER TABLE today ADD COLUMN `temp_count` INTEGER DEFAULT 0""",
+		"""ALTER TABLE today ADD COLUMN `temp_min` REAL DEFAULT NULL""",
+		"""ALTER TABLE today ADD COLUMN `temp_max` REAL DEFAULT NULL""",
+		backfill_today_aggregates]),
+	(5, "stage histograms of last forecast run", [
+		"""CREATE TABLE IF NOT EXISTS run_metrics (
+			`name`	TEXT NOT NULL,
+			`labels`	TEXT NOT NULL,
+			`kind`	TEXT NOT NULL,
+			`buckets`	TEXT,
+			`counts`	TEXT,
+			`sum`	REAL,
+			`count`	INTEGER,
+			PRIMARY KEY(`name`, `labels`)) WITHOUT ROWID"""]),
+	(6, "retry ledger of failed API calls", [
+		"""CREATE TABLE IF NOT EXISTS retry_ledger (
+			`region_id`	INTEGER NOT NULL PRIMARY KEY,
+			`failures`	INTEGER NOT NULL DEFAULT 0,
+			`last_error`	TEXT,
+			`next_attempt`	TEXT,
+			`datetime`	TEXT)"""]),
+	(7, "IANA timezone names of regions", [
+		"""ALTER TABLE regions ADD COLUMN `tz_name` TEXT DEFAULT NULL""",
+		backfill_tz_names]),
+]
+
+def schema_version(db):
+	"""
+	Read applied schema version.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:return: version <int>.
+	"""
+	return db.query("""PRAGMA user_version""")[0][0]
+
+def migrate(db, target=None):
+	"""
+	Apply pending migrations, each one in its own transaction.
+	Safe to call from several processes: version is re-read under write lock.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:param target: version to migrate to <int>, latest by default.
+	:return: applied versions <list>.
+	"""
+	con = db.connection()
+	applied = []
+	for version, description, steps in MIGRATIONS:
+		if target is not None and version > target:
+			break
+		if schema_version(db) >= version:
+			continue
+		con.execute("""BEGIN IMMEDIATE""")
+		try:
+			# another process could have applied it meanwhile
+			if con.execute("""PRAGMA user_version""").fetchone()[0] >= version:
+				con.rollback()
+				continue
+			for step in steps:
+				if callable(step):
+					step(con)
+				else:
+					con.execute(step)
+			con.execute("""PRAGMA user_version = {}""".format(version))
+			con.commit()
+		except BaseException:
+			con.rollback()
+			raise
+		applied.append(version)
+		log.info('migration %s applied: %s', version, description)
+	return applied
+
+def main():
+	parser = argparse.ArgumentParser(description="Apply schema migrations to weather database.")
+	parser.add_argument('--database', default='weather.db')
+	parser.add_argument('--target', type=int, help="migrate up to this version")
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO, format='%(message)s')
+	db = DatabaseQueries(args.database)
+	migrate(db, args.target)
+	print('schema version {} at {}'.format(schema_version(db), datetime.datetime.now()))
+	db.close()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,197 @@
+"""
+Bulk import of new cities into regions table, with their empty today and
+graph rows and a region page without graph. Cities come from CSV (with header) or JSON (list of objects)
+with fields name, latin, country, woeid, lat, lon and optional name_RU
+(locative case, generated if missing). Cities already in the database
+(same woeid) are skipped, so the import can be re-run.
+
+	$ python onboarding.py cities.csv --database weather.db
+"""
+import argparse
+import csv
+import datetime
+import json
+import re
+
+import pytz
+
+from data_version import bump_version
+from database_queries import DatabaseQueries
+from forecast_functions import page_payload
+from migrations import migrate
+from time_functions import dt_to_string
+from timezone_functions import find_timezones
+
+# locative case of names, that the rules below get wrong
+LOCATIVE_EXCEPTIONS = {'Орёл': 'Орле',
+					   'Орел': 'Орле',
+					   'Тверь': 'Твери',
+					   'Пермь': 'Перми',
+					   'Сочи': 'Сочи'}
+
+# (ending, replacement) of adjective parts: Нижний Новгород -> Нижнем Новгороде,
+# soft and hushing stems first: Нижний -> Нижнем, Горячий -> Горячем
+ADJECTIVE_ENDINGS = [('ний', 'нем'), ('няя', 'ней'), ('нее', 'нем'), ('ние', 'них'),
+					 ('чий', 'чем'), ('жий', 'жем'), ('ший', 'шем'), ('щий', 'щем'),
+					 ('ий', 'ом'), ('ый', 'ом'), ('ой', 'ом'), ('ая', 'ой'),
+					 ('ое', 'ом'), ('ые', 'ых'), ('ие', 'их')]
+
+# possessive first words: Сергиев Посад -> Сергиевом Посаде
+POSSESSIVE_ENDINGS = ('ов', 'ев', 'ин')
+
+# (ending, replacement) of nouns, first match wins
+NOUN_ENDINGS = [('ия', 'ии'), ('ья', 'ье'), ('а', 'е'), ('я', 'е'),
+				('ай', 'ае'), ('ей', 'ее'), ('ой', 'ое'), ('ль', 'ле'), ('рь', 'ре'), ('ь', 'и'),
+				('жи', 'жах'), ('ши', 'шах'), ('чи', 'чах'), ('щи', 'щах'),
+				('ки', 'ках'), ('ги', 'гах'), ('хи', 'хах'), ('и', 'ях'), ('ы', 'ах')]
+
+# names ending with these vowels don't change: Ровно, Актобе, Кокшетау, Улан-Удэ
+INDECLINABLE = 'оеёуюэи'
+
+def _inflect_adjective(word, last=False):
+	for ending, replacement in ADJECTIVE_ENDINGS:
+		# nouns end with -ой too: Новый Уренгой
+		if last and ending == 'ой':
+			continue
+		if word.endswith(ending) and len(word) > 4:
+			return word[:-len(ending)] + replacement
+	return None
+
+def _inflect_noun(word):
+	for ending, replacement in NOUN_ENDINGS:
+		if word.endswith(ending):
+			return word[:-len(ending)] + replacement
+	if word[-1] in INDECLINABLE:
+		return word
+	# consonant: Абакан -> Абакане
+	return word + 'е'
+
+def locative(name):
+	"""
+	Guess Russian locative case of city name for 'в ...' phrases:
+	'Москва' -> 'Москве', 'Нижний Новгород' -> 'Нижнем Новгороде',
+	'Ростов-на-Дону' -> 'Ростове-на-Дону'. Check unusual names by hand.
+
+	:param name: city name in Russian <string>.
+	:return: name in locative case <string>.
+	"""
+	if name in LOCATIVE_EXCEPTIONS:
+		return LOCATIVE_EXCEPTIONS[name]
+
+	# Ростов-на-Дону, Франкфурт-на-Майне: only the first word changes
+	match = re.match(r'(.+?)(-на-.+)$', name)
+	if match:
+		return locative(match.group(1)) + match.group(2)
+
+	words = name.split(' ')
+	if len(words) > 1:
+		# Великий Новгород, Кривой Рог, Набережные Челны
+		*first, last = words
+		return ' '.join([x + 'ом' if x.endswith(POSSESSIVE_ENDINGS) else _inflect_adjective(x) or
+						 locative(x) for x in first] + [locative(last)])
+
+	parts = name.split('-')
+	if len(parts) > 1:
+		# Петропавловск-Камчатский: both change, Горно-Алтайск, Йошкар-Ола: the last one
+		adjective = _inflect_adjective(parts[-1], last=True)
+		if adjective:
+			return '-'.join(parts[:-2] + [_inflect_noun(parts[-2]), adjective])
+		return '-'.join(parts[:-1] + [_inflect_noun(parts[-1])])
+
+	# Грозный, Хмельницкий
+	return _inflect_adjective(name, last=True) or _inflect_noun(name)
+
+def utc_offset(timezone, date=None):
+	"""
+	Standard (winter) offset of timezone in the format of regions table.
+
+	:param timezone: timezone in format 'Europe/Paris' <string>.
+	:param date: date of offset <datetime.datetime>, January 1 of this year by default.
+	:return: offset like 'UTC+3' or 'UTC-5' <string>.
+	"""
+	tz = pytz.timezone(timezone)
+	date = date or datetime.datetime(datetime.date.today().year, 1, 1)
+	hours = (tz.utcoffset(date) - tz.dst(date)).total_seconds() / 3600
+	return 'UTC{:+g}'.format(hours)
+
+def read_cities(path):
+	"""
+	Read cities from CSV or JSON file.
+
+	:param path: file path, .json for JSON and CSV otherwise <string>.
+	:return: cities <list> of dictionaries.
+	"""
+	with open(path, encoding='utf-8', newline='') as file:
+		if path.lower().endswith('.json'):
+			return json.load(file)
+		return list(csv.DictReader(file))
+
+def onboard(db, cities):
+	"""
+	Insert new cities with today, graph and page rows in one transaction.
+	Region ids continue the existing ones, as forecast.py iterates over 1..COUNT.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:param cities: dictionaries with keys name, latin, country, woeid, lat, lon
+	and optional name_RU <list>.
+	:return: tuple (number of inserted cities <int>, cities without timezone <list>).
+	"""
+	known = {woeid for woeid, in db.query("""SELECT woeid FROM regions""")}
+	new = {}
+	for city in cities:
+		woeid = int(city['woeid'])
+		if woeid not in known and woeid not in new:
+			new[woeid] = city
+	cities = list(new.values())
+
+	timezones = find_timezones([(float(x['lat']), float(x['lon'])) for x in cities])
+	offsets = {}
+	rows, missing = [], []
+	for city, timezone in zip(cities, timezones):
+		if not timezone:
+			missing.append(city)
+			continue
+		if timezone not in offsets:
+			offsets[timezone] = utc_offset(timezone)
+		rows.append((city, timezone, offsets[timezone]))
+
+	next_id = (db.query("""SELECT MAX(id) FROM regions""")[0][0] or 0) + 1
+	saved = dt_to_string(datetime.datetime.now())
+	with db.batch():
+		for region_id, (city, tz_name, timezone) in enumerate(rows, next_id):
+			name_RU = city.get('name_RU') or locative(city['name'])
+			db.insert(table='regions',
+					  destinations=['id', 'name', 'name_RU', 'latin', 'country', 'woeid',
+									'timezone', 'tz_name', 'last_date'],
+					  data=(region_id, city['name'], name_RU,
+							city['latin'], city.get('country'), int(city['woeid']), timezone,
+							tz_name, 0))
+			db.insert(table='today', destinations=['region_id'], data=(region_id,))
+			db.insert(table='graph', destinations=['region_id'], data=(region_id,))
+			# page links work before the first forecast, graph comes with it
+			db.insert(table='pages',
+					  destinations=['region_id', 'title', 'message', 'region_title',
+									'x', 'y', 'datetime'],
+					  data=(region_id,) + page_payload(name_RU, None, 0, {}) + (saved,))
+	return len(rows), missing
+
+def main():
+	parser = argparse.ArgumentParser(description="Import new cities into weather database.")
+	parser.add_argument('cities', help="CSV or JSON file of cities")
+	parser.add_argument('--database', default='weather.db')
+	args = parser.parse_args()
+
+	db = DatabaseQueries(args.database)
+	migrate(db)
+	inserted, missing = onboard(db, read_cities(args.cities))
+	for city in missing:
+		print('no timezone for {} ({}, {}), skipped'.format(city['name'], city['lat'], city['lon']))
+	if inserted:
+		# new regions appear on web pages
+		bump_version()
+	print('{} cities imported at {}'.format(inserted, datetime.datetime.now()))
+	db.close()
+
+
+if __name__ == "__main__":
+	main()
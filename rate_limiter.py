@@ -0,0 +1,112 @@
+import multiprocessing
+import threading
+import time
+
+# OpenWeatherMap API calls per minute for each subscription plan
+PLAN_TIERS = {'free': 60,
+			  'startup': 600,
+			  'developer': 3000,
+			  'professional': 30000,
+			  'enterprise': 200000}
+
+# refill is computed in floats, tokens may fall short of a whole one by rounding
+TOLERANCE = 1e-9
+
+class TokenBucket:
+	"""
+	Thread-safe token bucket rate limiter. Initializes with rate in tokens
+	per second and bucket capacity (burst size).
+	"""
+	def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+		self.rate = rate
+		self.capacity = capacity
+		self._clock = clock
+		self._sleep = sleep
+		self._tokens = capacity
+		self._updated = clock()
+		self._lock = threading.Lock()
+
+	@classmethod
+	def for_plan(cls, plan, share=1):
+		"""
+		Create limiter for OpenWeatherMap plan tier.
+		A minute window sees at most capacity + 60 * rate calls: the burst
+		(one second worth of calls) plus refill. The rate is lowered by the
+		burst, so that no sliding minute window sees more calls than the plan
+		allows, at the cost of capacity calls per minute of throughput.
+
+		:param plan: plan name from PLAN_TIERS <string>.
+		:param share: part of the plan quota for this limiter, e.g. 1/N for one of N hosts <float>.
+		:return: instance of TokenBucket class <object>.
+		"""
+		quota = PLAN_TIERS[plan] * share
+		capacity = max(1, int(quota / 60))
+		if quota <= capacity:
+			raise ValueError("share {} of plan {} is less than two calls per minute".format(share, plan))
+		return cls((quota - capacity) / 60, capacity=capacity)
+
+	def _refill(self):
+		now = self._clock()
+		self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+		self._updated = now
+
+	def try_acquire(self, tokens=1):
+		"""
+		Take tokens if available without waiting.
+
+		:param tokens: number of tokens <int>.
+		:return: True if tokens were taken, False otherwise.
+		"""
+		with self._lock:
+			self._refill()
+			if self._tokens + TOLERANCE >= tokens:
+				self._tokens -= tokens
+				return True
+			return False
+
+	def acquire(self, tokens=1):
+		"""
+		Take tokens, block until they are available.
+
+		:param tokens: number of tokens <int>.
+		:return: void function.
+		"""
+		while True:
+			with self._lock:
+				self._refill()
+				if self._tokens + TOLERANCE >= tokens:
+					self._tokens -= tokens
+					return
+				# time until enough tokens are refilled
+				wait = (tokens - self._tokens) / self.rate
+			self._sleep(wait)
+
+
+class SharedTokenBucket(TokenBucket):
+	"""
+	Token bucket shared by processes: tokens live in shared memory behind
+	a process lock, so that all workers of a process pool draw from one quota.
+	Hand it to workers when they start (e.g. initializer arguments of a pool),
+	it can't be sent along with tasks.
+	"""
+	def __init__(self, rate, capacity=1):
+		# tokens and time of last refill, monotonic clock is system-wide
+		self._state = multiprocessing.RawArray('d', 2)
+		super().__init__(rate, capacity)
+		self._lock = multiprocessing.Lock()
+
+	@property
+	def _tokens(self):
+		return self._state[0]
+
+	@_tokens.setter
+	def _tokens(self, value):
+		self._state[0] = value
+
+	@property
+	def _updated(self):
+		return self._state[1]
+
+	@_updated.setter
+	def _updated(self, value):
+		self._state[1] = value
@@ -1,34 +1,148 @@
 import sqlite3
 from time_functions import to_datetime
 
+# three-hour slots of today table: hour_0 ... hour_21
+TODAY_HOURS = range(0, 24, 3)
+TODAY_COLUMNS = ['hour_{}'.format(x) for x in TODAY_HOURS] + ['temp_sum', 'temp_count', 'temp_min', 'temp_max']
+
 class Region:
-	def __init__(self, database, region_id):
+	def __init__(self, database, region_id, basic=None, historical=None, today=None):
 		self.database = database
 		self.id = region_id
-		self.woeid, self.timezone, self.last_date = self._query_basic()
-		self.historical = self._query_historical()
+		# prefetched data skips per-region queries, see Region.prefetch
+		# timezone is hour offset, tz_name is IANA timezone like 'Europe/Moscow'
+		(self.woeid, self.timezone, self.last_date,
+		 self.name, self.name_RU, self.heating_date_RU, self.tz_name) = basic or self._query_basic()
+		self.historical = historical if historical is not None else self._query_historical()
+		# observed slots and running aggregates of today table
+		(self.today_hours, self.today_sum, self.today_count,
+		 self.today_min, self.today_max) = _parse_today(today or self._query_today())
 		self.current_temp = None
 		self.current_hour = None
 		self.today_forecast = None
 		self.forecast = None
 		self.heating_date = None
 
+	@classmethod
+	def prefetch(cls, db, region_ids):
+		"""
+		Populate Region instances for many regions with two set-based queries.
+
+		:param db: instance of DatabaseQueries class <object>.
+		:param region_ids: region ids <list>.
+		:return: dictionary with key=region id <int> and value=Region <object>.
+		"""
+		wanted = set(region_ids)
+
+		basic = {}
+		for region_id, woeid, timezone, *rest in db.query(
+				"""SELECT id, woeid, timezone, last_date, name, name_RU, heating_date_RU, tz_name
+				FROM regions"""):
+			if region_id in wanted:
+				basic[region_id] = (woeid, _parse_timezone(timezone), *rest)
+
+		# last five history rows per region, oldest first
+		historical = {region_id: {} for region_id in basic}
+		for region_id, date, temp in db.query("""SELECT region_id, date, temp FROM (
+			SELECT region_id, date, temp, ROW_NUMBER() OVER (
+				PARTITION BY region_id ORDER BY id DESC) AS row_number FROM history)
+			WHERE row_number <= 5 ORDER BY region_id, date ASC"""):
+			if region_id in historical:
+				historical[region_id][to_datetime(date, time=False)] = temp
+
+		today = {}
+		for region_id, *row in db.query("""SELECT region_id, {} FROM today""".format(
+				", ".join(TODAY_COLUMNS))):
+			if region_id in basic:
+				today[region_id] = row
+
+		return {region_id: cls(db.database, region_id, basic[region_id], historical[region_id],
+							   today.get(region_id, [None] * len(TODAY_COLUMNS)))
+				for region_id in region_ids if region_id in basic}
+
+	def observe(self, hour, temp):
+		"""
+		Save temperature of a three-hour slot to today aggregates in O(1).
+		A slot observed again replaces its previous value.
+
+		:param hour: slot hour (0, 21, 3) <int>.
+		:param temp: temperature <float>.
+		:return: void function.
+		"""
+		previous = self.today_hours.get(hour)
+		self.today_hours[hour] = temp
+		if previous is None:
+			self.today_sum += temp
+			self.today_count += 1
+		else:
+			self.today_sum += temp - previous
+		if previous is None or previous not in (self.today_min, self.today_max):
+			self.today_min = temp if self.today_min is None else min(self.today_min, temp)
+			self.today_max = temp if self.today_max is None else max(self.today_max, temp)
+		else:
+			# replaced value was an extreme, at most eight slots to look at
+			self.today_min = min(self.today_hours.values())
+			self.today_max = max(self.today_hours.values())
+
+	def reset_today(self):
+		"""
+		Clear today aggregates after the day is rolled into history.
+
+		:return: void function.
+		"""
+		self.today_hours = {}
+		self.today_sum, self.today_count, self.today_min, self.today_max = 0.0, 0, None, None
+
 	def _query_basic(self):
 		con = sqlite3.connect(self.database)
 		db = con.cursor()
 		mytuples = (self.id,)
-		db.execute("""SELECT woeid, timezone, last_date FROM regions WHERE id = ?""", mytuples)
+		db.execute("""SELECT woeid, timezone, last_date, name, name_RU, heating_date_RU, tz_name
+		FROM regions WHERE id = ?""", mytuples)
 		data = db.fetchall()
 		db.close()
-		return data[0][0], int(data[0][1].strip("UTC+")), data[0][2]
+		return (data[0][0], _parse_timezone(data[0][1])) + data[0][2:]
+
+	def _query_today(self):
+		con = sqlite3.connect(self.database)
+		db = con.cursor()
+		mytuples = (self.id,)
+		db.execute("""SELECT {} FROM today WHERE region_id = ?""".format(
+			", ".join(TODAY_COLUMNS)), mytuples)
+		data = db.fetchall()
+		db.close()
+		return data[0] if data else [None] * len(TODAY_COLUMNS)
 
 	def _query_historical(self):
 		# connect to database
 		con = sqlite3.connect(self.database)
 		db = con.cursor()
 		mytuples = (self.id,)
-		db.execute("""SELECT * FROM (SELECT date, temp FROM history WHERE 
+		db.execute("""SELECT * FROM (SELECT date, temp FROM history WHERE
 		region_id = ? ORDER BY id DESC LIMIT 5) ORDER BY date ASC""", mytuples)
 		data = db.fetchall()
 		db.close()
 		return {to_datetime(k, time=False):v for k,v in dict(data).items()}
+
+
+def _parse_timezone(timezone):
+	"""
+	Convert timezone string to hour offset: 'UTC+7' -> 7, 'UTC+5.5' -> 5.5.
+
+	:param timezone: timezone <string>.
+	:return: offset in hours <int> or <float> for fractional offsets.
+	"""
+	offset = float(timezone.strip("UTC+"))
+	return int(offset) if offset.is_integer() else offset
+
+def _parse_today(row):
+	"""
+	Split today table row into observed slots and running aggregates.
+
+	:param row: hour_0 ... hour_21, temp_sum, temp_count, temp_min, temp_max <list>.
+	:return: slots - dictionary with key=hour <int> and value=temperature <float>,
+	sum <float>, count <int>, min <float>, max <float>.
+	"""
+	hours = {hour: temp for hour, temp in zip(TODAY_HOURS, row) if temp is not None}
+	temp_sum, temp_count, temp_min, temp_max = row[len(TODAY_HOURS):]
+	return hours, temp_sum or 0.0, temp_count or 0, temp_min, temp_max
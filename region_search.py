@@ -0,0 +1,63 @@
+"""
+Prefix search over region names for typeahead: sorted arrays of normalized
+keys, looked up with bisect. Whole names (name, latin) match first,
+then names by a later word ('новг' finds Великий Новгород).
+"""
+import bisect
+import re
+
+# word starts inside a name: after space, hyphen or dot
+WORD_START = re.compile(r'[\s\-.]+(?=\w)')
+
+def normalize(text):
+	"""
+	Search key: case folded, ё as е.
+
+	:param text: name or query <string>.
+	:return: key <string>.
+	"""
+	return text.casefold().replace('ё', 'е').strip()
+
+class SearchIndex:
+	"""
+	Immutable index of regions, build a new one when regions change.
+	Initializes with rows (name, name_RU, latin, country).
+	"""
+	def __init__(self, rows):
+		self.rows = list(rows)
+		names, words = [], []
+		for i, row in enumerate(self.rows):
+			# name_RU is in locative case ('Москве'), nobody types it
+			for text in set(normalize(x) for x in (row[0], row[2]) if x):
+				names.append((text, i))
+				for match in WORD_START.finditer(text):
+					words.append((text[match.end():], i))
+		names.sort()
+		words.sort()
+		self._names = [x for x, _ in names]
+		self._name_rows = [x for _, x in names]
+		self._words = [x for x, _ in words]
+		self._word_rows = [x for _, x in words]
+
+	def search(self, query, limit=10):
+		"""
+		Regions with a name starting with query, alphabetical within
+		whole name and later word matches.
+
+		:param query: typed text <string>.
+		:param limit: maximum number of results <int>.
+		:return: rows (name, name_RU, latin, country) <list>.
+		"""
+		query = normalize(query)
+		if not query:
+			return []
+		found = []
+		seen = set()
+		for keys, rows in ((self._names, self._name_rows), (self._words, self._word_rows)):
+			i = bisect.bisect_left(keys, query)
+			while i < len(keys) and len(found) < limit and keys[i].startswith(query):
+				if rows[i] not in seen:
+					seen.add(rows[i])
+					found.append(self.rows[rows[i]])
+				i += 1
+		return found
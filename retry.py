@@ -0,0 +1,210 @@
+"""
+Retry scheduling of API calls: per-key exponential backoff with jitter,
+a circuit breaker for a dead upstream and a queue, that interleaves
+retries with fresh work instead of sleeping on them.
+"""
+import collections
+import heapq
+import itertools
+import logging
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+log = logging.getLogger(__name__)
+
+# responses meaning upstream is in trouble, not the region
+UPSTREAM_ERRORS = (429, 500, 502, 503, 504)
+
+class Backoff:
+	"""
+	Exponential backoff with equal jitter: delay of n-th retry is picked
+	from [d/2, d], where d = base * factor ** (n - 1) capped at cap.
+	"""
+	def __init__(self, base=30, factor=2, cap=600, rng=None):
+		self.base = base
+		self.factor = factor
+		self.cap = cap
+		self.rng = rng or random.Random()
+
+	def delay(self, attempt):
+		"""
+		:param attempt: number of failed attempts so far <int>.
+		:return: seconds to wait before next attempt <float>.
+		"""
+		delay = min(self.cap, self.base * self.factor ** (attempt - 1))
+		return delay / 2 + self.rng.uniform(0, delay / 2)
+
+class CircuitBreaker:
+	"""
+	Stops calls after threshold consecutive upstream failures. After
+	reset_timeout one probe call is let through: success closes the
+	breaker, failure opens it again. Not thread-safe, RetryQueue uses it
+	from the consuming thread only.
+	"""
+	CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+	def __init__(self, threshold=5, reset_timeout=60, clock=time.monotonic):
+		self.threshold = threshold
+		self.reset_timeout = reset_timeout
+		self.clock = clock
+		self.state = self.CLOSED
+		self.failures = 0
+		self.opened = None
+		self.probing = False
+
+	def allow(self):
+		"""
+		Ask for a call.
+
+		:return: 0 if call may go now, otherwise seconds to wait <float>.
+		"""
+		if self.state == self.OPEN:
+			wait = self.opened + self.reset_timeout - self.clock()
+			if wait > 0:
+				return wait
+			self.state, self.probing = self.HALF_OPEN, False
+		if self.state == self.HALF_OPEN:
+			if self.probing:
+				# result of the probe wakes the queue up
+				return self.reset_timeout
+			self.probing = True
+		return 0
+
+	def success(self):
+		self.state, self.failures, self.probing = self.CLOSED, 0, False
+
+	def failure(self):
+		self.failures += 1
+		if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+			if self.state != self.OPEN:
+				log.warning('circuit breaker open after %s failures', self.failures)
+			self.state, self.opened, self.probing = self.OPEN, self.clock(), False
+
+class RetryQueue:
+	"""
+	Runs fetch(url) for submitted keys in a thread pool and yields
+	(key, response) as responses arrive. fetch returns (status, body) with
+	status None if the server couldn't be reached.
+
+	Unreachable server and UPSTREAM_ERRORS are retried here with backoff and
+	count towards the circuit breaker; other responses are yielded and the
+	caller may ask for a retry with retry(key). Retries that are due go before
+	fresh keys, so one failing region never holds up the others and nothing
+	sleeps while there is work to do. A key that is given up is yielded with
+	False: bodies of upstream errors (e.g. an HTML page of a proxy) are not
+	API responses.
+	"""
+	def __init__(self, fetch, workers=8, attempts=4, backoff=None, breaker=None,
+				 deadline=None, clock=time.monotonic, sleep=time.sleep):
+		self.fetch = fetch
+		self.workers = workers
+		self.attempts = attempts
+		self.backoff = backoff or Backoff()
+		self.breaker = breaker or CircuitBreaker(clock=clock)
+		self.clock = clock
+		self.sleep = sleep
+		# monotonic time after which nothing is sent or retried
+		self.deadline = clock() + deadline if deadline else None
+		self._fresh = collections.deque()
+		# (due time, sequence, key, url, attempt)
+		self._delayed = []
+		self._sequence = itertools.count()
+		self._running = {}
+		# key -> (url, attempt) of last call
+		self._last = {}
+		self._executor = None
+
+	def submit(self, key, url):
+		"""
+		Add fresh key to the queue.
+
+		:param key: region id <int>.
+		:param url: url <string>.
+		:return: void function.
+		"""
+		self._fresh.append((key, url, 1))
+
+	def attempt(self, key):
+		"""
+		:param key: region id <int>.
+		:return: number of attempts made for key <int>.
+		"""
+		return self._last[key][1]
+
+	def retry(self, key, upstream=False):
+		"""
+		Schedule another attempt of key after backoff.
+
+		:param key: region id <int>.
+		:param upstream: True if failure is upstream's fault, counts towards circuit breaker <bool>.
+		:return: delay in seconds <float> or None if key is given up.
+		"""
+		url, attempt = self._last[key]
+		if upstream:
+			self.breaker.failure()
+		if attempt >= self.attempts or self._expired():
+			return None
+		delay = self.backoff.delay(attempt)
+		heapq.heappush(self._delayed, (self.clock() + delay, next(self._sequence), key, url, attempt + 1))
+		return delay
+
+	def __iter__(self):
+		self._executor = ThreadPoolExecutor(max_workers=self.workers)
+		try:
+			while self._fresh or self._delayed or self._running:
+				# nothing is sent after deadline, give up on waiting keys
+				if self._expired():
+					for key, url, attempt in self._drain():
+						self._last[key] = (url, attempt - 1)
+						yield key, False
+				wake = self._dispatch()
+				if not self._running:
+					if wake is not None:
+						self.sleep(wake)
+					continue
+				done, _ = wait(list(self._running), timeout=wake, return_when=FIRST_COMPLETED)
+				for future in done:
+					key, url, attempt = self._running.pop(future)
+					status, body = future.result()
+					if status is None or status in UPSTREAM_ERRORS:
+						if self.retry(key, upstream=True) is None:
+							yield key, False
+						continue
+					self.breaker.success()
+					yield key, body
+		finally:
+			for future in self._running:
+				future.cancel()
+			self._executor.shutdown(wait=True)
+
+	def _dispatch(self):
+		"""
+		Send due retries, then fresh keys, keeping at most two calls per worker
+		in flight, so that retries becoming due don't queue behind all fresh work.
+
+		:return: seconds until something else can be sent <float> or None.
+		"""
+		while len(self._running) < 2 * self.workers and not self._expired():
+			now = self.clock()
+			due = self._delayed and self._delayed[0][0] <= now
+			if not due and not self._fresh:
+				return self._delayed[0][0] - now if self._delayed else None
+			wait = self.breaker.allow()
+			if wait:
+				return wait
+			if due:
+				_, _, key, url, attempt = heapq.heappop(self._delayed)
+			else:
+				key, url, attempt = self._fresh.popleft()
+			self._last[key] = (url, attempt)
+			self._running[self._executor.submit(self.fetch, url)] = (key, url, attempt)
+		return None
+
+	def _drain(self):
+		items = [(key, url, attempt) for _, _, key, url, attempt in self._delayed] + list(self._fresh)
+		self._delayed, self._fresh = [], collections.deque()
+		return items
+
+	def _expired(self):
+		return self.deadline is not None and self.clock() >= self.deadline
@@ -0,0 +1,147 @@
+"""
+Multi-process forecast runs: regions are split into shards, each shard is
+downloaded and processed by a worker process, and all writes are funnelled
+to the parent, the only process that writes to SQLite.
+"""
+import multiprocessing
+import queue
+
+from database_queries import DatabaseQueries
+
+# set in worker processes by init_worker
+worker = {}
+
+def shard(region_ids, k, n):
+	"""
+	Region ids of shard k of n. Ids are dealt round-robin, so a region stays
+	in the same shard between runs and every shard gets a similar share.
+
+	:param region_ids: region ids <list>.
+	:param k: shard number, 1 to n <int>.
+	:param n: number of shards <int>.
+	:return: region ids <list>.
+	"""
+	if not 1 <= k <= n:
+		raise ValueError("shard {}/{} doesn't exist".format(k, n))
+	return [x for x in region_ids if (x - 1) % n == k - 1]
+
+def parse_shard(value):
+	"""
+	Parse shard argument like '2/4'.
+
+	:param value: shard argument <string>.
+	:return: tuple (k, n) <tuple>.
+	"""
+	k, _, n = value.partition('/')
+	k, n = int(k), int(n)
+	if not 1 <= k <= n:
+		raise ValueError("shard {} doesn't exist".format(value))
+	return k, n
+
+class WriteRecorder(DatabaseQueries):
+	"""
+	DatabaseQueries of a shard worker. Reads go to the database, writes are
+	recorded and sent to the writer process one unit of work (region) at a time,
+	so that the writer commits complete regions only.
+	"""
+	def __init__(self, database, channel):
+		super().__init__(database)
+		self.channel = channel
+		self._unit = []
+
+	def _write(self, sql, data):
+		self._unit.append(('write', sql, data))
+
+	def _commit(self):
+		# writer process commits
+		pass
+
+	def checkpoint(self):
+		self.send()
+
+	def send(self):
+		"""
+		Send recorded writes to the writer process.
+
+		:return: void function.
+		"""
+		if self._unit:
+			self.channel.put(('unit', self._unit))
+			self._unit = []
+
+class RecordedArchive:
+	"""
+	Archive of a shard worker: responses are sent to the writer process
+	together with the writes of their region.
+	"""
+	def __init__(self, recorder):
+		self.recorder = recorder
+
+	def add(self, region_id, payload):
+		self.recorder._unit.append(('archive', region_id, payload))
+
+def init_worker(database, channel, limiter):
+	worker.update(database=database, channel=channel, limiter=limiter)
+
+def finish_worker(recorder, failed, metric_rows):
+	"""
+	Send last writes and results of worker. Must be the last message of a shard.
+
+	:param recorder: instance of WriteRecorder class <object>.
+	:param failed: ids of failed regions <list>.
+	:param metric_rows: metrics of the worker, see metrics.Registry.rows <list>.
+	:return: void function.
+	"""
+	recorder.send()
+	recorder.channel.put(('done', failed, metric_rows))
+	recorder.close()
+
+def run_shards(db, region_ids, shards, target, args, limiter, archive, registry):
+	"""
+	Run target(shard region ids, *args) in a pool of shards processes and apply
+	their writes in this process, call it inside db.batch(). Workers get database path,
+	write channel and shared limiter in sharding.worker and must end with
+	finish_worker().
+
+	:param db: instance of DatabaseQueries class <object>, the only writer.
+	:param region_ids: region ids <list>.
+	:param shards: number of worker processes <int>.
+	:param target: worker function <function>.
+	:param args: extra arguments of target <tuple>.
+	:param limiter: instance of SharedTokenBucket class <object>.
+	:param archive: instance of ArchiveWriter class <object>.
+	:param registry: instance of metrics.Registry class <object>, gets metrics of workers.
+	:return: ids of failed regions <list>.
+	"""
+	channel = multiprocessing.Queue(maxsize=10000)
+	failed = []
+	# Pool rather than ProcessPoolExecutor, which takes an initializer since Python 3.7
+	with multiprocessing.Pool(shards, initializer=init_worker,
+							  initargs=(db.database, channel, limiter)) as pool:
+		results = [pool.apply_async(target, (shard(region_ids, k, shards),) + tuple(args))
+				   for k in range(1, shards + 1)]
+		done = 0
+		while done < shards:
+			try:
+				message = channel.get(timeout=1)
+			except queue.Empty:
+				# worker died before its last message
+				for result in results:
+					if result.ready() and not result.successful():
+						result.get()
+				continue
+			if message[0] == 'unit':
+				for kind, *item in message[1]:
+					if kind == 'write':
+						db.write(*item)
+					else:
+						archive.add(*item)
+				db.checkpoint()
+			else:
+				_, shard_failed, metric_rows = message
+				failed.extend(shard_failed)
+				registry.merge(metric_rows)
+				done += 1
+		for result in results:
+			result.get()
+	return failed
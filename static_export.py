@@ -0,0 +1,135 @@
+"""
+Static export of the web app: index, every region page and JSON API
+responses are rendered to files, so that a web server can serve them
+without Python and SQLite. Bodies above COMPRESS_MIN_SIZE get a
+precompressed .gz variant next to them.
+
+Every export goes to a new directory and output path is a symlink, that is
+switched to it atomically. Files with unchanged content are hard links to
+the previous export, so they are not rewritten and keep their mtime.
+
+	$ python static_export.py --database weather.db --output site
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import urllib.parse
+
+from http_caching import COMPRESS_MIN_SIZE, gzip_bytes
+
+def quote(name):
+	"""
+	File name of query value: percent-encoded UTF-8, the same as browsers
+	send it, so that the web server can map $arg_region to a file.
+
+	:param name: region name <string>.
+	:return: file name <string>.
+	"""
+	return urllib.parse.quote(name, safe='')
+
+def urls(db):
+	"""
+	Routes to export. Heating rules API takes arbitrary parameters and stays dynamic.
+
+	:param db: instance of DatabaseQueries class <object>.
+	:return: list of tuples (url, file path relative to export directory) <list>.
+	"""
+	exported = [('/', 'index.html'),
+				('/urlforjsonqueries', 'urlforjsonqueries/index.json'),
+				('/urlfortoday', 'urlfortoday/index.json')]
+	for name, in db.query("""SELECT DISTINCT name FROM regions ORDER BY name"""):
+		exported.append(('/region?' + urllib.parse.urlencode({'region': name}),
+						 'region/{}.html'.format(quote(name))))
+	for latin, in db.query("""SELECT latin FROM regions ORDER BY latin"""):
+		query = urllib.parse.urlencode({'region': latin})
+		exported.append(('/urlforjsonqueries?' + query, 'urlforjsonqueries/{}.json'.format(quote(latin))))
+		exported.append(('/urlfortoday?' + query, 'urlfortoday/{}.json'.format(quote(latin))))
+	return exported
+
+def _same(path, body):
+	try:
+		if os.path.getsize(path) != len(body):
+			return False
+		with open(path, 'rb') as file:
+			return file.read() == body
+	except FileNotFoundError:
+		return False
+
+def _write(path, body):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path, 'wb') as file:
+		file.write(body)
+
+def _link(source, path):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	os.link(source, path)
+
+def export(output, database=None):
+	"""
+	Render all exported routes and switch output to the new export.
+	Exports older than the previous one are removed.
+
+	:param output: path of the symlink to export directory <string>.
+	:param database: database path <string>, WEATHER_DB or weather.db by default.
+	:return: tuple (rewritten files <int>, unchanged files <int>).
+	"""
+	if os.path.lexists(output) and not os.path.islink(output):
+		raise ValueError("{} exists and is not a symlink to an export".format(output))
+	if database:
+		# web app opens its database on import
+		os.environ["WEATHER_DB"] = database
+	import application
+
+	output = os.path.abspath(output)
+	parent, base = os.path.split(output)
+	previous = os.path.realpath(output) if os.path.islink(output) else None
+	target = tempfile.mkdtemp(prefix=base + '.export-', dir=parent)
+	# readable by web server
+	os.chmod(target, 0o755)
+
+	client = application.app.test_client()
+	written = unchanged = 0
+	for url, path in urls(application.db):
+		response = client.get(url)
+		if response.status_code != 200:
+			continue
+		body = response.get_data()
+		files = [path] + [path + '.gz'] * (len(body) >= COMPRESS_MIN_SIZE)
+
+		if previous and _same(os.path.join(previous, path), body):
+			for name in files:
+				_link(os.path.join(previous, name), os.path.join(target, name))
+			unchanged += 1
+			continue
+
+		_write(os.path.join(target, path), body)
+		if len(files) > 1:
+			_write(os.path.join(target, files[1]), gzip_bytes(body, 9))
+		written += 1
+
+	# rename of a symlink over another one is atomic
+	link = os.path.join(parent, '.{}.{}'.format(base, os.getpid()))
+	os.symlink(os.path.basename(target), link)
+	os.replace(link, output)
+
+	# previous export may still serve requests in flight
+	for name in os.listdir(parent):
+		path = os.path.join(parent, name)
+		if name.startswith(base + '.export-') and path not in (target, previous) and os.path.isdir(path):
+			shutil.rmtree(path)
+	return written, unchanged
+
+def main():
+	parser = argparse.ArgumentParser(description="Render web pages and JSON API to static files.")
+	parser.add_argument('--database', default=os.environ.get("WEATHER_DB", "weather.db"))
+	parser.add_argument('--output', default='site')
+	args = parser.parse_args()
+
+	written, unchanged = export(args.output, args.database)
+	print('{} files written, {} unchanged, export at {}'.format(
+		written, unchanged, os.path.realpath(args.output)))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,21 @@
+import os
+import shutil
+
+import pytest
+
+from database_queries import DatabaseQueries
+from migrations import migrate
+
+DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'weather.db')
+
+@pytest.fixture
+def db(tmp_path):
+	"""
+	Migrated copy of the project database, the tracked file is never touched.
+	"""
+	path = str(tmp_path / 'weather.db')
+	shutil.copyfile(DATABASE, path)
+	db = DatabaseQueries(path)
+	migrate(db)
+	yield db
+	db.close()
@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+def run_in_thread(function):
+	thread = threading.Thread(target=function)
+	thread.start()
+	thread.join()
+
+def test_released_connections_are_reused(db):
+	opened = len(db._connections)
+	def request():
+		db.query("""SELECT COUNT(*) FROM regions""")
+		db.release()
+	for _ in range(50):
+		run_in_thread(request)
+	assert len(db._connections) <= opened + 1
+
+def test_pool_is_bounded(db):
+	db.pool_size = 2
+	barrier = threading.Barrier(5)
+	def request():
+		db.query("""SELECT COUNT(*) FROM regions""")
+		# all threads hold a connection at once
+		barrier.wait()
+		db.release()
+	threads = [threading.Thread(target=request) for _ in range(5)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	assert len(db._idle) == 2
+	# connection of the fixture thread stays open
+	assert len(db._connections) == 3
+
+def test_thread_keeps_its_connection_until_release(db):
+	con = db.connection()
+	assert db.connection() is con
+	db.release()
+	assert db.connection() is con
+
+def last_date(db, region_id):
+	return db.query("""SELECT last_date FROM regions WHERE id = ?""", (region_id,))[0][0]
+
+def test_batch_keeps_statement_order(db):
+	with db.batch():
+		db.delete(table='retry_ledger', conditions=['region_id'], condition_data=(1,))
+		db.insert(table='retry_ledger', destinations=['region_id', 'failures'], data=(1, 1))
+		db.update(table='retry_ledger', destinations=['failures'], data=(2,),
+				  conditions=['region_id'], condition_data=(1,))
+		db.delete(table='retry_ledger', conditions=['region_id'], condition_data=(2,))
+		db.insert(table='retry_ledger', destinations=['region_id', 'failures'], data=(2, 5))
+		db.delete(table='retry_ledger', conditions=['region_id'], condition_data=(2,))
+	assert db.query("""SELECT region_id, failures FROM retry_ledger ORDER BY region_id""") == [(1, 2)]
+
+def test_reads_see_pending_writes(db):
+	with db.batch():
+		db.update(table='regions', destinations=['last_date'], data=(7,),
+				  conditions=['id'], condition_data=(1,))
+		assert last_date(db, 1) == 7
+
+def test_one_commit_per_batch(db):
+	commits = db.commits
+	with db.batch():
+		for region_id in range(1, 11):
+			db.update(table='regions', destinations=['last_date'], data=(7,),
+					  conditions=['id'], condition_data=(region_id,))
+			db.checkpoint()
+	assert db.commits == commits + 1
+
+def test_commit_every_chunk(db):
+	commits = db.commits
+	with db.batch(chunk_size=3):
+		for region_id in range(1, 11):
+			db.update(table='regions', destinations=['last_date'], data=(7,),
+					  conditions=['id'], condition_data=(region_id,))
+			db.checkpoint()
+	# after regions 3, 6, 9 and at the end
+	assert db.commits == commits + 4
+
+def test_writes_outside_batch_commit_one_by_one(db):
+	commits = db.commits
+	for region_id in range(1, 4):
+		db.update(table='regions', destinations=['last_date'], data=(7,),
+				  conditions=['id'], condition_data=(region_id,))
+	assert db.commits == commits + 3
+
+def test_exception_rolls_back_uncommitted_chunk(db):
+	before = last_date(db, 5)
+	with pytest.raises(RuntimeError):
+		with db.batch(chunk_size=2):
+			for region_id in range(1, 6):
+				db.update(table='regions', destinations=['last_date'], data=(7,),
+						  conditions=['id'], condition_data=(region_id,))
+				db.checkpoint()
+			raise RuntimeError
+	# regions 1 to 4 were committed in full chunks, region 5 was not
+	assert [last_date(db, x) for x in range(1, 5)] == [7] * 4
+	assert last_date(db, 5) == before
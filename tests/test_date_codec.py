@@ -0,0 +1,22 @@
+import datetime
+
+import pytest
+
+import date_codec
+
+def test_parse_date_matches_strptime():
+	for string in ['2019-04-07', '2020-02-29', '2019-12-31']:
+		assert date_codec.parse_date(string) == datetime.datetime.strptime(string, '%Y-%m-%d')
+
+def test_parse_datetime_matches_strptime():
+	for string in ['2019-04-07 21:00:00', '2019-04-07 00:05:09', '2019-12-31 23:59:59']:
+		assert date_codec.parse_datetime(string) == datetime.datetime.strptime(string, '%Y-%m-%d %H:%M:%S')
+
+@pytest.mark.parametrize('string', ['2019-02-30', '2019-04-0x', '2019-13-01'])
+def test_invalid_date_is_rejected(string):
+	with pytest.raises(ValueError):
+		date_codec.parse_date(string)
+
+def test_invalid_datetime_is_rejected():
+	with pytest.raises(ValueError):
+		date_codec.parse_datetime('2019-04-07 24:00:00')
@@ -0,0 +1,56 @@
+import datetime
+import json
+
+import decoder
+from benchmarks.owm_stub import forecast_payload
+
+NOW = datetime.datetime(2019, 4, 7, 20, 2, 13)
+
+def real_layout():
+	# key order and spacing of API responses
+	return json.dumps(forecast_payload(1, NOW), separators=(',', ':')).encode()
+
+def test_undecodable_body_has_no_code():
+	for raw in [b'<html><body>503 Service Unavailable</body></html>', b'[1, 2]',
+				b'{"cod": "200", "list": [{"dt": 1}]}']:
+		data = decoder.decode(raw)
+		assert data.cod is None
+		assert len(data.epochs) == len(data.temps) == 0
+
+def test_scan_agrees_with_parse_on_real_layout():
+	raw = real_layout()
+	fast = decoder.scan(raw)
+	assert fast is not None
+	assert fast == decoder.parse(raw)
+	assert len(fast.epochs) == 40
+
+def test_scan_agrees_with_parse_with_spaces():
+	raw = json.dumps(forecast_payload(2, NOW)).encode()
+	assert decoder.scan(raw) == decoder.parse(raw)
+
+def test_reordered_keys_fall_back_to_parse():
+	payload = forecast_payload(1, NOW)
+	payload['list'] = [{'main': x['main'], 'dt': x['dt']} for x in payload['list']]
+	raw = json.dumps(payload, separators=(',', ':')).encode()
+	assert decoder.scan(raw) is None
+	assert decoder.decode(raw) == decoder.parse(raw)
+	assert list(decoder.decode(raw).epochs) == [x['dt'] for x in payload['list']]
+
+def test_missing_points_fall_back_to_parse():
+	payload = forecast_payload(1, NOW)
+	payload['cnt'] += 1
+	raw = json.dumps(payload, separators=(',', ':')).encode()
+	assert decoder.scan(raw) is None
+	assert len(decoder.decode(raw).epochs) == 40
+
+def test_error_response():
+	raw = b'{"cod":"404","message":"city not found"}'
+	assert decoder.scan(raw) is None
+	data = decoder.decode(raw)
+	assert (data.cod, data.message, len(data.epochs)) == ('404', 'city not found', 0)
+
+def test_empty_response():
+	assert decoder.scan(b'{}') is None
+	data = decoder.decode(b'{}')
+	assert data.cod is None
+	assert len(data.epochs) == len(data.temps) == 0
@@ -0,0 +1,58 @@
+import datetime
+import random
+
+import numpy as np
+import pytest
+
+import backtest
+import forecast_functions as ff
+from heating_rules import RuleIndex
+
+START = datetime.date(2019, 4, 1)
+
+def series(temps, start=START):
+	return {start + datetime.timedelta(x): temp for x, temp in enumerate(temps)}
+
+def live_rule(monkeypatch, data, spring_season, threshold=8, window=5):
+	monkeypatch.setattr(ff, 'spring', lambda date=None: spring_season)
+	return ff.search_heating_date(data, threshold, window)
+
+@pytest.mark.parametrize('spring_season', [True, False])
+def test_days_must_go_in_a_row(monkeypatch, spring_season):
+	warm, cold = 10, 5
+	above, below = (warm, cold) if spring_season else (cold, warm)
+	# five matching days, interrupted after the fourth
+	data = series([above] * 4 + [below] + [above] * 4 + [below])
+	assert live_rule(monkeypatch, data, spring_season) is None
+	data = series([below] + [above] * 5 + [below] * 4)
+	assert live_rule(monkeypatch, data, spring_season) == START + datetime.timedelta(6)
+
+@pytest.mark.parametrize('spring_season', [True, False])
+def test_backtest_and_rule_index_agree_with_live_rule(monkeypatch, spring_season):
+	rng = random.Random(1)
+	for _ in range(500):
+		data = series([round(rng.uniform(0, 16), 1) for _ in range(10)])
+		threshold = rng.choice([6, 8, 10])
+		window = rng.randint(1, 6)
+		expected = live_rule(monkeypatch, data, spring_season, threshold, window)
+		assert backtest.search_window(data, spring_season, threshold, window) == expected
+		row = (1,) + tuple(data.values()) + tuple(date.isoformat() for date in data)
+		assert RuleIndex([row]).heating_date(1, threshold, window, spring_season) == expected
+
+def test_history_backtest_agrees_with_live_rule_per_season(monkeypatch):
+	rng = random.Random(2)
+	rows = []
+	for region_id in range(1, 6):
+		# spring and fall of 2019, fall reaches into 2020
+		for start, days in ((datetime.date(2019, 3, 1), 184), (datetime.date(2019, 9, 1), 182)):
+			data = series([round(rng.uniform(-2, 14), 1) for _ in range(days)], start)
+			rows.extend((region_id, date, temp) for date, temp in data.items())
+	region_ids = np.array([x[0] for x in rows])
+	dates = np.array([x[1] for x in rows], dtype='datetime64[D]')
+	temps = np.array([x[2] for x in rows])
+	result = backtest.heating_dates(region_ids, dates, temps)
+	assert len(result['date']) == 10
+	for region_id, season, date in zip(result['region_id'], result['season'], result['date']):
+		data = {day: temp for i, day, temp in rows if i == region_id and (3 <= day.month <= 8) == (season == 'spring')}
+		expected = live_rule(monkeypatch, data, season == 'spring')
+		assert (None if np.isnat(date) else date.item()) == expected
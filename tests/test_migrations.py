@@ -0,0 +1,41 @@
+import pytest
+
+from migrations import MIGRATIONS, migrate, schema_version
+
+# (query, parameters, index that must be used)
+QUERY_PLANS = [
+	("""SELECT date, temp FROM history WHERE region_id = ? ORDER BY id DESC LIMIT 5""",
+	 (1,), 'history_region_id'),
+	("""SELECT region_id, date, temp FROM (SELECT region_id, date, temp, ROW_NUMBER() OVER (
+		PARTITION BY region_id ORDER BY id DESC) AS row_number FROM history)
+		WHERE row_number <= 5""", (), 'history_region_id'),
+	("""SELECT id, name_RU, heating_date_RU, last_date FROM regions WHERE name = ?""",
+	 ('Москва',), 'regions_name'),
+	("""SELECT title, message, region_title, x, y FROM regions
+		JOIN pages ON pages.region_id = regions.id
+		WHERE regions.name = ? ORDER BY regions.id LIMIT 1""",
+	 ('Москва',), 'regions_name'),
+	("""SELECT title, message, region_title, x, y FROM regions
+		JOIN pages ON pages.region_id = regions.id
+		WHERE regions.name = ? ORDER BY regions.id LIMIT 1""",
+	 ('Москва',), 'INTEGER PRIMARY KEY'),
+	("""SELECT name, name_RU, latin, heating_date, heating_date_RU, last_date
+		FROM regions WHERE latin = ?""", ('Moscow',), 'regions_latin'),
+	("""SELECT date, temp, kind FROM forecast_series WHERE region_id = ? ORDER BY date""",
+	 (1,), 'PRIMARY KEY'),
+]
+
+def test_database_is_at_latest_version(db):
+	assert schema_version(db) == MIGRATIONS[-1][0]
+
+def test_migrate_again_is_noop(db):
+	assert migrate(db) == []
+
+def test_every_region_has_a_page(db):
+	assert db.query("""SELECT COUNT(*) FROM regions
+		LEFT JOIN pages ON pages.region_id = regions.id WHERE pages.region_id IS NULL""") == [(0,)]
+
+@pytest.mark.parametrize('sql, parameters, index', QUERY_PLANS)
+def test_hot_query_uses_index(db, sql, parameters, index):
+	plan = " | ".join(row[-1] for row in db.query("EXPLAIN QUERY PLAN " + sql, parameters))
+	assert index in plan
@@ -0,0 +1,80 @@
+import bisect
+
+import pytest
+
+from rate_limiter import PLAN_TIERS, TokenBucket
+
+class FakeClock:
+	"""
+	Clock that only moves when limiter sleeps or test waits.
+	"""
+	def __init__(self):
+		self.now = 0.0
+
+	def __call__(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.now += seconds
+
+def limiter_for(plan, clock, share=1):
+	bucket = TokenBucket.for_plan(plan, share)
+	return TokenBucket(bucket.rate, bucket.capacity, clock=clock, sleep=clock.sleep)
+
+def max_calls_per_window(times, window=60):
+	"""
+	Largest number of calls in any half-open window [t, t + window).
+	"""
+	return max(bisect.bisect_left(times, t + window) - i for i, t in enumerate(times))
+
+@pytest.mark.parametrize('plan', ['free', 'startup', 'developer'])
+def test_sliding_minute_never_exceeds_plan(plan):
+	clock = FakeClock()
+	limiter = limiter_for(plan, clock)
+	times = []
+	# back to back calls, then idle until the bucket is full again, twice
+	for _ in range(2):
+		for _ in range(3 * PLAN_TIERS[plan]):
+			limiter.acquire()
+			times.append(clock.now)
+		clock.sleep(120)
+	assert max_calls_per_window(times) <= PLAN_TIERS[plan]
+
+def test_share_of_plan():
+	clock = FakeClock()
+	limiter = limiter_for('startup', clock, share=0.25)
+	times = []
+	for _ in range(1000):
+		limiter.acquire()
+		times.append(clock.now)
+	assert max_calls_per_window(times) <= PLAN_TIERS['startup'] * 0.25
+
+def test_full_bucket_allows_burst():
+	clock = FakeClock()
+	limiter = TokenBucket(rate=1, capacity=3, clock=clock, sleep=clock.sleep)
+	assert [limiter.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+def test_refill_is_proportional_to_elapsed_time():
+	clock = FakeClock()
+	limiter = TokenBucket(rate=2, capacity=10, clock=clock, sleep=clock.sleep)
+	while limiter.try_acquire():
+		pass
+	clock.sleep(1.5)
+	assert [limiter.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+def test_refill_stops_at_capacity():
+	clock = FakeClock()
+	limiter = TokenBucket(rate=100, capacity=2, clock=clock, sleep=clock.sleep)
+	clock.sleep(60)
+	assert [limiter.try_acquire() for _ in range(3)] == [True, True, False]
+
+def test_acquire_waits_for_refill():
+	clock = FakeClock()
+	limiter = TokenBucket(rate=4, capacity=1, clock=clock, sleep=clock.sleep)
+	limiter.acquire()
+	limiter.acquire()
+	assert clock.now == pytest.approx(0.25)
+
+def test_too_small_share_is_rejected():
+	with pytest.raises(ValueError):
+		TokenBucket.for_plan('free', share=1 / 60)
@@ -0,0 +1,29 @@
+from region_search import SearchIndex
+
+ROWS = [('Москва', 'Москве', 'Moscow', 'Россия'),
+		('Нижний Новгород', 'Нижнем Новгороде', 'Nizhniy Novgorod', 'Россия'),
+		('Великий Новгород', 'Великом Новгороде', 'Velikiy Novgorod', 'Россия'),
+		('Орёл', 'Орле', 'Orel', 'Россия')]
+
+def names(index, query, limit=10):
+	return [row[0] for row in index.search(query, limit)]
+
+def test_nominative_and_latin_prefixes():
+	index = SearchIndex(ROWS)
+	assert names(index, 'моск') == ['Москва']
+	assert names(index, 'Москва') == ['Москва']
+	assert names(index, 'mosc') == ['Москва']
+
+def test_locative_name_is_not_indexed():
+	assert names(SearchIndex(ROWS), 'москве') == []
+
+def test_case_and_yo_do_not_matter():
+	index = SearchIndex(ROWS)
+	assert names(index, 'ОРЕЛ') == ['Орёл']
+	assert names(index, 'орёл') == ['Орёл']
+
+def test_whole_names_go_before_later_words():
+	index = SearchIndex(ROWS)
+	assert names(index, 'н') == ['Нижний Новгород', 'Великий Новгород']
+	assert sorted(names(index, 'новг')) == ['Великий Новгород', 'Нижний Новгород']
+	assert names(index, 'н', limit=1) == ['Нижний Новгород']
@@ -0,0 +1,139 @@
+import pytest
+
+from retry import Backoff, CircuitBreaker, RetryQueue
+
+class FakeClock:
+	"""
+	Clock that only moves when queue sleeps or test waits.
+	"""
+	def __init__(self):
+		self.now = 0.0
+
+	def __call__(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.now += seconds
+
+class MaxRandom:
+	"""
+	Jitter always picks the longest delay.
+	"""
+	def uniform(self, low, high):
+		return high
+
+class FakeFetch:
+	"""
+	Answers urls with scripted (status, body) responses, the last one repeats.
+	Records (time, url) of every call.
+	"""
+	def __init__(self, clock, script):
+		self.clock = clock
+		self.script = {url: list(responses) for url, responses in script.items()}
+		self.calls = []
+
+	def __call__(self, url):
+		self.calls.append((self.clock(), url))
+		responses = self.script[url]
+		return responses.pop(0) if len(responses) > 1 else responses[0]
+
+OK = (200, b'{"cod":"200"}')
+DOWN = (503, b'<html><body>503 Service Unavailable</body></html>')
+
+def make_queue(clock, script, **options):
+	fetch = FakeFetch(clock, script)
+	options.setdefault('backoff', Backoff(base=10, factor=2, cap=40, rng=MaxRandom()))
+	options.setdefault('breaker', CircuitBreaker(threshold=100, clock=clock))
+	queue = RetryQueue(fetch, workers=1, clock=clock, sleep=clock.sleep, **options)
+	for key, url in enumerate(sorted(script)):
+		queue.submit(key, url)
+	return queue, fetch
+
+def test_backoff_doubles_up_to_cap():
+	backoff = Backoff(base=10, factor=2, cap=40, rng=MaxRandom())
+	assert [backoff.delay(x) for x in range(1, 6)] == [10, 20, 40, 40, 40]
+
+def test_jitter_stays_within_half_of_delay():
+	backoff = Backoff(base=10, factor=2, cap=600)
+	for attempt in range(1, 8):
+		delay = min(600, 10 * 2 ** (attempt - 1))
+		assert delay / 2 <= backoff.delay(attempt) <= delay
+
+def test_retries_follow_backoff_and_do_not_hold_up_others():
+	clock = FakeClock()
+	queue, fetch = make_queue(clock, {'a': [DOWN, DOWN, OK], 'b': [OK]})
+	assert list(queue) == [(1, OK[1]), (0, OK[1])]
+	assert [(time, url) for time, url in fetch.calls if url == 'a'] == [(0, 'a'), (10, 'a'), (30, 'a')]
+	assert queue.attempt(0) == 3
+
+def test_upstream_error_is_given_up_without_its_body():
+	clock = FakeClock()
+	queue, fetch = make_queue(clock, {'a': [DOWN]}, attempts=3)
+	assert list(queue) == [(0, False)]
+	assert len(fetch.calls) == 3
+
+def test_unreachable_server_is_given_up():
+	clock = FakeClock()
+	queue, _ = make_queue(clock, {'a': [(None, b'')]}, attempts=2)
+	assert list(queue) == [(0, False)]
+
+def test_caller_retry_of_other_responses():
+	clock = FakeClock()
+	queue, fetch = make_queue(clock, {'a': [(404, b'{"cod":"404"}'), OK]})
+	results = []
+	for key, body in queue:
+		results.append(body)
+		if body != OK[1]:
+			assert queue.retry(key) == 10
+	assert results == [b'{"cod":"404"}', OK[1]]
+	assert [time for time, _ in fetch.calls] == [0, 10]
+
+def test_deadline_drains_waiting_keys():
+	clock = FakeClock()
+	queue, fetch = make_queue(clock, {'a': [DOWN], 'b': [DOWN]}, attempts=10, deadline=25)
+	assert sorted(queue) == [(0, False), (1, False)]
+	# nothing is sent after deadline
+	assert all(time < 25 for time, _ in fetch.calls)
+
+def test_breaker_opens_after_threshold_failures():
+	clock = FakeClock()
+	breaker = CircuitBreaker(threshold=2, reset_timeout=60, clock=clock)
+	breaker.failure()
+	assert breaker.allow() == 0
+	breaker.failure()
+	assert breaker.state == CircuitBreaker.OPEN
+	clock.sleep(20)
+	assert breaker.allow() == pytest.approx(40)
+
+def test_half_open_breaker_lets_one_probe_through():
+	clock = FakeClock()
+	breaker = CircuitBreaker(threshold=1, reset_timeout=60, clock=clock)
+	breaker.failure()
+	clock.sleep(60)
+	assert breaker.allow() == 0
+	assert breaker.state == CircuitBreaker.HALF_OPEN
+	# others wait for result of the probe
+	assert breaker.allow() == 60
+	breaker.success()
+	assert breaker.state == CircuitBreaker.CLOSED
+	assert breaker.allow() == 0
+
+def test_failed_probe_opens_breaker_again():
+	clock = FakeClock()
+	breaker = CircuitBreaker(threshold=3, reset_timeout=60, clock=clock)
+	for _ in range(3):
+		breaker.failure()
+	clock.sleep(60)
+	assert breaker.allow() == 0
+	breaker.failure()
+	assert breaker.state == CircuitBreaker.OPEN
+	assert breaker.allow() == pytest.approx(60)
+
+def test_open_breaker_holds_retries_until_probe():
+	clock = FakeClock()
+	breaker = CircuitBreaker(threshold=1, reset_timeout=60, clock=clock)
+	queue, fetch = make_queue(clock, {'a': [DOWN, OK]}, breaker=breaker)
+	assert list(queue) == [(0, OK[1])]
+	# retry is due after 10 s, but waits for the breaker to let a probe through
+	assert [time for time, _ in fetch.calls] == [0, 60]
+	assert breaker.state == CircuitBreaker.CLOSED
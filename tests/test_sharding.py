@@ -0,0 +1,39 @@
+import pytest
+
+import metrics
+import sharding
+from rate_limiter import SharedTokenBucket
+
+def test_shards_cover_every_region_once():
+	region_ids = list(range(1, 21))
+	shards = [sharding.shard(region_ids, k, 3) for k in range(1, 4)]
+	assert sorted(x for ids in shards for x in ids) == region_ids
+
+def test_parse_shard():
+	assert sharding.parse_shard('2/4') == (2, 4)
+	with pytest.raises(ValueError):
+		sharding.parse_shard('5/4')
+
+class ListArchive(list):
+	def add(self, region_id, payload):
+		self.append((region_id, payload))
+
+def record_regions(region_ids):
+	recorder = sharding.WriteRecorder(sharding.worker['database'], sharding.worker['channel'])
+	for region_id in region_ids:
+		sharding.worker['limiter'].acquire()
+		recorder.write("""UPDATE regions SET last_date = ? WHERE id = ?""", (7, region_id))
+		sharding.RecordedArchive(recorder).add(region_id, b'{}')
+		recorder.checkpoint()
+	sharding.finish_worker(recorder, [x for x in region_ids if x % 5 == 0], [])
+
+def test_workers_writes_are_applied_by_parent(db):
+	region_ids = [x for x, in db.query("""SELECT id FROM regions ORDER BY id LIMIT 12""")]
+	archive = ListArchive()
+	with db.batch():
+		failed = sharding.run_shards(db, region_ids, 3, record_regions, (),
+									 SharedTokenBucket(1000, 100), archive, metrics.Registry())
+	assert sorted(failed) == [x for x in region_ids if x % 5 == 0]
+	assert sorted(x for x, _ in archive) == sorted(region_ids)
+	marks = db.query("""SELECT COUNT(*) FROM regions WHERE last_date = 7""")
+	assert marks == [(len(region_ids),)]
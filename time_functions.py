@@ -1,8 +1,13 @@
 import datetime
 
+import date_codec
+
+# start of unix time, API timestamps are seconds since then in UTC
+EPOCH = datetime.datetime(1970, 1, 1)
+
 def to_datetime(string, date=True, time=True):
 	"""
-	Convert datetime object to string.
+	Convert string timestamp to datetime object.
 	Strip date or time using optional parameters.
 	:param string: timestamp <string>
 	:param date: set to False to strip date.
@@ -10,15 +15,23 @@ def to_datetime(string, date=True, time=True):
 	:return: datetime object <datetime>
 	"""
 	if date and not time:
-		return datetime.datetime.strptime(string, '%Y-%m-%d')
+		return date_codec.parse_date(string)
 	elif time and not date:
-		return datetime.datetime.strptime(string, '%H:%M:%S')
+		return date_codec.parse_time(string)
 	else:
-		return datetime.datetime.strptime(string, '%Y-%m-%d %H:%M:%S')
+		return date_codec.parse_datetime(string)
+
+def from_epoch(seconds):
+	"""
+	Convert unix timestamp to naive UTC datetime object, same as API dt_txt.
+	:param seconds: seconds since 1970-01-01 UTC <int>
+	:return: datetime object <datetime>
+	"""
+	return EPOCH + datetime.timedelta(seconds=seconds)
 
 def dt_to_string(dt, date=True, time=True):
 	"""
-	Convert string timestamp to datetime object.
+	Convert datetime object to string timestamp.
 	Strip date or time using optional parameters.
 	:param dt: datetime object <datetime>
 	:param date: set to False to strip date.
@@ -26,36 +39,19 @@ def dt_to_string(dt, date=True, time=True):
 	:return: timestamp <string>
 	"""
 	if date and not time:
-		return dt.strftime('%Y-%m-%d')
+		return date_codec.format_date(dt)
 	elif time and not date:
-		return dt.strftime('%H:%M:%S')
+		return date_codec.format_time(dt)
 	else:
-		return dt.strftime('%Y-%m-%d %H:%M:%S')
-	
+		return date_codec.format_datetime(dt)
+
 def date_convert_RU(date, short=False):
 	"""
 	Convert date object to string in Russian with month name:
-	'2018-01-06' -> '1 июня'.
+	'2018-06-01' -> '1 июня'.
 
 	:param date: date object <datetime.date>
 	:param short: set to True to get abbreviated month name, use for graph labels.
 	:return: date <string>
 	"""
-	months_ru = ['января', 'февраля', 'марта',
-				 'апреля', 'мая', 'юня', 'июля',
-				 'августа', 'сентября', 'октября',
-				 'ноября', 'декабря']
-
-	months_ru_short = ['янв', 'фев', 'мар',
-				 'апр', 'мая', 'июн', 'июл',
-				 'авг', 'сент', 'окт',
-				 'нояб', 'дек']
-
-	if short:
-		for index, month in enumerate(months_ru_short, 1):
-			if index == date.month:
-				return "{} {}".format(date.day, month)
-	else:
-		for index, month in enumerate(months_ru, 1):
-			if index == date.month:
-				return "{} {}".format(date.day, month)
+	return date_codec.russian_date(date, short)
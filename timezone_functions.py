@@ -1,5 +1,12 @@
+import datetime
+import functools
+import json
+import os
+import numpy
 import pytz
-from tzwhere import tzwhere
+
+# lookups by rounded coordinates are kept here between runs
+TZ_CACHE = os.environ.get("TZ_CACHE", "timezone_cache.json")
 
 def utc_to_local_pytz(utc_dt, timezone):
 	"""
@@ -12,6 +19,174 @@ def utc_to_local_pytz(utc_dt, timezone):
 	local_dt = utc_dt.replace(tzinfo=pytz.utc).astimezone(local_tz)
 	return local_dt
 
+def fixed_zone(hours):
+	"""
+	IANA name of a fixed UTC offset, signs of Etc zones are inverted: 3 -> 'Etc/GMT-3'.
+	:param hours: offset in hours <int>
+	:return: timezone name <string> or None for fractional offsets
+	"""
+	if hours != int(hours) or abs(hours) > 14:
+		return None
+	return 'Etc/GMT{:+d}'.format(-int(hours)) if hours else 'Etc/GMT'
+
+@functools.lru_cache(maxsize=None)
+def offset_table(zone):
+	"""
+	Transition table of timezone: UTC epochs when offset changes and offsets
+	from then on. Built once per zone from tz database of pytz.
+	:param zone: timezone in format 'Europe/Paris' <string> or fixed offset in hours <float>
+	:return: tuple (transitions <numpy.ndarray>, offsets in seconds <numpy.ndarray>)
+	"""
+	if not isinstance(zone, str):
+		return numpy.array([numpy.iinfo('int64').min]), numpy.array([int(zone * 3600)])
+	tz = pytz.timezone(zone)
+	# zones with DST or history of changes, others have a single offset
+	times = getattr(tz, '_utc_transition_times', None)
+	if not times:
+		return offset_table(tz.utcoffset(datetime.datetime(2000, 1, 1)).total_seconds() / 3600)
+	epoch = datetime.datetime(1970, 1, 1)
+	transitions = numpy.array([(x - epoch) // datetime.timedelta(seconds=1) for x in times])
+	offsets = numpy.array([int(info[0].total_seconds()) for info in tz._transition_info])
+	return transitions, offsets
+
+def utc_to_local_many(epochs, zone):
+	"""
+	Convert many UTC timestamps to local time at once, with DST.
+	:param epochs: seconds since 1970-01-01 UTC <array.array> or <list>
+	:param zone: timezone in format 'Europe/Paris' <string> or fixed offset in hours <float>
+	:return: naive datetime objects in local time <list>
+	"""
+	transitions, offsets = offset_table(zone)
+	epochs = numpy.asarray(epochs, dtype='int64')
+	local = epochs + offsets[numpy.searchsorted(transitions, epochs, side='right') - 1]
+	return local.astype('datetime64[s]').tolist()
+
+class TimezoneResolver:
+	"""
+	Timezone by geographic coordinates. Timezone polygons of tzwhere are loaded
+	on first lookup only and indexed with an R-tree, so that a lookup
+	tests the few polygons around the point. Works with Shapely 1.7 and later
+	(2.x needs Python 3.7). Results are cached on disk
+	by coordinates rounded to precision digits (0.01 degree is about 1 km).
+	"""
+	def __init__(self, cache=TZ_CACHE, precision=2):
+		self.path = cache
+		self.precision = precision
+		self._names = None
+		self._polygons = None
+		self._tree = None
+		# id of polygon -> its position, Shapely 1.x trees return polygons
+		self._positions = None
+		self._cache = None
+
+	def _load(self):
+		# heavy imports and shape data are needed on cache misses only
+		from shapely.geometry import Polygon
+		from shapely.strtree import STRtree
+		from tzwhere import tzwhere
+
+		names, polygons = [], []
+		collection = tzwhere.read_tzworld(tzwhere.tzwhere.DEFAULT_POLYGONS)
+		for name, (exterior, interiors) in tzwhere.feature_collection_polygons(collection):
+			names.append(name)
+			polygons.append(Polygon(exterior, interiors))
+		self._names = names
+		self._polygons = polygons
+		self._positions = {id(polygon): i for i, polygon in enumerate(polygons)}
+		self._tree = STRtree(polygons)
+
+	def _load_cache(self):
+		self._cache = {}
+		if self.path and os.path.exists(self.path):
+			with open(self.path) as file:
+				self._cache = json.load(file)
+
+	def save(self):
+		"""
+		Write cache to disk, replacing the file atomically.
+
+		:return: void function.
+		"""
+		if not self.path or self._cache is None:
+			return
+		temporary = self.path + '.tmp'
+		with open(temporary, 'w') as file:
+			json.dump(self._cache, file, sort_keys=True)
+		os.replace(temporary, self.path)
+
+	def key(self, lat, lon):
+		return '{:.{p}f},{:.{p}f}'.format(lat, lon, p=self.precision)
+
+	def search(self, points):
+		"""
+		Look points up in timezone polygons, no cache.
+
+		:param points: list of tuples (latitude, longitude) <list>.
+		:return: timezones in format 'Europe/Paris' or None in the sea <list>.
+		"""
+		from shapely.geometry import Point
+
+		if self._tree is None:
+			self._load()
+		found = [None] * len(points)
+		for i, (lat, lon) in enumerate(points):
+			point = Point(lon, lat)
+			# bounding boxes around the point, Shapely 2 gives positions, 1.x polygons
+			for item in self._tree.query(point):
+				position = self._positions[id(item)] if hasattr(item, 'geom_type') else int(item)
+				if self._polygons[position].contains(point):
+					found[i] = self._names[position]
+					break
+		return found
+
+	def lookup_many(self, points):
+		"""
+		Timezones of many points at once: one index query for all cache misses.
+		Points outside of any polygon (coast, islands) get timezone of
+		coordinates rounded to whole degrees, if there is one.
+
+		:param points: list of tuples (latitude, longitude) <list>.
+		:return: timezones in format 'Europe/Paris' or None <list>.
+		"""
+		if self._cache is None:
+			self._load_cache()
+		keys = [self.key(lat, lon) for lat, lon in points]
+		missing = sorted({key: point for key, point in zip(keys, points)
+						  if key not in self._cache}.items())
+		if missing:
+			found = self.search([point for _, point in missing])
+			# second chance for points that missed all polygons
+			misses = [i for i, timezone in enumerate(found) if timezone is None]
+			retry = self.search([tuple(round(x) for x in missing[i][1]) for i in misses])
+			for i, timezone in zip(misses, retry):
+				found[i] = timezone
+			for (key, _), timezone in zip(missing, found):
+				self._cache[key] = timezone
+			self.save()
+		return [self._cache[key] for key in keys]
+
+	def lookup(self, lat, lon):
+		"""
+		:param lat: latitude <float>.
+		:param lon: longitude <float>.
+		:return: timezone in format 'Europe/Paris' or None <string>.
+		"""
+		return self.lookup_many([(lat, lon)])[0]
+
+# created on first use
+_resolver = None
+
+def resolver():
+	"""
+	Shared TimezoneResolver of this process, shape data is loaded once.
+
+	:return: instance of TimezoneResolver class <object>.
+	"""
+	global _resolver
+	if _resolver is None:
+		_resolver = TimezoneResolver()
+	return _resolver
+
 def find_timezone(lat, lon):
 	"""
 	Search for timezone with geographic coordinates using tzwhere.
@@ -19,8 +194,12 @@ def find_timezone(lat, lon):
 	:param lon: longitude <float>
 	:return: timezone in format 'Europe/Paris' <string>
 	"""
-	tz = tzwhere.tzwhere()
-	timezone = tz.tzNameAt(lat, lon)
-	if not timezone:
-		timezone = tz.tzNameAt(round(lat), round(lon))
-	return timezone
\ No newline at end of file
+	return resolver().lookup(lat, lon)
+
+def find_timezones(points):
+	"""
+	Search for timezones of many coordinates at once, use for batches of new regions.
+	:param points: list of tuples (latitude, longitude) <list>
+	:return: timezones in format 'Europe/Paris' <list>
+	"""
+	return resolver().lookup_many(points)